@@ -0,0 +1,133 @@
+"""
+ASGI entry point, for serving with an event loop instead of sync workers:
+
+    uvicorn asgi:app --host 0.0.0.0 --port 8000 --workers 2
+
+The LLM-backed routes (sentiment on write, insight, update_sentiment,
+generate_prompt, period_summary) run the shared handlers from routes/handlers.py
+on the event loop with AsyncGeminiClient, so a worker waiting on Gemini holds
+a coroutine rather than a thread; their MongoDB calls run on worker threads.
+Every other route is served by the Flask app itself through a WSGI adapter.
+"""
+import time
+from contextlib import asynccontextmanager
+
+from a2wsgi import WSGIMiddleware
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Mount, Route
+
+from app import app as wsgi_app, start_background_workers
+from routes import handlers
+from routes.handlers import run_async, wants_event_stream
+from services import metrics
+from services.ai_services import GeminiError, get_gemini_client
+from services.async_gemini import AsyncGeminiClient
+from services.db_services import get_db
+
+
+async def read_json(request):
+    try:
+        return await request.json()
+    except ValueError:
+        return None
+
+
+def reply(result):
+    """
+    Turns a handler result into a Starlette response.
+    """
+    if not isinstance(result, handlers.SSEReply):
+        body, status = result
+        return JSONResponse(body, status_code=status)
+
+    async def events():
+        yield handlers.sse_event({result.field: result.first})
+        try:
+            async for text in result.chunks:
+                yield handlers.sse_event({result.field: text})
+        except GeminiError as e:
+            yield handlers.sse_error(result.field, e)
+            return
+        yield handlers.sse_event(result.done, event="done")
+
+    return StreamingResponse(events(), media_type='text/event-stream', headers=handlers.SSE_HEADERS)
+
+
+def timed(path, endpoint):
+    """
+    Wraps a native endpoint so it is counted in the request metrics, under
+    the same route template as the equivalent Flask view.
+    """
+    route = path.replace('{', '<').replace('}', '>')
+
+    async def timed_endpoint(request):
+        started = time.perf_counter()
+        status = 500
+        try:
+            response = await endpoint(request)
+            status = response.status_code
+            return response
+        finally:
+            metrics.observe_request(request.method, route, status, time.perf_counter() - started)
+    return timed_endpoint
+
+
+def create_asgi_app(flask_app=None):
+    """
+    Builds the ASGI app around a Flask app (by default the one app.py builds).
+    """
+    flask_app = flask_app or wsgi_app
+    config = flask_app.config
+    llm = AsyncGeminiClient.from_sync_client(get_gemini_client(), max_connections=config['GEMINI_ASYNC_MAX_CONNECTIONS'])
+
+    async def add_journal_entry(request):
+        data = await read_json(request)
+        return reply(await run_async(handlers.add_journal_entry(get_db(), config, request.path_params['username'], data), llm))
+
+    async def journal_insight(request):
+        data = await read_json(request)
+        stream = wants_event_stream(request.query_params, request.headers)
+        return reply(await run_async(handlers.journal_insight(get_db(), config, data, stream), llm))
+
+    async def update_journal_sentiment(request):
+        params = request.path_params
+        return reply(await run_async(handlers.update_journal_sentiment(get_db(), params['username'], params['entry_id']), llm))
+
+    async def generate_journal_prompt(request):
+        return reply(await run_async(handlers.generate_journal_prompt(get_db(), config, request.path_params['username']), llm))
+
+    async def period_summary(request):
+        data = await read_json(request)
+        stream = wants_event_stream(request.query_params, request.headers)
+        return reply(await run_async(
+            handlers.get_period_summary(get_db(), config, request.path_params['username'], data, stream), llm))
+
+    @asynccontextmanager
+    async def lifespan(app):
+        # Runs in each worker process, after any fork
+        start_background_workers(config)
+        yield
+        await llm.aclose()
+
+    native = [
+        # Static paths first: /journal/{username} would match them too
+        ('/journal/insight', journal_insight, 'POST'),
+        ('/journal/update_sentiment/{username}/{entry_id}', update_journal_sentiment, 'PUT'),
+        ('/journal/generate_prompt/{username}', generate_journal_prompt, 'POST'),
+        ('/journal/period_summary/{username}', period_summary, 'POST'),
+        ('/journal/{username}', add_journal_entry, 'POST'),
+    ]
+    routes = [
+        Route(path, timed(path, endpoint) if config['METRICS_ENABLED'] else endpoint, methods=[method])
+        for path, endpoint, method in native
+    ]
+    # Everything else (including GET /journal/{username}) is the Flask app, which times its own requests
+    routes.append(Mount('/', app=WSGIMiddleware(flask_app, workers=config['ASGI_WSGI_THREADS'])))
+    middleware = [Middleware(CORSMiddleware, allow_origins=['*'], allow_methods=['*'], allow_headers=['*'])]
+    return Starlette(routes=routes, middleware=middleware, lifespan=lifespan)
+
+
+app = create_asgi_app()
@@ -0,0 +1,161 @@
+"""
+Concurrent LLM calls one worker process can hold: the Flask app under gunicorn
+(sync and gthread workers) vs. the ASGI app under uvicorn, with every request
+waiting on a slow local Gemini stub.
+
+    python -m benchmarks.bench_async_capacity --concurrency 200 --requests 600 --latency 1.0
+
+Each server runs as a single worker. Requests are POST /journal/insight with a
+distinct text each, so the LLM cache never answers and every request holds an
+upstream call for --latency seconds. Capacity is throughput x stub latency,
+i.e. how many upstream calls were in flight on average. The stub runs in its
+own process so it does not share an interpreter with the load generator.
+"""
+import argparse
+import asyncio
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+
+import httpx
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def server_commands(servers, threads):
+    """
+    Yields (label, port, command) for each single-worker server to measure.
+    """
+    def gunicorn(port, *worker):
+        return [sys.executable, "-m", "gunicorn", "-w", "1", "-b", f"127.0.0.1:{port}", "--timeout", "120",
+                *worker, "app:app"]
+
+    port = free_port()
+    if "sync" in servers:
+        yield "gunicorn sync", port, gunicorn(port, "-k", "sync")
+    if "gthread" in servers:
+        yield f"gunicorn gthread x{threads}", port, gunicorn(port, "-k", "gthread", "--threads", str(threads))
+    if "asgi" in servers:
+        yield "uvicorn asgi", port, [sys.executable, "-m", "uvicorn", "asgi:app", "--host", "127.0.0.1",
+                                     "--port", str(port), "--workers", "1", "--no-access-log", "--log-level", "warning"]
+
+
+def start_stub(port, latency):
+    process = subprocess.Popen([sys.executable, "-m", "benchmarks.gemini_stub", "--port", str(port),
+                                "--latency", str(latency)], cwd=BACKEND_DIR,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + 10
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return process
+        except OSError:
+            time.sleep(0.1)
+    process.terminate()
+    raise RuntimeError("Gemini stub did not start")
+
+
+def wait_until_up(url, process, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"server exited with status {process.returncode}")
+        try:
+            httpx.get(url, timeout=1).raise_for_status()
+            return
+        except httpx.HTTPError:
+            time.sleep(0.2)
+    raise RuntimeError(f"server did not come up at {url}")
+
+
+async def drive(url, concurrency, total, label, timeout):
+    """
+    Sends `total` requests from `concurrency` concurrent senders; returns
+    (latencies in ms, error count, wall seconds).
+    """
+    latencies, errors = [], 0
+    requests = iter(range(total))
+    # Small pools, for the same reason as services.async_gemini.CONNECTIONS_PER_POOL,
+    # so the load generator is not the bottleneck
+    clients = [httpx.AsyncClient(limits=httpx.Limits(max_connections=25, max_keepalive_connections=25),
+                                 timeout=timeout) for _ in range(-(-concurrency // 25))]
+
+    async def sender(client):
+        nonlocal errors
+        for i in requests:
+            start = time.perf_counter()
+            try:
+                response = await client.post(url, json={"text": f"capacity benchmark ({label}) #{i}"})
+                response.raise_for_status()
+            except httpx.HTTPError:
+                errors += 1
+                continue
+            latencies.append((time.perf_counter() - start) * 1000)
+
+    started = time.perf_counter()
+    try:
+        await asyncio.gather(*(sender(clients[n % len(clients)]) for n in range(concurrency)))
+    finally:
+        for client in clients:
+            await client.aclose()
+    return latencies, errors, time.perf_counter() - started
+
+
+def percentile(samples, q):
+    return statistics.quantiles(samples, n=100)[q - 1] if len(samples) > 1 else (samples or [0])[0]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--concurrency', type=int, default=200)
+    parser.add_argument('--requests', type=int, default=600)
+    parser.add_argument('--latency', type=float, default=1.0, help="stub seconds per Gemini call")
+    parser.add_argument('--threads', type=int, default=8, help="threads for the gthread worker")
+    parser.add_argument('--timeout', type=float, default=120.0, help="client timeout per request")
+    parser.add_argument('--servers', default="sync,gthread,asgi",
+                        help="comma-separated subset of sync, gthread and asgi to measure")
+    args = parser.parse_args()
+
+    stub_port = free_port()
+    stub = start_stub(stub_port, args.latency)
+    env = dict(os.environ)
+    env['GEMINI_API_BASE'] = f"http://127.0.0.1:{stub_port}/v1beta"
+    env.setdefault('SENTIMENT_WORKER_THREADS', '0')
+    # This measures the transport, not the quota: the LLM scheduler would cap the rate
+    env.setdefault('LLM_SCHEDULER_ENABLED', 'false')
+    # /journal/insight does not touch MongoDB; do not wait on one that is not running
+    env.setdefault('MONGO_URI', 'mongodb://127.0.0.1:27017/')
+    env.setdefault('MONGO_SERVER_SELECTION_TIMEOUT_MS', '500')
+
+    print(f"{args.requests} requests, {args.concurrency} concurrent, stub latency {args.latency:.2f}s, 1 worker")
+    for label, port, command in server_commands(args.servers.split(','), args.threads):
+        base = f"http://127.0.0.1:{port}"
+        process = subprocess.Popen(command, cwd=BACKEND_DIR, env=env,
+                                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            wait_until_up(base + "/llm_cache/stats", process)
+            latencies, errors, wall = asyncio.run(
+                drive(base + "/journal/insight", args.concurrency, args.requests, label, args.timeout))
+        finally:
+            process.terminate()
+            process.wait()
+
+        throughput = len(latencies) / wall
+        print(f"{label:<20} {throughput:8.1f} req/s   in flight ~{throughput * args.latency:6.1f}   "
+              f"p50 {percentile(latencies, 50):8.0f} ms   p95 {percentile(latencies, 95):8.0f} ms   "
+              f"errors {errors}")
+
+    stub.terminate()
+
+
+if __name__ == '__main__':
+    main()
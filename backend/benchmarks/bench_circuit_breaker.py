@@ -0,0 +1,151 @@
+"""
+Gemini circuit breaker and hedged requests against the fault-injecting local stub.
+
+    python -m benchmarks.bench_circuit_breaker --phase-seconds 6 --threads 8
+    python -m benchmarks.bench_circuit_breaker --only hedging --calls 400
+
+breaker: --threads callers loop on generateContent while the stub goes
+through four phases: healthy, failing (every call HTTP 503), stalled (every
+call slower than the read timeout) and healthy again. It runs once with the
+breaker and once without it, and reports per phase how many calls succeeded,
+failed after waiting out timeouts and retries, or were failed fast by the
+open breaker, with p50/p99 call latency. Without the breaker every caller
+(i.e. every web worker thread) sits through the whole retry budget.
+
+hedging: a healthy stub with a latency tail (--slow-rate of calls take
+--slow-latency), called with hedge=False and hedge=True. Reports p50/p95/p99
+and how many extra upstream requests the hedges cost.
+"""
+import argparse
+import contextlib
+import io
+import statistics
+import threading
+import time
+
+from benchmarks.gemini_stub import start_stub_server
+from services.ai_services import GeminiCircuitOpen, GeminiClient, GeminiError, build_payload
+from services.circuit_breaker import CircuitBreaker
+
+PHASES = (
+    ("healthy", {"error_rate": 0.0, "slow_rate": 0.0}),
+    ("failing", {"error_rate": 1.0, "slow_rate": 0.0}),
+    ("stalled", {"error_rate": 0.0, "slow_rate": 1.0}),
+    ("recovered", {"error_rate": 0.0, "slow_rate": 0.0}),
+)
+
+
+def percentiles(samples):
+    if len(samples) < 2:
+        return (samples or [0.0]) * 3
+    cuts = statistics.quantiles(samples, n=100, method='inclusive')
+    return cuts[49], cuts[94], cuts[98]
+
+
+def make_client(server, breaker=None, hedge=False, read_timeout=1.0):
+    return GeminiClient(api_key="bench", api_base=server.api_base, model="gemini-2.0-flash",
+                        read_timeout=read_timeout, total_deadline=3 * read_timeout, max_retries=2,
+                        backoff_base=0.1, backoff_cap=0.5, pool_maxsize=32, breaker=breaker, hedge=hedge,
+                        hedge_min_delay=0.01)
+
+
+def run_breaker(args):
+    server = start_stub_server(latency=args.latency, slow_latency=2.0)
+    payload = build_payload("How was your day?", temperature=0.7, max_output_tokens=200)
+    print(f"{args.threads} callers, {args.phase_seconds:g}s per phase, read timeout 1s, 2 retries, "
+          f"breaker window 5s")
+    print(f"\n{'breaker':<8} {'phase':<10} {'ok':>6} {'failed':>7} {'fast':>6} {'p50':>8} {'p99':>8}  (s)")
+    for label, breaker in (("off", None), ("on", CircuitBreaker(window=5, min_calls=10, open_seconds=2.0))):
+        client = make_client(server, breaker)
+        for phase, faults in PHASES:
+            for name, value in faults.items():
+                setattr(server, name, value)
+            results = []
+            lock = threading.Lock()
+            deadline = time.monotonic() + args.phase_seconds
+
+            def caller():
+                while time.monotonic() < deadline:
+                    started = time.monotonic()
+                    try:
+                        client.generate(payload, use_cache=False)
+                        outcome = "ok"
+                    except GeminiCircuitOpen:
+                        outcome = "fast"
+                        # A real request handler would return 503 here; do not spin
+                        time.sleep(0.01)
+                    except GeminiError:
+                        outcome = "failed"
+                    with lock:
+                        results.append((outcome, time.monotonic() - started))
+
+            threads = [threading.Thread(target=caller) for _ in range(args.threads)]
+            # Keep the client's retry and breaker log lines out of the table
+            with contextlib.redirect_stdout(io.StringIO()):
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    thread.join()
+            counts = {outcome: sum(1 for o, _ in results if o == outcome) for outcome in ("ok", "failed", "fast")}
+            p50, _, p99 = percentiles([seconds for _, seconds in results])
+            print(f"{label:<8} {phase:<10} {counts['ok']:>6} {counts['failed']:>7} {counts['fast']:>6} "
+                  f"{p50:8.3f} {p99:8.3f}")
+    server.shutdown()
+
+
+def run_hedging(args):
+    server = start_stub_server(latency=args.latency, slow_rate=args.slow_rate, slow_latency=args.slow_latency)
+    print(f"\n{args.calls} calls from {args.threads} threads, stub {args.latency * 1000:.0f} ms, "
+          f"{args.slow_rate:.0%} of calls {args.slow_latency * 1000:.0f} ms")
+    print(f"{'hedge':<6} {'p50':>8} {'p95':>8} {'p99':>8} {'upstream requests':>19}  (ms)")
+    for hedge in (False, True):
+        client = make_client(server, CircuitBreaker(window=60, min_calls=10 ** 9), hedge=hedge, read_timeout=5.0)
+        # Warm up the latency statistics the hedge delay is based on
+        warmup_payload = build_payload("warm up", temperature=0.7, max_output_tokens=200)
+        for _ in range(40):
+            client.generate(warmup_payload, use_cache=False)
+        server.requests = 0
+        samples = []
+        lock = threading.Lock()
+        per_thread = args.calls // args.threads
+
+        def caller(n):
+            for i in range(per_thread):
+                payload = build_payload(f"entry {n}-{i}", temperature=0.7, max_output_tokens=200)
+                started = time.perf_counter()
+                client.generate(payload, use_cache=False, hedge=True)
+                with lock:
+                    samples.append((time.perf_counter() - started) * 1000)
+
+        threads = [threading.Thread(target=caller, args=(n,)) for n in range(args.threads)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        # Requests still running for lost hedges are counted too
+        time.sleep(args.slow_latency)
+        p50, p95, p99 = percentiles(samples)
+        print(f"{'on' if hedge else 'off':<6} {p50:8.1f} {p95:8.1f} {p99:8.1f} "
+              f"{server.requests:>8} ({server.requests / len(samples):.2f}/call)")
+    server.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--only', choices=("breaker", "hedging"))
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--phase-seconds', type=float, default=6.0)
+    parser.add_argument('--latency', type=float, default=0.02, help="normal stub latency in seconds")
+    parser.add_argument('--calls', type=int, default=400, help="calls per hedging mode")
+    parser.add_argument('--slow-rate', type=float, default=0.05)
+    parser.add_argument('--slow-latency', type=float, default=0.5)
+    args = parser.parse_args()
+
+    if args.only != "hedging":
+        run_breaker(args)
+    if args.only != "breaker":
+        run_hedging(args)
+
+
+if __name__ == '__main__':
+    main()
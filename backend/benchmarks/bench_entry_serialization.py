@@ -0,0 +1,99 @@
+"""
+Serialization throughput of the journal listing, dicts + jsonify vs entry_json().
+
+    python -m benchmarks.bench_entry_serialization --entries 10000 --repeat 5
+
+Builds --entries synthetic entries and encodes them to BSON the way MongoDB
+returns them for GET /journal/<username>?all=true. Then times turning those
+bytes into the response body, both starting with bson.decode_all():
+
+- dicts: entry_to_json() into a second dict per entry, then
+  json.dumps(sort_keys=True) (what jsonify did)
+- direct: each entry's JSON written by entry_json()
+
+and checks that both bodies parse to the same list. Also reports the stored
+size per entry with and without the legacy date_display field. Times are the
+best of --repeat runs, per 10k entries.
+"""
+import argparse
+import json
+import random
+import time
+from datetime import datetime, timedelta
+
+import bson
+from bson.objectid import ObjectId
+
+from services.db_services import entry_to_json
+from services.entry_schema import display_date, entry_json
+
+WORDS = ("today", "felt", "calm", "tired", "work", "friends", "walk", "anxious", "grateful", "sleep",
+         "coffee", "rain", "family", "deadline", "happy", "café", "quiet", "long", "day", "better")
+SENTIMENTS = ("positive", "negative", "neutral", "mixed", "pending")
+
+
+def make_entries(count, seed=7):
+    rng = random.Random(seed)
+    started = datetime(2024, 1, 1, 8, 0, 0)
+    entries = []
+    for n in range(count):
+        timestamp = started + timedelta(minutes=37 * n, milliseconds=rng.randrange(1000))
+        entries.append({
+            "_id": ObjectId(),
+            "text": " ".join(rng.choice(WORDS) for _ in range(rng.randint(20, 120))),
+            "sentiment": rng.choice(SENTIMENTS),
+            "timestamp": timestamp,
+        })
+    return entries
+
+
+def dicts_body(buffer):
+    return json.dumps([entry_to_json(entry) for entry in bson.decode_all(buffer)], sort_keys=True)
+
+
+def direct_body(buffer):
+    return "[" + ",".join(entry_json(entry) for entry in bson.decode_all(buffer)) + "]"
+
+
+def best_of(fn, buffer, repeat):
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        body = fn(buffer)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best, body
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--entries', type=int, default=10000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    entries = make_entries(args.entries)
+    # The listing's projection, as it comes off the wire
+    buffer = b"".join(bson.encode(entry) for entry in entries)
+    legacy_bytes = sum(len(bson.encode({**entry, "username": "bench", "sentiment_tier": "llm",
+                                        "date_display": display_date(entry["timestamp"])}))
+                       for entry in entries)
+    compact_bytes = sum(len(bson.encode({**entry, "username": "bench", "sentiment_tier": "llm"}))
+                        for entry in entries)
+
+    print(f"{args.entries} entries, {len(buffer) / 1e6:.1f} MB of BSON, best of {args.repeat}")
+    print(f"stored bytes per entry (without embedding): legacy {legacy_bytes / args.entries:.0f}, "
+          f"compact {compact_bytes / args.entries:.0f} "
+          f"({1 - compact_bytes / legacy_bytes:.1%} smaller)")
+    print(f"\n{'path':<7} {'ms/10k':>9} {'MB/s':>8} {'entries/s':>11}")
+    bodies = {}
+    for label, fn in (("dicts", dicts_body), ("direct", direct_body)):
+        seconds, bodies[label] = best_of(fn, buffer, args.repeat)
+        print(f"{label:<7} {seconds * 1000 * 10000 / args.entries:9.1f} {len(buffer) / seconds / 1e6:8.1f} "
+              f"{args.entries / seconds:11.0f}")
+    if json.loads(bodies["dicts"]) != json.loads(bodies["direct"]):
+        raise SystemExit("The two paths produced different JSON")
+    print("\nBoth paths produce the same entries")
+
+
+if __name__ == '__main__':
+    main()
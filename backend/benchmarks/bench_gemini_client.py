@@ -0,0 +1,70 @@
+"""
+Compares per-call latency of the old bare requests.post pattern (new connection
+every call) with the pooled GeminiClient, against the local Gemini stub.
+
+    python -m benchmarks.bench_gemini_client --calls 500
+
+The stub speaks plain HTTP, so this only measures TCP setup savings; against
+the real HTTPS endpoint each avoided TLS handshake saves considerably more.
+"""
+import argparse
+import statistics
+import time
+
+import requests
+
+from benchmarks.gemini_stub import start_stub_server
+from services.ai_services import GeminiClient, build_payload
+
+
+def time_calls(call, n):
+    samples = []
+    for _ in range(n):
+        start = time.perf_counter()
+        call()
+        samples.append((time.perf_counter() - start) * 1000)
+    return samples
+
+
+def report(label, samples, connections):
+    samples = sorted(samples)
+    p50 = statistics.median(samples)
+    p95 = samples[int(len(samples) * 0.95) - 1]
+    print(f"{label:<22} mean {statistics.mean(samples):7.3f} ms   p50 {p50:7.3f} ms   p95 {p95:7.3f} ms   connections {connections}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--calls', type=int, default=500)
+    parser.add_argument('--latency', type=float, default=0.0, help="simulated upstream latency in seconds")
+    args = parser.parse_args()
+
+    server = start_stub_server(latency=args.latency)
+    payload = build_payload("How was your day?", temperature=0.7, max_output_tokens=200)
+    url = f"{server.api_base}/models/gemini-2.0-flash:generateContent"
+
+    def bare_call():
+        # What every route used to do: a fresh connection per request
+        requests.post(url, json=payload).raise_for_status()
+
+    client = GeminiClient(api_key="bench", api_base=server.api_base, model="gemini-2.0-flash")
+
+    # Warm up both paths so imports and the first pooled connection are not measured
+    bare_call()
+    client.generate(payload)
+
+    server.connections = 0
+    bare = time_calls(bare_call, args.calls)
+    report("bare requests.post", bare, server.connections)
+
+    server.connections = 0
+    pooled = time_calls(lambda: client.generate(payload), args.calls)
+    report("pooled GeminiClient", pooled, server.connections)
+
+    saved = statistics.mean(bare) - statistics.mean(pooled)
+    print(f"saved per call: {saved:.3f} ms ({saved / statistics.mean(bare):.0%})")
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,132 @@
+"""
+Admission latency of the LLM scheduler (services/llm_scheduler.py) under contention.
+
+    python -m benchmarks.bench_llm_scheduler --processes 4 --duration 20 --rpm 600
+
+Simulates several web worker processes sharing one scheduler state file while
+one noisy user sends insight requests back to back from many threads, normal
+users each send one every few seconds, and the sentiment workers classify new
+entries. Admitted calls then "run" for --service-time seconds; no HTTP is
+involved, so only the scheduler is measured. Demand is well above --rpm.
+
+Each mode runs against a fresh state file:
+
+- fifo: one global budget only, every call in arrival order (what a shared
+  rate limiter without users or priorities would do)
+- fair: the scheduler as configured in the app, with per-user buckets,
+  priority classes and round-robin across users
+
+Reports admitted and refused calls and p50/p95/p99 of the time until the
+decision, per kind of caller. With the defaults, fair mode turns the noisy
+user away and nobody else waits; with --rpm below what the normal users and
+sentiment need on their own (e.g. --rpm 240 --duration 30), it also shows
+sentiment going ahead of the queued insight calls.
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import statistics
+import tempfile
+import threading
+import time
+
+from services.llm_scheduler import PRIORITY_INTERACTIVE, PRIORITY_SENTIMENT, LLMScheduler
+
+NOISY_USER = "noisy"
+KINDS = ("sentiment", "normal users", "noisy user")
+
+
+def run_process(mode, path, seed, args):
+    """
+    One simulated worker process. Returns [(kind, seconds waited, refused)].
+    """
+    scheduler = LLMScheduler(path, rpm=args.rpm, tpm=args.rpm * 1000, user_rpm=args.user_rpm,
+                             user_burst=args.user_burst, max_wait=args.max_wait)
+    rng = random.Random(seed)
+    deadline = time.monotonic() + args.duration
+    results = []
+    lock = threading.Lock()
+
+    def call(kind, username, priority):
+        if mode == "fifo":
+            username, priority = None, PRIORITY_INTERACTIVE
+        started = time.monotonic()
+        retry_after = scheduler.admit(username, priority, cost=300)
+        with lock:
+            results.append((kind, time.monotonic() - started, retry_after is not None))
+        if retry_after is None:
+            time.sleep(args.service_time)
+
+    def noisy():
+        while time.monotonic() < deadline:
+            call("noisy user", NOISY_USER, PRIORITY_INTERACTIVE)
+            # A refused client retries at once, but not in a hot loop
+            time.sleep(0.05)
+
+    def normal(username, interval):
+        thread_rng = random.Random(f"{seed}-{username}")
+        while time.monotonic() < deadline:
+            time.sleep(thread_rng.expovariate(1 / interval))
+            call("normal users", username, PRIORITY_INTERACTIVE)
+
+    def sentiment(interval):
+        thread_rng = random.Random(f"{seed}-sentiment")
+        while time.monotonic() < deadline:
+            time.sleep(thread_rng.expovariate(1 / interval))
+            call("sentiment", None, PRIORITY_SENTIMENT)
+
+    per_process = args.users // args.processes
+    threads = [threading.Thread(target=noisy) for _ in range(args.noisy_threads)]
+    threads += [threading.Thread(target=normal, args=(f"user{seed}_{n}", args.user_interval))
+                for n in range(per_process)]
+    threads += [threading.Thread(target=sentiment, args=(args.processes / args.sentiment_rate,))]
+    rng.shuffle(threads)
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def percentiles(samples):
+    if len(samples) < 2:
+        return (samples or [0.0]) * 3
+    cuts = statistics.quantiles(samples, n=100, method='inclusive')
+    return cuts[49], cuts[94], cuts[98]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--processes', type=int, default=4)
+    parser.add_argument('--duration', type=float, default=20.0, help="seconds per mode")
+    parser.add_argument('--rpm', type=int, default=600, help="global requests per minute")
+    parser.add_argument('--user-rpm', type=float, default=10)
+    parser.add_argument('--user-burst', type=int, default=5)
+    parser.add_argument('--max-wait', type=float, default=10.0)
+    parser.add_argument('--users', type=int, default=20, help="normal users, spread over the processes")
+    parser.add_argument('--user-interval', type=float, default=5.0, help="mean seconds between a user's calls")
+    parser.add_argument('--sentiment-rate', type=float, default=3.0, help="sentiment calls per second")
+    parser.add_argument('--noisy-threads', type=int, default=4, help="noisy user's concurrent requests per process")
+    parser.add_argument('--service-time', type=float, default=0.2, help="simulated Gemini latency")
+    parser.add_argument('--modes', default="fifo,fair")
+    args = parser.parse_args()
+
+    print(f"{args.processes} processes, {args.duration:.0f}s per mode, global {args.rpm} rpm, "
+          f"user {args.user_rpm:g} rpm (burst {args.user_burst}), max wait {args.max_wait:g}s")
+    print(f"\n{'mode':<6} {'caller':<14} {'admitted':>9} {'refused':>8} {'p50':>8} {'p95':>8} {'p99':>8}  (s)")
+    for mode in args.modes.split(','):
+        with tempfile.TemporaryDirectory(prefix="mindease-schedbench-") as tmp:
+            path = os.path.join(tmp, "state.db")
+            with multiprocessing.Pool(args.processes) as pool:
+                per_process = pool.starmap(run_process, [(mode, path, n, args) for n in range(args.processes)])
+        results = [result for process_results in per_process for result in process_results]
+        for kind in KINDS:
+            waits = [wait for result_kind, wait, _ in results if result_kind == kind]
+            refused = sum(1 for result_kind, _, was_refused in results if result_kind == kind and was_refused)
+            p50, p95, p99 = percentiles(waits)
+            print(f"{mode:<6} {kind:<14} {len(waits) - refused:>9} {refused:>8} {p50:8.3f} {p95:8.3f} {p99:8.3f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+"""
+Per-request cost of the metrics hooks, in the single-process registry and in
+multi-process mode (PROMETHEUS_MULTIPROC_DIR, as under gunicorn.conf.py).
+
+    python -m benchmarks.bench_metrics_overhead --iterations 100000
+
+Reports the cost of one request observation, one MongoDB command
+(started + succeeded events), and what init_app() adds to each Flask request:
+RequestMetricsMiddleware (timing, status capture and the observation) plus
+RouteRecordingRequest copying the matched route into the environ.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CHILD = r"""
+import json, sys, time
+from types import SimpleNamespace
+from flask import Flask
+from werkzeug.routing import Rule
+from werkzeug.test import EnvironBuilder
+from services import metrics
+
+iterations = int(sys.argv[1])
+
+
+def per_call_us(fn, n):
+    best = float("inf")
+    for _ in range(5):
+        start = time.perf_counter()
+        for _ in range(n):
+            fn()
+        best = min(best, (time.perf_counter() - start) / n)
+    return best * 1e6
+
+
+def observe():
+    metrics.observe_request("GET", "/journal/<username>", 200, 0.001)
+
+
+listener = metrics.MongoCommandMetrics()
+started = SimpleNamespace(command_name="find", command={"find": "journal_entries"}, connection_id=("h", 1), request_id=1)
+succeeded = SimpleNamespace(command_name="find", duration_micros=800, connection_id=("h", 1), request_id=1)
+
+
+def mongo_command():
+    listener.started(started)
+    listener.succeeded(succeeded)
+
+
+def bare_app(environ, start_response):
+    start_response("200 OK", [])
+    return [b"{}"]
+
+
+def start_response(status, headers, exc_info=None):
+    pass
+
+
+# As left by RouteRecordingRequest
+environ = {"REQUEST_METHOD": "GET", metrics.ROUTE_ENVIRON_KEY: "/journal/<username>"}
+timed_app = metrics.RequestMetricsMiddleware(bare_app)
+middleware_us = per_call_us(lambda: timed_app(environ, start_response), iterations) - \
+    per_call_us(lambda: bare_app(environ, start_response), iterations)
+
+
+def set_rule_us(request_class):
+    # Flask sets url_rule once per request, when it matches the route
+    rule = Rule("/journal/<username>", endpoint="entries")
+    request = request_class(EnvironBuilder(path="/journal/alice").get_environ())
+
+    def set_rule():
+        request.url_rule = rule
+    return per_call_us(set_rule, iterations)
+
+
+route_us = set_rule_us(metrics.RouteRecordingRequest) - set_rule_us(Flask.request_class)
+
+with open(sys.argv[2], "w") as f:
+    json.dump({"observe_us": per_call_us(observe, iterations), "mongo_us": per_call_us(mongo_command, iterations),
+               "middleware_us": middleware_us, "route_us": route_us}, f)
+"""
+
+
+def run_mode(iterations, multiprocess):
+    env = dict(os.environ)
+    env.pop('PROMETHEUS_MULTIPROC_DIR', None)
+    with tempfile.TemporaryDirectory() as metrics_dir, tempfile.NamedTemporaryFile(suffix=".json") as result:
+        if multiprocess:
+            env['PROMETHEUS_MULTIPROC_DIR'] = metrics_dir
+        subprocess.run([sys.executable, "-c", CHILD, str(iterations), result.name], cwd=BACKEND_DIR, env=env,
+                       capture_output=True, check=True)
+        with open(result.name) as f:
+            return json.load(f)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--iterations', type=int, default=100000)
+    args = parser.parse_args()
+
+    for label, multiprocess in (("single-process", False), ("multi-process", True)):
+        r = run_mode(args.iterations, multiprocess)
+        print(f"{label:<15} observe_request {r['observe_us']:6.2f} us   mongo command {r['mongo_us']:6.2f} us   "
+              f"request middleware {r['middleware_us']:5.2f} + route recording {r['route_us']:5.2f} us")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,128 @@
+"""
+Journal latency during a login burst, with password hashing inline on the
+request threads vs. on the bounded hashing pool (services/password_hashing.py).
+
+    python -m benchmarks.bench_password_hashing --duration 5 --login-threads 16
+
+For each mode, a few threads read GET /journal/<username> on their own, and
+then again while --login-threads threads send POST /login as fast as they
+can. The app is served in-process against mongomock (pip install mongomock)
+or, with --mongo-uri, a scratch database on a real server. mongomock is not
+thread-safe, so a few journal errors under load are expected with it.
+With the pool, journal p95 should stay close to its idle value and the
+logins that do not fit get 503s instead of queueing; login clients honour
+the Retry-After header as a browser-side retry would.
+"""
+import argparse
+import contextlib
+import os
+import random
+import statistics
+import threading
+import time
+from collections import Counter
+
+import requests
+
+from benchmarks.load_test import PASSWORD, entry_counts, seed, start_server
+
+
+def run_load(base_url, username, duration, journal_threads, login_threads):
+    """
+    Returns (journal latencies in ms, journal errors, Counter of login statuses) over duration seconds.
+    """
+    deadline = time.monotonic() + duration
+    journal_ms, journal_errors, logins = [], 0, Counter()
+    lock = threading.Lock()
+
+    def reader():
+        nonlocal journal_errors
+        session = requests.Session()
+        while time.monotonic() < deadline:
+            start = time.perf_counter()
+            ok = session.get(f"{base_url}/journal/{username}", timeout=60).ok
+            with lock:
+                if ok:
+                    journal_ms.append((time.perf_counter() - start) * 1000)
+                else:
+                    journal_errors += 1
+
+    def login():
+        session = requests.Session()
+        while time.monotonic() < deadline:
+            response = session.post(f"{base_url}/login", json={"username": username, "password": PASSWORD},
+                                    timeout=60)
+            with lock:
+                logins[response.status_code] += 1
+            # Well-behaved clients wait as told instead of retrying in a tight loop
+            time.sleep(min(float(response.headers.get('Retry-After', 0)), max(0.0, deadline - time.monotonic())))
+
+    threads = [threading.Thread(target=reader) for _ in range(journal_threads)]
+    threads += [threading.Thread(target=login) for _ in range(login_threads)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return journal_ms, journal_errors, logins
+
+
+def percentiles(samples):
+    cuts = statistics.quantiles(samples, n=100, method='inclusive')
+    return cuts[49], cuts[94]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--duration', type=float, default=5.0, help="seconds per phase")
+    parser.add_argument('--journal-threads', type=int, default=2)
+    parser.add_argument('--login-threads', type=int, default=16)
+    parser.add_argument('--entries', type=int, default=200, help="entries of the reading user")
+    parser.add_argument('--workers', type=int, default=1, help="hashing processes in pool mode")
+    parser.add_argument('--max-pending', type=int, default=4, help="PASSWORD_HASH_MAX_PENDING in pool mode")
+    parser.add_argument('--mongo-uri', help="use a real MongoDB (database mindease_pwbench, dropped) instead of mongomock")
+    args = parser.parse_args()
+
+    os.environ.setdefault('SENTIMENT_WORKER_THREADS', '0')
+    if args.mongo_uri:
+        os.environ['MONGO_URI'] = args.mongo_uri
+        os.environ['MONGO_DB_NAME'] = 'mindease_pwbench'
+    from app import app
+    from services.db_services import get_db, init_db
+    from services.password_hashing import configure_password_hashing
+
+    if not args.mongo_uri:
+        import mongomock
+        mock_client = mongomock.MongoClient()
+        init_db(app.config, client_factory=lambda config: mock_client)
+    db = get_db()
+    if args.mongo_uri:
+        db.client.drop_database('mindease_pwbench')
+    with contextlib.redirect_stdout(open(os.devnull, "w")):
+        seed(db, entry_counts(1, args.entries, args.entries), random.Random(1))
+    username = "loadtest_user_0"
+
+    base_url, stop_server = start_server("werkzeug", app, 1, {})
+    print(f"{args.journal_threads} journal readers, {args.login_threads} login threads, {args.duration:.0f}s per phase")
+    try:
+        for label, workers in (("inline", 0), (f"pool x{args.workers}", args.workers)):
+            configure_password_hashing({**app.config, 'PASSWORD_HASH_WORKERS': workers,
+                                        'PASSWORD_HASH_MAX_PENDING': args.max_pending})
+            # Starts the pool, so process start-up is not measured
+            requests.post(f"{base_url}/login", json={"username": username, "password": PASSWORD}, timeout=60)
+
+            with contextlib.redirect_stdout(open(os.devnull, "w")):
+                idle, _, _ = run_load(base_url, username, args.duration, args.journal_threads, 0)
+                busy, errors, logins = run_load(base_url, username, args.duration, args.journal_threads, args.login_threads)
+            idle_p50, idle_p95 = percentiles(idle)
+            busy_p50, busy_p95 = percentiles(busy)
+            print(f"{label:<8} journal p50/p95 idle {idle_p50:6.1f}/{idle_p95:6.1f} ms   "
+                  f"during logins {busy_p50:6.1f}/{busy_p95:6.1f} ms   "
+                  f"logins ok {logins[200] / args.duration:5.1f}/s   503 {logins[503]:4}   journal errors {errors}")
+    finally:
+        stop_server()
+        if args.mongo_uri:
+            db.client.drop_database('mindease_pwbench')
+
+
+if __name__ == '__main__':
+    main()
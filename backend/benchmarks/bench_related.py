@@ -0,0 +1,92 @@
+"""
+Related-entry lookups (services/embeddings.py) for one user with a large journal.
+
+    python -m benchmarks.bench_related --entries 2000 10000
+    python -m benchmarks.bench_related --mongo-uri mongodb://127.0.0.1:27017/ --entries 100000
+
+Data is served from mongomock (pip install mongomock) or, with --mongo-uri, a
+scratch database on a real server (mindease_relatedbench, dropped). For each
+journal size, reports how long embedding costs per entry, the first lookup
+(loading the matrix; the seeded entries are embedded beforehand with
+reembed_entries(), as the migration command would), and p50/p95 of the lookups after it, which only score the cached matrix and fetch
+the matching entries. "scoring" is the matrix-vector product and top-k
+selection alone, without the database. mongomock scans a collection for
+every query and update, so with it the database steps dominate and grow
+with the journal; use --mongo-uri for realistic first-lookup numbers.
+"""
+import argparse
+import contextlib
+import os
+import random
+import statistics
+import time
+
+from benchmarks.load_test import entry_counts, seed, synthetic_text
+
+DB_NAME = 'mindease_relatedbench'
+
+
+def percentiles(samples):
+    cuts = statistics.quantiles(samples, n=100, method='inclusive')
+    return cuts[49], cuts[94]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--entries', type=int, nargs='+', default=[2000, 10000])
+    parser.add_argument('--repeat', type=int, default=50, help="timed lookups per size")
+    parser.add_argument('--limit', type=int, default=5, help="related entries per lookup")
+    parser.add_argument('--mongo-uri', help="use a real MongoDB instead of mongomock")
+    args = parser.parse_args()
+
+    os.environ.setdefault('SENTIMENT_WORKER_THREADS', '0')
+    if args.mongo_uri:
+        os.environ['MONGO_URI'] = args.mongo_uri
+        os.environ['MONGO_DB_NAME'] = DB_NAME
+    from app import app
+    from services import embeddings
+    from services.db_services import get_db, init_db
+
+    if not args.mongo_uri:
+        import mongomock
+        mock_client = mongomock.MongoClient()
+        init_db(app.config, client_factory=lambda config: mock_client)
+    db = get_db()
+
+    rng = random.Random(1)
+    texts = [synthetic_text(rng, "mixed") for _ in range(2000)]
+    start = time.perf_counter()
+    for text in texts:
+        embeddings.embedding_field(text)
+    print(f"embedding: {(time.perf_counter() - start) / len(texts) * 1e6:.0f} us per entry")
+
+    print(f"\n{'entries':>8} {'first lookup':>14} {'lookup p50/p95':>18} {'scoring p50/p95':>18}  (ms)")
+    username = "loadtest_user_0"
+    for count in args.entries:
+        db.client.drop_database(db.name)
+        embeddings._matrices.clear()
+        with contextlib.redirect_stdout(open(os.devnull, "w")):
+            entry_ids = seed(db, entry_counts(1, count, count), random.Random(1))[username]
+            embeddings.reembed_entries(db, username)
+
+        start = time.perf_counter()
+        embeddings.related_entries(db, username, entry_ids[0], args.limit)
+        first_ms = (time.perf_counter() - start) * 1000
+
+        lookups, scoring = [], []
+        matrix = embeddings.user_matrix(db, username).matrix
+        for n in range(args.repeat):
+            entry_id = entry_ids[n % len(entry_ids)]
+            start = time.perf_counter()
+            embeddings.related_entries(db, username, entry_id, args.limit)
+            lookups.append((time.perf_counter() - start) * 1000)
+            start = time.perf_counter()
+            embeddings.nearest(matrix, matrix[n % len(matrix)], args.limit, exclude=n % len(matrix))
+            scoring.append((time.perf_counter() - start) * 1000)
+        print(f"{count:>8} {first_ms:>14.0f} " + " ".join(f"{p50:8.2f} /{p95:8.2f}" for p50, p95 in
+                                                     (percentiles(lookups), percentiles(scoring))))
+    db.client.drop_database(db.name)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+"""
+Search latency (services/search.py) for one user with a large journal.
+
+    python -m benchmarks.bench_search --entries 100000
+    python -m benchmarks.bench_search --mongo-uri mongodb://127.0.0.1:27017/ --entries 100000
+
+Needs a real MongoDB (mongomock has no text search): --mongo-uri, or a
+`mongod` on PATH started on a temporary data directory. The data goes to the
+mindease_searchbench database, which is dropped before and after the run.
+
+The synthetic entries (benchmarks/load_test.py) use a small vocabulary, so
+common words match a large share of the journal, the costly case: every
+match is scored and sorted for each page. Reports p50/p95 for the first page,
+the page after it (through the cursor), and the first page with a sentiment
+and date-range filter.
+"""
+import argparse
+import os
+import random
+import shutil
+import statistics
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from benchmarks.load_test import entry_counts, seed, start_mongod
+
+DB_NAME = 'mindease_searchbench'
+
+# (label, query): from words in a large share of the entries down to none
+QUERIES = [
+    ("common word", "thinking"),
+    ("topic", "deadline"),
+    ("two words", "grateful family"),
+    ("stemmed", "walks"),
+    ("no match", "volcano"),
+]
+
+
+def timed(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    cuts = statistics.quantiles(samples, n=100, method='inclusive')
+    return cuts[49], cuts[94]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--entries', type=int, default=100000)
+    parser.add_argument('--repeat', type=int, default=20, help="timed runs per query")
+    parser.add_argument('--limit', type=int, default=20, help="page size")
+    parser.add_argument('--mongo-uri', help="MongoDB to use instead of a local mongod")
+    args = parser.parse_args()
+
+    mongod, data_dir = None, None
+    mongo_uri = args.mongo_uri
+    if mongo_uri is None:
+        if not shutil.which("mongod"):
+            parser.error("needs a real MongoDB: pass --mongo-uri or put mongod on PATH")
+        data_dir = tempfile.mkdtemp(prefix="mindease-searchbench-")
+        mongod, mongo_uri = start_mongod(data_dir)
+
+    os.environ['MONGO_URI'] = mongo_uri
+    os.environ['MONGO_DB_NAME'] = DB_NAME
+    os.environ.setdefault('SENTIMENT_WORKER_THREADS', '0')
+    from app import app
+    from services.db_services import get_db, init_db
+    from services.search import search_entries
+
+    init_db(app.config)
+    db = get_db()
+    db.client.drop_database(DB_NAME)
+    try:
+        seed(db, entry_counts(1, args.entries, args.entries), random.Random(1))
+        username = "loadtest_user_0"
+        month_ago = datetime.now() - timedelta(days=30)
+        print(f"\n{args.entries} entries, page size {args.limit}, {args.repeat} runs each (p50 / p95 ms)")
+        print(f"{'query':<16} {'matches':>8} {'first page':>16} {'next page':>16} {'filtered':>16}")
+        for label, query in QUERIES:
+            matches = db.journal_entries.count_documents({"username": username, "$text": {"$search": query}})
+            _, cursor = search_entries(db, username, query, args.limit)
+            first = timed(lambda: search_entries(db, username, query, args.limit), args.repeat)
+            following = timed(lambda: search_entries(db, username, query, args.limit, cursor), args.repeat)
+            filtered = timed(lambda: search_entries(db, username, query, args.limit, sentiments=["negative"],
+                                                    start=month_ago), args.repeat)
+            print(f"{label:<16} {matches:>8} " + " ".join(f"{p50:7.1f} /{p95:7.1f}" for p50, p95 in
+                                                          (first, following, filtered)))
+    finally:
+        db.client.drop_database(DB_NAME)
+        if mongod is not None:
+            mongod.terminate()
+            mongod.wait()
+            shutil.rmtree(data_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+"""
+Import-to-first-request latency of the backend, optionally compared with an
+older revision of the tree (e.g. one from before the app factory, whose
+app.py connected to and pinged MongoDB at import time).
+
+    python -m benchmarks.bench_startup --runs 5
+    python -m benchmarks.bench_startup --before <git-rev> --runs 5
+
+Each run is a fresh interpreter that imports app and serves one request to
+--path through the test client. MONGO_URI is taken from the environment; if it
+is unset, a local mongod is assumed (with a 2 s server selection timeout, which
+is what an import-time ping costs when no server is listening).
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CHILD = r"""
+import json, sys, time
+start = time.perf_counter()
+import app as module
+imported = time.perf_counter()
+response = module.app.test_client().get(sys.argv[1])
+served = time.perf_counter()
+with open(sys.argv[2], "w") as f:
+    json.dump({"import_ms": (imported - start) * 1000, "first_request_ms": (served - imported) * 1000,
+               "status": response.status_code}, f)
+"""
+
+
+def run_once(backend_dir, path, env):
+    # The app logs to stdout (some of it from background threads), so results go through a file
+    with tempfile.NamedTemporaryFile(suffix=".json") as result:
+        subprocess.run([sys.executable, "-c", CHILD, path, result.name], cwd=backend_dir, env=env,
+                       capture_output=True, check=True)
+        with open(result.name) as f:
+            return json.load(f)
+
+
+def measure(label, backend_dir, path, runs, env):
+    samples = [run_once(backend_dir, path, env) for _ in range(runs)]
+    import_ms = statistics.median(s["import_ms"] for s in samples)
+    request_ms = statistics.median(s["first_request_ms"] for s in samples)
+    print(f"{label:<8} import {import_ms:8.1f} ms   first request {request_ms:8.1f} ms   "
+          f"total {import_ms + request_ms:8.1f} ms   (status {samples[-1]['status']}, median of {runs})")
+
+
+def export_revision(revision, target):
+    """
+    Writes the backend directory as of `revision` under target and returns its path.
+    """
+    repo_root = subprocess.run(["git", "rev-parse", "--show-toplevel"], cwd=BACKEND_DIR,
+                               capture_output=True, text=True, check=True).stdout.strip()
+    prefix = os.path.relpath(BACKEND_DIR, repo_root)
+    archive = subprocess.run(["git", "archive", revision, prefix], cwd=repo_root, capture_output=True, check=True).stdout
+    subprocess.run(["tar", "-x", "-C", target], input=archive, check=True)
+    return os.path.join(target, prefix)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--before', help="git revision to compare against the working tree")
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--path', default='/llm_cache/stats',
+                        help="first request; the default does not touch MongoDB, '/' pings it")
+    args = parser.parse_args()
+
+    env = dict(os.environ)
+    env.setdefault('MONGO_URI', 'mongodb://127.0.0.1:27017/?serverSelectionTimeoutMS=2000')
+    # Newer trees take the timeout from config rather than the URI
+    env.setdefault('MONGO_SERVER_SELECTION_TIMEOUT_MS', '2000')
+    # Background workers do not delay startup, but keep them out of the measurement
+    env.setdefault('SENTIMENT_WORKER_THREADS', '0')
+
+    if args.before:
+        with tempfile.TemporaryDirectory() as tmp:
+            measure("before", export_revision(args.before, tmp), args.path, args.runs, env)
+    measure("after", BACKEND_DIR, args.path, args.runs, env)
+
+
+if __name__ == '__main__':
+    main()
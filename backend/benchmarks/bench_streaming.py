@@ -0,0 +1,68 @@
+"""
+Time to first byte for /journal/insight as plain JSON vs. streamed SSE,
+served by the real app against the chunked local Gemini stub.
+
+    python -m benchmarks.bench_streaming --requests 20 --latency 0.3 --chunk-delay 0.05
+"""
+import argparse
+import os
+import statistics
+import threading
+import time
+
+import requests
+from werkzeug.serving import WSGIRequestHandler, make_server
+
+from benchmarks.gemini_stub import start_stub_server
+
+
+class QuietHandler(WSGIRequestHandler):
+    def log_request(self, *args, **kwargs):
+        pass
+
+
+def measure(url, body, n):
+    """
+    Returns (time to first byte, total time) samples in milliseconds.
+    """
+    ttfb, total = [], []
+    for i in range(n):
+        start = time.perf_counter()
+        # A distinct text per request so the LLM cache never answers
+        with requests.post(url, json={"text": f"{body} #{i}"}, stream=True) as response:
+            response.raise_for_status()
+            chunks = response.iter_content(chunk_size=None)
+            next(chunks)
+            ttfb.append((time.perf_counter() - start) * 1000)
+            for _ in chunks:
+                pass
+        total.append((time.perf_counter() - start) * 1000)
+    return ttfb, total
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=20)
+    parser.add_argument('--latency', type=float, default=0.3, help="stub seconds before the first token")
+    parser.add_argument('--chunk-delay', type=float, default=0.05, help="stub seconds between streamed pieces")
+    args = parser.parse_args()
+
+    stub = start_stub_server(latency=args.latency, chunk_delay=args.chunk_delay)
+    os.environ['GEMINI_API_BASE'] = stub.api_base
+    os.environ.setdefault('SENTIMENT_WORKER_THREADS', '0')
+    from app import app
+
+    server = make_server('127.0.0.1', 0, app, threaded=True, request_handler=QuietHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{server.server_port}/journal/insight"
+
+    for label, url in (("json", base), ("sse", base + "?stream=true")):
+        ttfb, total = measure(url, f"benchmark entry ({label})", args.requests)
+        print(f"{label:<5} TTFB p50 {statistics.median(ttfb):8.1f} ms   total p50 {statistics.median(total):8.1f} ms")
+
+    server.shutdown()
+    stub.shutdown()
+
+
+if __name__ == '__main__':
+    main()
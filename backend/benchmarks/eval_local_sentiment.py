@@ -0,0 +1,114 @@
+"""
+Offline evaluation of the local sentiment tier against stored Gemini labels.
+
+    python -m benchmarks.eval_local_sentiment                  # entries in MONGO_URI
+    python -m benchmarks.eval_local_sentiment --jsonl labelled.jsonl
+
+Gemini-labelled entries are split into train/held-out sets (every n-th entry
+is held out). The lexicon and a model trained on the train split are scored
+on the held-out entries: overall agreement, and for each confidence threshold
+the share of entries that would skip Gemini and the agreement on those. Local
+latency per entry is reported alongside; compare it with the Gemini latency
+in /llm_cache/stats or the pooled client benchmark.
+"""
+import argparse
+import json
+import os
+import statistics
+import time
+
+from pymongo import MongoClient
+
+from services.ai_services import SENTIMENT_LABELS
+from services.local_sentiment import LinearSentimentModel, lexicon_sentiment, load_training_data
+
+
+def load_jsonl(path):
+    """
+    Reads {"text": ..., "sentiment": ...} lines, keeping the ones with a real label.
+    """
+    texts, labels = [], []
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            if not line.strip():
+                continue
+            item = json.loads(line)
+            if item.get("sentiment") in SENTIMENT_LABELS:
+                texts.append(item["text"])
+                labels.append(item["sentiment"])
+    return texts, labels
+
+
+def timed_predictions(predict_one, texts):
+    """
+    Returns ([(label, confidence)], per-entry latencies in microseconds).
+    """
+    predictions, latencies = [], []
+    for text in texts:
+        start = time.perf_counter()
+        predictions.append(predict_one(text))
+        latencies.append((time.perf_counter() - start) * 1e6)
+    return predictions, latencies
+
+
+def report(name, predictions, latencies, labels, thresholds):
+    agreement = sum(label == expected for (label, _), expected in zip(predictions, labels)) / len(labels)
+    latencies = sorted(latencies)
+    p95 = latencies[max(0, int(len(latencies) * 0.95) - 1)]
+    print(f"\n{name}: agreement {agreement:.1%} on {len(labels)} entries, "
+          f"latency p50 {statistics.median(latencies):.0f} us, p95 {p95:.0f} us per entry")
+    for label in SENTIMENT_LABELS:
+        relevant = [(predicted, expected) for (predicted, _), expected in zip(predictions, labels) if expected == label]
+        if relevant:
+            recall = sum(predicted == expected for predicted, expected in relevant) / len(relevant)
+            print(f"  {label:<9} {len(relevant):6d} entries, recall {recall:.1%}")
+    print(f"  {'threshold':>9} {'local':>8} {'agreement':>10}")
+    for threshold in thresholds:
+        confident = [(label, expected) for (label, confidence), expected in zip(predictions, labels) if confidence >= threshold]
+        coverage = len(confident) / len(labels)
+        local_agreement = sum(label == expected for label, expected in confident) / len(confident) if confident else float('nan')
+        print(f"  {threshold:>9.2f} {coverage:>8.1%} {local_agreement:>10.1%}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--jsonl', help="read labelled entries from this file instead of MongoDB")
+    parser.add_argument('--limit', type=int, default=50000)
+    parser.add_argument('--holdout', type=float, default=0.2)
+    parser.add_argument('--epochs', type=int, default=150)
+    parser.add_argument('--thresholds', default="0.6,0.7,0.8,0.85,0.9,0.95")
+    args = parser.parse_args()
+
+    if args.jsonl:
+        texts, labels = load_jsonl(args.jsonl)
+    else:
+        db = MongoClient(os.environ.get("MONGO_URI", ""))['mindease_db']
+        texts, labels = load_training_data(db, args.limit)
+    step = max(2, round(1 / args.holdout))
+    test = [i for i in range(len(texts)) if i % step == 0]
+    train = [i for i in range(len(texts)) if i % step]
+    if not test:
+        raise SystemExit("No labelled entries to evaluate")
+    thresholds = [float(t) for t in args.thresholds.split(",")]
+    test_texts, test_labels = [texts[i] for i in test], [labels[i] for i in test]
+    print(f"{len(texts)} labelled entries: {len(train)} train, {len(test)} held out")
+
+    predictions, latencies = timed_predictions(lexicon_sentiment, test_texts)
+    report("lexicon", predictions, latencies, test_labels, thresholds)
+
+    if len(set(labels[i] for i in train)) > 1:
+        start = time.perf_counter()
+        model = LinearSentimentModel.train([texts[i] for i in train], [labels[i] for i in train], epochs=args.epochs)
+        print(f"\ntrained model in {time.perf_counter() - start:.1f} s")
+        predictions, latencies = timed_predictions(lambda text: model.predict([text])[0], test_texts)
+        report("linear model", predictions, latencies, test_labels, thresholds)
+
+        # The worker classifies whole batches, which amortises the NumPy overhead
+        start = time.perf_counter()
+        model.predict(test_texts)
+        batch_us = (time.perf_counter() - start) * 1e6 / len(test_texts)
+        print(f"  batched: {batch_us:.0f} us per entry")
+
+
+if __name__ == '__main__':
+    main()
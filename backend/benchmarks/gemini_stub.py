@@ -0,0 +1,166 @@
+"""
+Local stand-in for the Gemini REST API, used by the benchmarks so they run offline.
+
+Run standalone with `python -m benchmarks.gemini_stub --port 8089` and point the
+backend at it with GEMINI_API_BASE=http://127.0.0.1:8089/v1beta.
+
+Faults can be injected with error_rate (HTTP 503 answers) and slow_rate /
+slow_latency (a share of calls stalls); all options are plain attributes of
+the server, so a benchmark can change them while it runs to script an outage.
+"""
+import argparse
+import json
+import random
+import re
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def canned_response(text):
+    return {
+        "candidates": [{"content": {"role": "model", "parts": [{"text": text}]}, "finishReason": "STOP"}],
+        "usageMetadata": {"promptTokenCount": 1, "candidatesTokenCount": 1, "totalTokenCount": 2}
+    }
+
+
+def stub_text(payload):
+    """
+    Picks a plausible answer for the kind of prompt the backend sent.
+    """
+    prompt = payload["contents"][0]["parts"][0]["text"]
+    max_tokens = payload.get("generationConfig", {}).get("maxOutputTokens", 100)
+    batch = re.search(r"JSON array of (\d+) strings", prompt)
+    if batch:
+        return json.dumps(["neutral"] * int(batch.group(1)))
+    # Sentiment calls ask for at most 10 tokens and expect a single label
+    if max_tokens <= 10:
+        return "neutral"
+    return "This is a stubbed response from the local Gemini stand-in."
+
+
+class GeminiStubHandler(BaseHTTPRequestHandler):
+    # HTTP/1.1 so clients can keep the connection alive between calls
+    protocol_version = "HTTP/1.1"
+    # Headers and body are written separately; without this, Nagle + delayed ACK adds ~40ms per call
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        super().setup()
+        with self.server.stats_lock:
+            self.server.connections += 1
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        payload = json.loads(self.rfile.read(length) or b"{}")
+        with self.server.stats_lock:
+            self.server.requests += 1
+
+        # Split the answer into word-sized pieces, the way the model streams tokens
+        pieces = re.findall(r"\S+\s*", stub_text(payload)) or [""]
+
+        if self.server.slow_rate and random.random() < self.server.slow_rate:
+            time.sleep(self.server.slow_latency)
+        elif self.server.latency:
+            time.sleep(self.server.latency)
+
+        if self.server.error_rate and random.random() < self.server.error_rate:
+            # What an overloaded Gemini answers; the client retries it
+            body = json.dumps({"error": {"code": 503, "message": "The model is overloaded.",
+                                         "status": "UNAVAILABLE"}}).encode()
+            self.send_response(503)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+
+        if ':streamGenerateContent' in self.path:
+            self._stream(pieces)
+            return
+
+        # A non-streaming call only answers once the whole text has been generated
+        if self.server.chunk_delay:
+            time.sleep(self.server.chunk_delay * (len(pieces) - 1))
+        body = json.dumps(canned_response("".join(pieces))).encode()
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _stream(self, pieces):
+        """
+        Answers like streamGenerateContent?alt=sse: one SSE event per piece,
+        sent with chunked transfer encoding.
+        """
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        for i, piece in enumerate(pieces):
+            if i and self.server.chunk_delay:
+                time.sleep(self.server.chunk_delay)
+            event = f"data: {json.dumps(canned_response(piece))}\r\n\r\n".encode()
+            self.wfile.write(f"{len(event):x}\r\n".encode() + event + b"\r\n")
+        self.wfile.write(b"0\r\n\r\n")
+
+
+class GeminiStubServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # The default listen backlog of 5 drops connections when hundreds are opened at once
+    request_queue_size = 1024
+
+    def __init__(self, address, latency=0.0, chunk_delay=0.0, error_rate=0.0, slow_rate=0.0, slow_latency=5.0):
+        super().__init__(address, GeminiStubHandler)
+        # Seconds before the first token, and between streamed pieces
+        self.latency = latency
+        self.chunk_delay = chunk_delay
+        # Fraction of calls answered with HTTP 503
+        self.error_rate = error_rate
+        # Fraction of calls that wait slow_latency instead of latency (a latency tail)
+        self.slow_rate = slow_rate
+        self.slow_latency = slow_latency
+        self.stats_lock = threading.Lock()
+        self.connections = 0
+        self.requests = 0
+
+    def handle_error(self, request, client_address):
+        # A client that timed out on a stalled call has hung up; that is the point of stalling
+        if not isinstance(sys.exc_info()[1], (BrokenPipeError, ConnectionResetError)):
+            super().handle_error(request, client_address)
+
+    @property
+    def api_base(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/v1beta"
+
+
+def start_stub_server(port=0, **options):
+    """
+    Starts a stub server on a background thread and returns it.
+    Use server.api_base as GEMINI_API_BASE and server.shutdown() to stop it.
+    """
+    server = GeminiStubServer(('127.0.0.1', port), **options)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--port', type=int, default=8089)
+    parser.add_argument('--latency', type=float, default=0.0, help="seconds before the first token")
+    parser.add_argument('--chunk-delay', type=float, default=0.0, help="seconds between streamed pieces")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="fraction of calls answered with HTTP 503")
+    parser.add_argument('--slow-rate', type=float, default=0.0, help="fraction of calls delayed by --slow-latency")
+    parser.add_argument('--slow-latency', type=float, default=5.0, help="seconds a slow call takes")
+    args = parser.parse_args()
+    server = GeminiStubServer(('127.0.0.1', args.port), latency=args.latency, chunk_delay=args.chunk_delay,
+                              error_rate=args.error_rate, slow_rate=args.slow_rate, slow_latency=args.slow_latency)
+    print(f"Gemini stub listening on {server.api_base}")
+    server.serve_forever()
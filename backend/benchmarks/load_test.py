@@ -0,0 +1,562 @@
+"""
+Offline load test: seeds synthetic users, serves the app against MongoDB and
+the local Gemini stub, and drives every route at a fixed concurrency.
+
+    python -m benchmarks.load_test
+    python -m benchmarks.load_test --users 4 --min-entries 10 --max-entries 100000
+    python -m benchmarks.load_test --mongo-uri mongodb://127.0.0.1:27017/ --server gunicorn --workers 2
+    python -m benchmarks.load_test --write-baseline       # writes benchmarks/baseline.json
+    python -m benchmarks.load_test --compare              # exits 1 on a regression
+    python -m benchmarks.load_test --check-plans          # exits 1 on a collection scan or in-memory sort
+
+MongoDB: --mongo-uri uses that server; otherwise a `mongod` found on PATH is
+started on a temporary data directory; otherwise the data lives in mongomock
+inside this process (pip install mongomock). mongomock is not thread-safe,
+so with it the in-process server handles one request at a time and the
+numbers are only good for spotting regressions; use a real MongoDB for
+capacity figures. On a real server everything goes to the --db-name
+database, which is dropped before and after the run.
+
+Users get between --min-entries and --max-entries entries each (spaced
+geometrically), spread over the past year. Each route is driven on its own,
+reads before writes, for --rounds rounds, and reported with the throughput
+and p50/p95/p99 latency of its best round. --compare flags routes whose p50
+or p95 grew, or whose throughput fell, by more than --tolerance against the
+baseline file. Baselines are only meaningful on the same machine with the
+same settings.
+
+--check-plans needs a real MongoDB: instead of measuring, it sends --warmup
+requests to each route (with a sentiment worker running), then explains every
+distinct query the app sent (services/query_plans.py) and fails if any of
+them scans a collection or sorts in memory.
+"""
+import argparse
+import contextlib
+import json
+import math
+import os
+import random
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+
+import requests
+from werkzeug.security import generate_password_hash
+from werkzeug.serving import WSGIRequestHandler, make_server
+
+from benchmarks.bench_async_capacity import free_port, wait_until_up
+from benchmarks.gemini_stub import start_stub_server
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_BASELINE = os.path.join(BACKEND_DIR, 'benchmarks', 'baseline.json')
+
+USER_PREFIX = "loadtest_user_"
+PASSWORD = "load-test-password"
+
+# Words for the synthetic entries, by the sentiment they are labelled with
+MOODS = {
+    "positive": ["grateful", "happy", "calm", "proud", "excited", "relaxed", "hopeful"],
+    "negative": ["anxious", "tired", "frustrated", "sad", "overwhelmed", "lonely", "stressed"],
+    "neutral": ["busy", "ordinary", "quiet", "routine", "steady", "uneventful", "normal"],
+}
+TOPICS = ["work", "my family", "the weather", "a long walk", "dinner with friends", "the project deadline",
+          "my sleep", "a book I am reading", "the gym", "the commute"]
+LABEL_WEIGHTS = [("positive", 0.4), ("neutral", 0.3), ("negative", 0.25), ("mixed", 0.05)]
+
+
+class QuietHandler(WSGIRequestHandler):
+    def log_request(self, *args, **kwargs):
+        pass
+
+
+class Scenario:
+    """
+    One route driven by the load test. make_request(i) returns (path, body):
+    a JSON-serializable body, raw bytes, or None. mongod_only scenarios use
+    features mongomock lacks and are skipped with it.
+    """
+
+    def __init__(self, name, method, rule, make_request, expect=(200,), mongod_only=False):
+        self.name = name
+        self.method = method
+        self.rule = rule
+        self.make_request = make_request
+        self.expect = expect
+        self.mongod_only = mongod_only
+
+
+def synthetic_text(rng, label):
+    if label == "mixed":
+        return (f"Felt {rng.choice(MOODS['positive'])} about {rng.choice(TOPICS)} "
+                f"but {rng.choice(MOODS['negative'])} about {rng.choice(TOPICS)}.")
+    return f"Today I felt {rng.choice(MOODS[label])}. Mostly thinking about {rng.choice(TOPICS)}."
+
+
+def entry_counts(users, min_entries, max_entries):
+    """
+    Spaces the users' entry counts geometrically from min_entries to max_entries.
+    """
+    if users == 1:
+        return [max_entries]
+    ratio = (max_entries / min_entries) ** (1 / (users - 1))
+    return [int(round(min_entries * ratio ** n)) for n in range(users)]
+
+
+def seed(db, counts, rng):
+    """
+    Inserts the users and their entries, builds their rollups, and returns
+    {username: [a sample of entry ids]}.
+    """
+    from services.db_services import ensure_indexes
+    from services.rollups import rebuild_rollups
+
+    labels, weights = zip(*LABEL_WEIGHTS)
+    password_hash = generate_password_hash(PASSWORD)
+    end = datetime.now() - timedelta(minutes=1)
+    entry_ids = {}
+
+    for n, count in enumerate(counts):
+        username = f"{USER_PREFIX}{n}"
+        db.users.insert_one({"username": username, "password": password_hash})
+        step = timedelta(days=365) / count
+        ids = []
+        for batch_start in range(0, count, 5000):
+            batch = []
+            for i in range(batch_start, min(count, batch_start + 5000)):
+                timestamp = end - (count - i) * step
+                label = rng.choices(labels, weights)[0]
+                batch.append({
+                    "text": synthetic_text(rng, label),
+                    "timestamp": timestamp,
+                    "username": username,
+                    "sentiment": label,
+                    "sentiment_tier": "llm",
+                })
+            ids.extend(db.journal_entries.insert_many(batch).inserted_ids)
+        entry_ids[username] = rng.sample(ids, min(len(ids), 100))
+        rebuild_rollups(db, username)
+        print(f"Seeded {username} with {count} entries")
+
+    ensure_indexes(db)
+    return entry_ids
+
+
+def build_scenarios(entry_ids, run_id):
+    """
+    One scenario per route, reads before writes.
+    """
+    users = sorted(entry_ids)
+    today = datetime.now().date()
+    month_ago = (today - timedelta(days=30)).isoformat()
+
+    def user(i):
+        return users[i % len(users)]
+
+    def entry_text(i):
+        # Seeded by the request index, so each request's text is the same on every run
+        entry_rng = random.Random(i)
+        return synthetic_text(entry_rng, entry_rng.choice(["positive", "negative", "neutral", "mixed"]))
+
+    def import_batch(i):
+        # 20 NDJSON lines per request, dated over the past month
+        lines = [json.dumps({"text": entry_text(i * 20 + n),
+                             "timestamp": (datetime.now() - timedelta(days=(i * 20 + n) % 30)).isoformat()})
+                 for n in range(20)]
+        return f"/journal/{user(i)}/import", ("\n".join(lines) + "\n").encode('utf-8')
+
+    def related(i):
+        ids = entry_ids[user(i)]
+        return f"/journal/{user(i)}/related/{ids[i // len(users) % len(ids)]}", None
+
+    def update_sentiment(i):
+        ids = entry_ids[user(i)]
+        return f"/journal/update_sentiment/{user(i)}/{ids[i // len(users) % len(ids)]}", None
+
+    return [
+        Scenario("home", "GET", "/", lambda i: ("/", None)),
+        Scenario("llm_cache_stats", "GET", "/llm_cache/stats", lambda i: ("/llm_cache/stats", None)),
+        Scenario("prometheus_metrics", "GET", "/metrics", lambda i: ("/metrics", None)),
+        Scenario("login_user", "POST", "/login",
+                 lambda i: ("/login", {"username": user(i), "password": PASSWORD})),
+        Scenario("get_journal_entries", "GET", "/journal/<username>",
+                 lambda i: (f"/journal/{user(i)}", None)),
+        Scenario("get_sentiment_summary", "GET", "/journal/sentiment_summary/<username>",
+                 lambda i: (f"/journal/sentiment_summary/{user(i)}", None)),
+        Scenario("get_sentiment_trends", "GET", "/journal/sentiment_trends/<username>",
+                 lambda i: (f"/journal/sentiment_trends/{user(i)}", None)),
+        # Weekly columns for a chart ($dateTrunc needs MongoDB 5.0)
+        Scenario("get_sentiment_trends_weekly", "GET", "/journal/sentiment_trends/<username>",
+                 lambda i: (f"/journal/sentiment_trends/{user(i)}?granularity=week&format=columns&max_points=26",
+                            None),
+                 mongod_only=True),
+        Scenario("get_journal_changes", "GET", "/journal/<username>/changes",
+                 lambda i: (f"/journal/{user(i)}/changes", None)),
+        # Text search
+        Scenario("search_journal", "GET", "/journal/<username>/search",
+                 lambda i: (f"/journal/{user(i)}/search?q={random.Random(i).choice(TOPICS)}", None),
+                 mongod_only=True),
+        Scenario("get_related_entries", "GET", "/journal/<username>/related/<entry_id>", related),
+        Scenario("export_journal", "GET", "/journal/<username>/export",
+                 lambda i: (f"/journal/{user(i)}/export", None)),
+        # A distinct text per request, so the LLM cache does not answer
+        Scenario("get_journal_insight", "POST", "/journal/insight",
+                 lambda i: ("/journal/insight", {"text": f"{entry_text(i)} ({run_id}-{i})"})),
+        Scenario("generate_journal_prompt", "POST", "/journal/generate_prompt/<username>",
+                 lambda i: (f"/journal/generate_prompt/{user(i)}", None)),
+        Scenario("get_period_summary", "POST", "/journal/period_summary/<username>",
+                 lambda i: (f"/journal/period_summary/{user(i)}",
+                            {"start_date": month_ago, "end_date": today.isoformat()})),
+        Scenario("add_journal_entry", "POST", "/journal/<username>",
+                 lambda i: (f"/journal/{user(i)}", {"text": entry_text(i)}), expect=(201,)),
+        Scenario("import_journal", "POST", "/journal/<username>/import", import_batch),
+        Scenario("update_journal_sentiment", "PUT", "/journal/update_sentiment/<username>/<entry_id>",
+                 update_sentiment),
+        Scenario("change_password", "PUT", "/change_password/<username>",
+                 lambda i: (f"/change_password/{user(i)}", {"old_password": PASSWORD, "new_password": PASSWORD})),
+        Scenario("register_user", "POST", "/register",
+                 lambda i: ("/register", {"username": f"loadtest_new_{run_id}_{i}", "password": PASSWORD}),
+                 expect=(201,)),
+    ]
+
+
+def check_coverage(app, scenarios):
+    """
+    Warns about routes no scenario drives, so new routes do not go unmeasured.
+    """
+    covered = {(s.method, s.rule) for s in scenarios}
+    for rule in app.url_map.iter_rules():
+        if rule.endpoint == 'static':
+            continue
+        for method in rule.methods - {'HEAD', 'OPTIONS'}:
+            if (method, rule.rule) not in covered:
+                print(f"warning: no load-test scenario for {method} {rule.rule}")
+
+
+def drive(base_url, scenario, first, total, concurrency):
+    """
+    Sends requests first .. first+total-1 from `concurrency` threads; returns
+    (latencies in seconds of the expected responses, Counter of other outcomes, wall seconds).
+    """
+    indexes = iter(range(first, first + total))
+    lock = threading.Lock()
+    latencies, failures = [], Counter()
+
+    def worker():
+        session = requests.Session()
+        while True:
+            with lock:
+                i = next(indexes, None)
+            if i is None:
+                return
+            path, body = scenario.make_request(i)
+            start = time.perf_counter()
+            try:
+                if isinstance(body, bytes):
+                    response = session.request(scenario.method, base_url + path, data=body, timeout=120,
+                                               headers={'Content-Type': 'application/x-ndjson'})
+                else:
+                    response = session.request(scenario.method, base_url + path, json=body, timeout=120)
+                outcome = response.status_code
+            except requests.RequestException as e:
+                outcome = type(e).__name__
+            elapsed = time.perf_counter() - start
+            with lock:
+                if outcome in scenario.expect:
+                    latencies.append(elapsed)
+                else:
+                    failures[outcome] += 1
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, failures, time.perf_counter() - started
+
+
+def summarize(latencies, failures, wall):
+    if len(latencies) > 1:
+        cuts = statistics.quantiles(latencies, n=100, method='inclusive')
+        p50, p95, p99 = cuts[49], cuts[94], cuts[98]
+    else:
+        p50 = p95 = p99 = latencies[0] if latencies else math.nan
+    return {
+        "requests": len(latencies) + sum(failures.values()),
+        "errors": sum(failures.values()),
+        "error_kinds": {str(k): v for k, v in failures.items()},
+        "throughput": round(len(latencies) / wall, 2),
+        "p50_ms": round(p50 * 1000, 2),
+        "p95_ms": round(p95 * 1000, 2),
+        "p99_ms": round(p99 * 1000, 2),
+    }
+
+
+def print_results(results):
+    print(f"\n{'route':<26} {'reqs':>5} {'errors':>6} {'req/s':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for name, r in results.items():
+        print(f"{name:<26} {r['requests']:>5} {r['errors']:>6} {r['throughput']:>8.1f} "
+              f"{r['p50_ms']:>9.1f} {r['p95_ms']:>9.1f} {r['p99_ms']:>9.1f}")
+        if r['error_kinds']:
+            print(f"{'':<26} unexpected: {r['error_kinds']}")
+
+
+def compare(results, settings, baseline, tolerance, min_delta_ms):
+    """
+    Prints the changes against a baseline and returns the regressed route names.
+    """
+    if baseline.get("settings") != settings:
+        print("\nwarning: the baseline was recorded with different settings:")
+        for key in sorted(set(settings) | set(baseline.get("settings", {}))):
+            if settings.get(key) != baseline["settings"].get(key):
+                print(f"  {key}: baseline {baseline['settings'].get(key)!r}, now {settings.get(key)!r}")
+
+    print(f"\nAgainst the baseline (tolerance {tolerance:.0%}):")
+    regressions = []
+    for name, r in results.items():
+        b = baseline["routes"].get(name)
+        if b is None:
+            print(f"  {name:<26} not in the baseline")
+            continue
+        problems = []
+        for key in ("p50_ms", "p95_ms"):
+            if r[key] > b[key] * (1 + tolerance) and r[key] - b[key] > min_delta_ms:
+                problems.append(f"{key} {b[key]:.1f} -> {r[key]:.1f}")
+        if r["throughput"] < b["throughput"] * (1 - tolerance):
+            problems.append(f"req/s {b['throughput']:.1f} -> {r['throughput']:.1f}")
+        if r["errors"] > b["errors"]:
+            problems.append(f"errors {b['errors']} -> {r['errors']}")
+        change = (r["p95_ms"] / b["p95_ms"] - 1) if b["p95_ms"] else 0.0
+        if problems:
+            regressions.append(name)
+            print(f"  {name:<26} REGRESSION  {'; '.join(problems)}")
+        else:
+            print(f"  {name:<26} ok          p95 {change:+.0%}")
+    return regressions
+
+
+def check_plans(base_url, scenarios, requests_per_route, recorder, client, app_log):
+    """
+    Drives each route, explains the queries recorded meanwhile, and returns the failures.
+    """
+    from services.query_plans import check_query_plans
+
+    for scenario in scenarios:
+        with contextlib.redirect_stdout(app_log):
+            failures = drive(base_url, scenario, 0, requests_per_route, 1)[1]
+        if failures:
+            print(f"warning: {scenario.name} returned {dict(failures)}")
+    # Give the sentiment worker time to claim the entries just added
+    time.sleep(2)
+
+    queries = recorder.queries()
+    failures = check_query_plans(client, queries)
+    print(f"\nExplained {len(queries)} distinct queries")
+    for description, problems in failures:
+        print(f"  {'+'.join(problems):<14} {description}")
+    return failures
+
+
+def start_mongod(data_dir):
+    port = free_port()
+    process = subprocess.Popen(["mongod", "--dbpath", data_dir, "--port", str(port), "--bind_ip", "127.0.0.1",
+                                "--quiet"], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return process, f"mongodb://127.0.0.1:{port}/"
+        except OSError:
+            if process.poll() is not None:
+                break
+            time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError("mongod did not start")
+
+
+def start_server(kind, app, workers, env, threaded=True):
+    """
+    Serves the app and returns (base URL, stop function).
+    """
+    if kind == "werkzeug":
+        server = make_server('127.0.0.1', 0, app, threaded=threaded, request_handler=QuietHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return f"http://127.0.0.1:{server.server_port}", server.shutdown
+
+    port = free_port()
+    if kind == "gunicorn":
+        command = [sys.executable, "-m", "gunicorn", "-w", str(workers), "-k", "gthread", "--threads", "8",
+                   "-b", f"127.0.0.1:{port}", "app:app"]
+    else:
+        command = [sys.executable, "-m", "uvicorn", "asgi:app", "--host", "127.0.0.1", "--port", str(port),
+                   "--workers", str(workers), "--no-access-log", "--log-level", "warning"]
+    process = subprocess.Popen(command, cwd=BACKEND_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    base_url = f"http://127.0.0.1:{port}"
+    wait_until_up(base_url + "/llm_cache/stats", process)
+
+    def stop():
+        process.terminate()
+        process.wait()
+    return base_url, stop
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=3)
+    parser.add_argument('--min-entries', type=int, default=10)
+    parser.add_argument('--max-entries', type=int, default=5000)
+    parser.add_argument('--requests', type=int, default=100, help="measured requests per route and round")
+    parser.add_argument('--rounds', type=int, default=3, help="measured rounds per route; the best one is reported")
+    parser.add_argument('--warmup', type=int, default=10, help="unmeasured requests per route first")
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--routes', help="comma-separated scenario names to run (default: all)")
+    parser.add_argument('--gemini-latency', type=float, default=0.05, help="stub seconds per Gemini call")
+    parser.add_argument('--gemini-error-rate', type=float, default=0.0, help="fraction of Gemini calls that fail")
+    parser.add_argument('--mongo-uri', help="MongoDB to use instead of a local mongod or mongomock")
+    parser.add_argument('--db-name', default='mindease_loadtest', help="database used (and dropped) on a real server")
+    parser.add_argument('--server', choices=['werkzeug', 'gunicorn', 'uvicorn'], default='werkzeug')
+    parser.add_argument('--workers', type=int, default=1, help="worker processes for gunicorn/uvicorn")
+    parser.add_argument('--seed', type=int, default=1234)
+    parser.add_argument('--verbose', action='store_true', help="show the app's own log output")
+    parser.add_argument('--check-plans', action='store_true',
+                        help="explain the routes' queries instead of measuring; exits 1 on a COLLSCAN or SORT")
+    parser.add_argument('--compare', nargs='?', const=DEFAULT_BASELINE, help="baseline file to compare against")
+    parser.add_argument('--write-baseline', nargs='?', const=DEFAULT_BASELINE, help="write the results here")
+    parser.add_argument('--tolerance', type=float, default=0.25, help="allowed relative slowdown")
+    parser.add_argument('--min-delta-ms', type=float, default=1.0,
+                        help="latency increases smaller than this never count as regressions")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    stub = start_stub_server(latency=args.gemini_latency, error_rate=args.gemini_error_rate)
+    mongod, data_dir, mock_client = None, None, None
+    mongo_uri = args.mongo_uri
+    if mongo_uri is None and shutil.which("mongod"):
+        data_dir = tempfile.mkdtemp(prefix="mindease-loadtest-")
+        mongod, mongo_uri = start_mongod(data_dir)
+    if mongo_uri is None:
+        if args.server != "werkzeug":
+            parser.error("--server gunicorn/uvicorn needs a real MongoDB (--mongo-uri or mongod on PATH)")
+        try:
+            import mongomock
+        except ImportError:
+            parser.error("no mongod on PATH and mongomock is not installed (pip install mongomock)")
+        mock_client = mongomock.MongoClient()
+    if args.check_plans and (mock_client is not None or args.server != "werkzeug"):
+        parser.error("--check-plans needs a real MongoDB and the in-process (werkzeug) server")
+    elif args.db_name == 'mindease_db':
+        parser.error("refusing to drop the app's own database; pick another --db-name")
+
+    # The app reads its settings from the environment when it is imported
+    env = os.environ
+    env['GEMINI_API_BASE'] = stub.api_base
+    env['MONGO_DB_NAME'] = args.db_name
+    # One worker when checking plans, so the sentiment queue's queries are seen too
+    env.setdefault('SENTIMENT_WORKER_THREADS', '1' if args.check_plans else '0')
+    # Keep the LLM scheduler in the request path, but with a fresh state and
+    # quotas the few load-test users sending many requests each never reach
+    env.setdefault('LLM_SCHEDULER_PATH', os.path.join(tempfile.mkdtemp(prefix="mindease-llm-scheduler-"), "state.db"))
+    env.setdefault('LLM_USER_RPM', '1000000')
+    env.setdefault('LLM_USER_BURST', '1000')
+    env.setdefault('LLM_GLOBAL_RPM', '1000000')
+    env.setdefault('LLM_GLOBAL_TPM', '1000000000')
+    if mongo_uri:
+        env['MONGO_URI'] = mongo_uri
+    from app import app
+    from services.db_services import get_db, init_db
+    if mock_client is not None:
+        init_db(app.config, client_factory=lambda config: mock_client)
+    recorder = None
+    if args.check_plans:
+        from pymongo import monitoring
+        from services.query_plans import QueryRecorder
+        # Registered before get_db() creates the client, which only picks up listeners registered by then
+        recorder = QueryRecorder()
+        monitoring.register(recorder)
+
+    db = get_db()
+    if mock_client is None:
+        db.client.drop_database(args.db_name)
+    counts = entry_counts(args.users, args.min_entries, args.max_entries)
+    entry_ids = seed(db, counts, rng)
+
+    run_id = f"{args.seed}-{int(time.time())}"
+    scenarios = build_scenarios(entry_ids, run_id)
+    check_coverage(app, scenarios)
+    if args.routes:
+        wanted = set(args.routes.split(','))
+        scenarios = [s for s in scenarios if s.name in wanted]
+    if mock_client is not None:
+        skipped = [s.name for s in scenarios if s.mongod_only]
+        if skipped:
+            print(f"Skipping {', '.join(skipped)}: not supported by mongomock")
+        scenarios = [s for s in scenarios if not s.mongod_only]
+
+    settings = {
+        "users": args.users, "entries": counts, "requests": args.requests, "rounds": args.rounds,
+        "concurrency": args.concurrency,
+        "gemini_latency": args.gemini_latency, "gemini_error_rate": args.gemini_error_rate,
+        "server": args.server, "workers": args.workers,
+        "mongo": "mongomock" if mock_client is not None else "mongod",
+    }
+    print(f"\nSettings: {json.dumps(settings)}")
+
+    base_url, stop_server = start_server(args.server, app, args.workers, dict(env), threaded=mock_client is None)
+    results, plan_failures = {}, []
+    # The in-process app logs every request to stdout
+    app_log = sys.stdout if args.verbose else open(os.devnull, "w")
+    try:
+        if args.check_plans:
+            plan_failures = check_plans(base_url, scenarios, max(1, args.warmup), recorder, db.client, app_log)
+            scenarios = []
+        for scenario in scenarios:
+            with contextlib.redirect_stdout(app_log):
+                drive(base_url, scenario, 0, args.warmup, args.concurrency)
+                rounds = []
+                for n in range(args.rounds):
+                    first = args.warmup + n * args.requests
+                    rounds.append(summarize(*drive(base_url, scenario, first, args.requests, args.concurrency)))
+            # The best round is the one least disturbed by whatever else the machine was doing
+            results[scenario.name] = min(rounds, key=lambda r: (r["errors"], r["p50_ms"]))
+            print(f"{scenario.name}: {results[scenario.name]['throughput']} req/s")
+    finally:
+        stop_server()
+        if mock_client is None:
+            db.client.drop_database(args.db_name)
+        if mongod is not None:
+            mongod.terminate()
+            mongod.wait()
+            shutil.rmtree(data_dir, ignore_errors=True)
+        stub.shutdown()
+
+    if args.check_plans:
+        if plan_failures:
+            print(f"{len(plan_failures)} queries scan a collection or sort in memory; see services/db_services.INDEXES")
+            sys.exit(1)
+        print("Every query is served by an index")
+        return
+
+    print_results(results)
+
+    if args.write_baseline:
+        with open(args.write_baseline, "w") as f:
+            json.dump({"settings": settings, "routes": results}, f, indent=2)
+            f.write("\n")
+        print(f"\nWrote {args.write_baseline}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if compare(results, settings, baseline, args.tolerance, args.min_delta_ms):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,137 @@
+"""
+Management commands, run with `flask --app app <command>`.
+"""
+import click
+
+from services.backfill import SentimentBackfill, build_backfill_filter
+from services.embeddings import EMBED_BATCH_SIZE, reembed_entries
+from services.entry_schema import MIGRATION_BATCH_SIZE, migrate_entries
+from services.local_sentiment import LinearSentimentModel, load_training_data, save_model
+from services.prompt_pool import PromptWorkerPool
+from services.rollups import rebuild_rollups
+from services.sentiment_queue import SentimentWorkerPool
+
+
+def register_commands(app, get_db):
+    """
+    Registers the CLI commands on app. get_db returns the database handle (or None).
+    """
+
+    def require_db():
+        db = get_db()
+        if db is None:
+            raise click.ClickException("Database connection not available")
+        return db
+
+    @app.cli.command('sentiment-worker')
+    @click.option('--threads', default=app.config['SENTIMENT_WORKER_THREADS'] or 2, show_default=True,
+                  help="Number of worker threads.")
+    @click.option('--batch-size', default=app.config['SENTIMENT_BATCH_SIZE'], show_default=True,
+                  help="Entries classified per Gemini call.")
+    def sentiment_worker(threads, batch_size):
+        """Drain the sentiment queue in the foreground."""
+        SentimentWorkerPool(
+            require_db(),
+            threads=threads,
+            batch_size=batch_size,
+            max_attempts=app.config['SENTIMENT_MAX_ATTEMPTS'],
+            lease_seconds=app.config['SENTIMENT_LEASE_SECONDS'],
+            poll_interval=app.config['SENTIMENT_POLL_INTERVAL'],
+            local_threshold=app.config['LOCAL_SENTIMENT_THRESHOLD']
+        ).run_forever()
+
+    @app.cli.command('prompt-worker')
+    @click.option('--threads', default=app.config['PROMPT_WORKER_THREADS'] or 1, show_default=True,
+                  help="Number of worker threads.")
+    def prompt_worker(threads):
+        """Keep the users' journaling prompt pools filled, in the foreground."""
+        PromptWorkerPool(
+            require_db(),
+            threads=threads,
+            pool_size=app.config['PROMPT_POOL_SIZE'],
+            max_age=app.config['PROMPT_POOL_MAX_AGE'],
+            idle_days=app.config['PROMPT_POOL_IDLE_DAYS'],
+            sweep_interval=app.config['PROMPT_POOL_SWEEP_INTERVAL'],
+            related_limit=app.config['RELATED_CONTEXT_ENTRIES'],
+            context_chars=app.config['RELATED_CONTEXT_CHARS']
+        ).run_forever()
+
+    @app.cli.command('backfill-sentiment')
+    @click.option('--status', 'statuses', multiple=True, default=['unknown', 'error'], show_default=True,
+                  help="Sentiment values to reclassify (repeatable).")
+    @click.option('--user', 'username', default=None, help="Only this user's entries.")
+    @click.option('--since', type=click.DateTime(formats=['%Y-%m-%d']), default=None,
+                  help="Only entries on or after this date (YYYY-MM-DD).")
+    @click.option('--until', type=click.DateTime(formats=['%Y-%m-%d']), default=None,
+                  help="Only entries on or before this date (YYYY-MM-DD).")
+    @click.option('--concurrency', default=4, show_default=True, help="Gemini calls in flight.")
+    @click.option('--batch-size', default=app.config['SENTIMENT_BATCH_SIZE'], show_default=True,
+                  help="Entries classified per Gemini call.")
+    @click.option('--rate', default=5.0, show_default=True, help="Maximum Gemini calls per second.")
+    @click.option('--job-name', default=None, help="Checkpoint name (defaults to a hash of the filter).")
+    @click.option('--restart', is_flag=True, help="Ignore any saved checkpoint and start over.")
+    @click.option('--llm-only', is_flag=True, help="Skip the local classifier and send every entry to Gemini.")
+    def backfill_sentiment(statuses, username, since, until, concurrency, batch_size, rate, job_name, restart, llm_only):
+        """Reclassify stored entries in bulk, resuming from the last checkpoint."""
+        if until:
+            # Include the whole end day
+            until = until.replace(hour=23, minute=59, second=59, microsecond=999999)
+        query = build_backfill_filter(statuses, username, since, until)
+        backfill = SentimentBackfill(require_db(), query, job_name=job_name, concurrency=concurrency,
+                                     batch_size=batch_size, rate=rate,
+                                     local_threshold=None if llm_only else app.config['LOCAL_SENTIMENT_THRESHOLD'])
+        if restart:
+            backfill.reset_checkpoint()
+        click.echo(f"Backfill {backfill.job_name}: filter {query}")
+        backfill.run()
+
+    @app.cli.command('rebuild-rollups')
+    @click.option('--user', 'username', default=None, help="Only rebuild this user's rollups.")
+    def rebuild_rollups_command(username):
+        """Recompute the sentiment rollups from journal_entries; run once so older users' summaries read them."""
+        written = rebuild_rollups(require_db(), username)
+        click.echo(f"Rebuilt {written} rollup day(s)")
+
+    @app.cli.command('migrate-entries')
+    @click.option('--batch-size', default=MIGRATION_BATCH_SIZE, show_default=True, help="Entries rewritten per update.")
+    def migrate_entries_command(batch_size):
+        """Rewrite stored journal entries to the compact schema (drops date_display and null sentiment_tier)."""
+        migrated = migrate_entries(require_db(), batch_size, report=click.echo)
+        click.echo(f"Done: {migrated} entries migrated")
+
+    @app.cli.command('reembed-entries')
+    @click.option('--user', 'username', default=None, help="Only this user's entries.")
+    @click.option('--batch-size', default=EMBED_BATCH_SIZE, show_default=True, help="Entries rewritten per update.")
+    def reembed_entries_command(username, batch_size):
+        """Embed entries that have no embedding and recompute ones made by an older EMBEDDING_VERSION."""
+        written = reembed_entries(require_db(), username, batch_size, report=click.echo)
+        click.echo(f"Done: {written} entries re-embedded")
+
+    @app.cli.command('train-sentiment-model')
+    @click.option('--limit', default=50000, show_default=True, help="Most recent Gemini-labelled entries to train on.")
+    @click.option('--epochs', default=150, show_default=True, help="Gradient descent iterations.")
+    @click.option('--holdout', default=0.2, show_default=True, help="Fraction of entries kept back to measure agreement.")
+    def train_sentiment_model(limit, epochs, holdout):
+        """Train the local sentiment model on Gemini-labelled entries and publish it to all workers."""
+        db = require_db()
+        texts, labels = load_training_data(db, limit)
+        if len(texts) < 50:
+            raise click.ClickException(f"Only {len(texts)} labelled entries; need at least 50 to train")
+
+        # The data is newest first; hold back every n-th entry rather than the newest ones
+        step = max(2, round(1 / holdout)) if holdout > 0 else None
+        test = [i for i in range(len(texts)) if step and i % step == 0]
+        train = [i for i in range(len(texts)) if not step or i % step]
+        model = LinearSentimentModel.train([texts[i] for i in train], [labels[i] for i in train], epochs=epochs)
+        metrics = {}
+        if test:
+            predictions = model.predict([texts[i] for i in test])
+            agreement = sum(label == labels[i] for (label, _), i in zip(predictions, test)) / len(test)
+            metrics = {"holdout": len(test), "agreement": round(agreement, 4)}
+            click.echo(f"Held-out agreement with Gemini labels: {agreement:.1%} on {len(test)} entries")
+
+        # Publish the model trained on everything, so held-out entries are not wasted
+        if test:
+            model = LinearSentimentModel.train(texts, labels, epochs=epochs)
+        save_model(db, model, len(texts), metrics)
+        click.echo(f"Saved model trained on {len(texts)} entries; workers pick it up within 10 minutes")
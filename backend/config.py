@@ -1,4 +1,5 @@
 import os
+import tempfile
 
 class Config:
         """Base configuration class."""
@@ -7,7 +8,166 @@ class Config:
         # Set this to False in production
         DEBUG = True
         TESTING = False
-        # Add any other configuration variables here
+
+        # --- MongoDB client ---
+        # The client is created lazily in each worker process (see services/db_services.get_db).
+        # These settings take precedence over the same options given in MONGO_URI.
+        MONGO_DB_NAME = os.environ.get('MONGO_DB_NAME', 'mindease_db')
+        MONGO_MAX_POOL_SIZE = int(os.environ.get('MONGO_MAX_POOL_SIZE', '20'))
+        MONGO_MIN_POOL_SIZE = int(os.environ.get('MONGO_MIN_POOL_SIZE', '0'))
+        MONGO_MAX_IDLE_TIME_MS = int(os.environ.get('MONGO_MAX_IDLE_TIME_MS', '300000'))
+        # How long a request may wait for a free pooled connection
+        MONGO_WAIT_QUEUE_TIMEOUT_MS = int(os.environ.get('MONGO_WAIT_QUEUE_TIMEOUT_MS', '5000'))
+        MONGO_CONNECT_TIMEOUT_MS = int(os.environ.get('MONGO_CONNECT_TIMEOUT_MS', '5000'))
+        MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.environ.get('MONGO_SERVER_SELECTION_TIMEOUT_MS', '5000'))
+        MONGO_SOCKET_TIMEOUT_MS = int(os.environ.get('MONGO_SOCKET_TIMEOUT_MS', '20000'))
+        # primary, primaryPreferred, secondary, secondaryPreferred or nearest
+        MONGO_READ_PREFERENCE = os.environ.get('MONGO_READ_PREFERENCE', 'primary')
+
+        # --- Time zone ---
+        # Time zone of the server clock. Entry timestamps are stored as naive server-local
+        # times and the sentiment rollups count server-local days; trends requested in
+        # another time zone are counted from the entries instead.
+        SERVER_TIMEZONE = os.environ.get('SERVER_TIMEZONE', 'UTC')
+
+        # --- Journal listing ---
+        JOURNAL_PAGE_SIZE = int(os.environ.get('JOURNAL_PAGE_SIZE', '20'))
+        JOURNAL_PAGE_SIZE_MAX = int(os.environ.get('JOURNAL_PAGE_SIZE_MAX', '100'))
+
+        # --- Delta sync (GET /journal/<username>/changes) ---
+        JOURNAL_CHANGES_PAGE_SIZE = int(os.environ.get('JOURNAL_CHANGES_PAGE_SIZE', '500'))
+        # Changes this recent are sent again on the next sync, in case writes from
+        # other processes became visible out of order (commit delay, clock skew)
+        JOURNAL_CHANGES_LAG_SECONDS = float(os.environ.get('JOURNAL_CHANGES_LAG_SECONDS', '10'))
+
+        # --- Related entries (services/embeddings.py) ---
+        # Default and maximum page size of GET /journal/<username>/related/<entry_id>
+        RELATED_ENTRIES_LIMIT = int(os.environ.get('RELATED_ENTRIES_LIMIT', '5'))
+        RELATED_ENTRIES_LIMIT_MAX = int(os.environ.get('RELATED_ENTRIES_LIMIT_MAX', '50'))
+        # Past entries the prompt and insight routes add to the LLM prompt, and the characters kept from each
+        RELATED_CONTEXT_ENTRIES = int(os.environ.get('RELATED_CONTEXT_ENTRIES', '3'))
+        RELATED_CONTEXT_CHARS = int(os.environ.get('RELATED_CONTEXT_CHARS', '400'))
+
+        # --- Journal import (POST /journal/<username>/import) ---
+        # Entries written per insert_many batch
+        JOURNAL_IMPORT_BATCH_SIZE = int(os.environ.get('JOURNAL_IMPORT_BATCH_SIZE', '500'))
+        # Longer NDJSON lines are skipped and reported as errors
+        JOURNAL_IMPORT_MAX_LINE_BYTES = int(os.environ.get('JOURNAL_IMPORT_MAX_LINE_BYTES', str(64 * 1024)))
+
+        # --- Period summaries ---
+        # Ranges with at most this much entry text are summarized in a single prompt
+        PERIOD_SUMMARY_DIRECT_CHARS = int(os.environ.get('PERIOD_SUMMARY_DIRECT_CHARS', '8000'))
+        # Longer ranges are split into at most this many calendar buckets (week/month/quarter/year)
+        PERIOD_SUMMARY_MAX_BUCKETS = int(os.environ.get('PERIOD_SUMMARY_MAX_BUCKETS', '12'))
+        # Entry text budget for each bucket's prompt
+        PERIOD_SUMMARY_BUCKET_CHARS = int(os.environ.get('PERIOD_SUMMARY_BUCKET_CHARS', '12000'))
+
+        # --- Gemini client ---
+        # GEMINI_API_BASE can point at a local stub server for offline testing/benchmarks.
+        GEMINI_API_KEY = os.environ.get('GEMINI_API_KEY', '')
+        GEMINI_API_BASE = os.environ.get('GEMINI_API_BASE', 'https://generativelanguage.googleapis.com/v1beta')
+        GEMINI_MODEL = os.environ.get('GEMINI_MODEL', 'gemini-2.0-flash')
+        # Per-attempt timeouts in seconds (connect, read)
+        GEMINI_CONNECT_TIMEOUT = float(os.environ.get('GEMINI_CONNECT_TIMEOUT', '3.05'))
+        GEMINI_READ_TIMEOUT = float(os.environ.get('GEMINI_READ_TIMEOUT', '20'))
+        # Total time budget for one logical call, including all retries and backoff
+        GEMINI_TOTAL_DEADLINE = float(os.environ.get('GEMINI_TOTAL_DEADLINE', '30'))
+        GEMINI_MAX_RETRIES = int(os.environ.get('GEMINI_MAX_RETRIES', '2'))
+        GEMINI_BACKOFF_BASE = float(os.environ.get('GEMINI_BACKOFF_BASE', '0.25'))
+        GEMINI_BACKOFF_CAP = float(os.environ.get('GEMINI_BACKOFF_CAP', '4'))
+        # Size of the per-worker keep-alive connection pool
+        GEMINI_POOL_MAXSIZE = int(os.environ.get('GEMINI_POOL_MAXSIZE', '10'))
+        # Connections the async client (ASGI mode, asgi.py) may hold open at once
+        GEMINI_ASYNC_MAX_CONNECTIONS = int(os.environ.get('GEMINI_ASYNC_MAX_CONNECTIONS', '200'))
+
+        # --- Gemini circuit breaker and hedged requests (services/circuit_breaker.py) ---
+        # The breaker is per worker process: each gunicorn worker opens and probes on its own
+        GEMINI_BREAKER_ENABLED = os.environ.get('GEMINI_BREAKER_ENABLED', 'true').lower() == 'true'
+        # Rolling window in seconds, and the attempts it needs before it can open
+        GEMINI_BREAKER_WINDOW = int(os.environ.get('GEMINI_BREAKER_WINDOW', '30'))
+        GEMINI_BREAKER_MIN_CALLS = int(os.environ.get('GEMINI_BREAKER_MIN_CALLS', '10'))
+        # Opens when this share of attempts in the window failed...
+        GEMINI_BREAKER_ERROR_RATE = float(os.environ.get('GEMINI_BREAKER_ERROR_RATE', '0.5'))
+        # ...or this share took longer than GEMINI_BREAKER_SLOW_CALL seconds
+        GEMINI_BREAKER_SLOW_CALL = float(os.environ.get('GEMINI_BREAKER_SLOW_CALL', '10'))
+        GEMINI_BREAKER_SLOW_RATE = float(os.environ.get('GEMINI_BREAKER_SLOW_RATE', '0.8'))
+        # Seconds calls fail fast before a probe is let through
+        GEMINI_BREAKER_OPEN_SECONDS = float(os.environ.get('GEMINI_BREAKER_OPEN_SECONDS', '15'))
+        # Latency-sensitive calls send a second request after the recent p95 latency (needs the breaker)
+        GEMINI_HEDGE_ENABLED = os.environ.get('GEMINI_HEDGE_ENABLED', 'false').lower() == 'true'
+        GEMINI_HEDGE_MIN_DELAY = float(os.environ.get('GEMINI_HEDGE_MIN_DELAY', '0.25'))
+
+        # --- LLM response cache ---
+        LLM_CACHE_ENABLED = os.environ.get('LLM_CACHE_ENABLED', 'true').lower() == 'true'
+        LLM_CACHE_MAX_ENTRIES = int(os.environ.get('LLM_CACHE_MAX_ENTRIES', '1024'))
+        LLM_CACHE_TTL = float(os.environ.get('LLM_CACHE_TTL', '86400'))
+        # Persistent tier in the llm_cache collection, shared by all workers
+        LLM_CACHE_PERSISTENT = os.environ.get('LLM_CACHE_PERSISTENT', 'false').lower() == 'true'
+        LLM_CACHE_PERSISTENT_TTL = int(os.environ.get('LLM_CACHE_PERSISTENT_TTL', str(7 * 86400)))
+
+        # --- LLM admission scheduler (services/llm_scheduler.py) ---
+        LLM_SCHEDULER_ENABLED = os.environ.get('LLM_SCHEDULER_ENABLED', 'true').lower() == 'true'
+        # SQLite file shared by all worker processes on the host; must be on a local disk
+        LLM_SCHEDULER_PATH = os.environ.get('LLM_SCHEDULER_PATH',
+                                            os.path.join(tempfile.gettempdir(), 'mindease_llm_scheduler.db'))
+        # Global budgets, matching the Gemini project quota
+        LLM_GLOBAL_RPM = int(os.environ.get('LLM_GLOBAL_RPM', '1000'))
+        LLM_GLOBAL_TPM = int(os.environ.get('LLM_GLOBAL_TPM', '1000000'))
+        # Per-user budget for insights, prompts and summaries (sentiment is exempt)
+        LLM_USER_RPM = float(os.environ.get('LLM_USER_RPM', '10'))
+        LLM_USER_BURST = int(os.environ.get('LLM_USER_BURST', '5'))
+        # Calls not admitted within this many seconds fail with HTTP 429
+        LLM_ADMISSION_MAX_WAIT = float(os.environ.get('LLM_ADMISSION_MAX_WAIT', '10'))
+
+        # --- Background sentiment classification ---
+        # When true, new entries are saved as "pending" and classified by the sentiment workers
+        SENTIMENT_ASYNC = os.environ.get('SENTIMENT_ASYNC', 'true').lower() == 'true'
+        # Worker threads started inside each web process; set to 0 when running
+        # `flask --app app sentiment-worker` as a separate process instead
+        SENTIMENT_WORKER_THREADS = int(os.environ.get('SENTIMENT_WORKER_THREADS', '2'))
+        SENTIMENT_BATCH_SIZE = int(os.environ.get('SENTIMENT_BATCH_SIZE', '8'))
+        SENTIMENT_MAX_ATTEMPTS = int(os.environ.get('SENTIMENT_MAX_ATTEMPTS', '5'))
+        SENTIMENT_LEASE_SECONDS = int(os.environ.get('SENTIMENT_LEASE_SECONDS', '60'))
+        SENTIMENT_POLL_INTERVAL = float(os.environ.get('SENTIMENT_POLL_INTERVAL', '2'))
+
+        # --- Journaling prompt pool (services/prompt_pool.py) ---
+        # Prompts are generated in the background after each entry and served from a small
+        # per-user pool; the prompt route only calls Gemini itself when the pool is empty
+        PROMPT_POOL_ENABLED = os.environ.get('PROMPT_POOL_ENABLED', 'true').lower() == 'true'
+        PROMPT_POOL_SIZE = int(os.environ.get('PROMPT_POOL_SIZE', '3'))
+        # Pooled prompts older than this (seconds) are never served
+        PROMPT_POOL_MAX_AGE = int(os.environ.get('PROMPT_POOL_MAX_AGE', '86400'))
+        # Users active this recently get their pool refreshed on a schedule
+        PROMPT_POOL_IDLE_DAYS = int(os.environ.get('PROMPT_POOL_IDLE_DAYS', '14'))
+        PROMPT_POOL_SWEEP_INTERVAL = float(os.environ.get('PROMPT_POOL_SWEEP_INTERVAL', '600'))
+        # Worker threads started inside each web process; set to 0 when running
+        # `flask --app app prompt-worker` as a separate process instead
+        PROMPT_WORKER_THREADS = int(os.environ.get('PROMPT_WORKER_THREADS', '1'))
+
+        # --- Metrics ---
+        # Request, MongoDB and Gemini metrics at /metrics (Prometheus text format)
+        METRICS_ENABLED = os.environ.get('METRICS_ENABLED', 'true').lower() == 'true'
+
+        # --- ASGI serving mode (uvicorn asgi:app) ---
+        # Threads serving the non-LLM routes through the wrapped Flask app
+        ASGI_WSGI_THREADS = int(os.environ.get('ASGI_WSGI_THREADS', '10'))
+
+        # --- Password hashing (services/password_hashing.py) ---
+        # Werkzeug method string; stored hashes made with other parameters are upgraded on login
+        PASSWORD_HASH_METHOD = os.environ.get('PASSWORD_HASH_METHOD', 'scrypt:32768:8:1')
+        PASSWORD_SALT_LENGTH = int(os.environ.get('PASSWORD_SALT_LENGTH', '16'))
+        # Hashing processes per web process; 0 hashes inline on the request thread
+        PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS', '1'))
+        # Hashes running or queued per web process before requests get a 503
+        PASSWORD_HASH_MAX_PENDING = int(os.environ.get('PASSWORD_HASH_MAX_PENDING', '8'))
+        # Seconds a request waits for its hash before giving up with a 503
+        PASSWORD_HASH_TIMEOUT = float(os.environ.get('PASSWORD_HASH_TIMEOUT', '5'))
+
+        # --- Local sentiment fast path ---
+        # Entries the local classifier labels with at least this confidence skip Gemini
+        LOCAL_SENTIMENT_ENABLED = os.environ.get('LOCAL_SENTIMENT_ENABLED', 'true').lower() == 'true'
+        LOCAL_SENTIMENT_MIN_CONFIDENCE = float(os.environ.get('LOCAL_SENTIMENT_MIN_CONFIDENCE', '0.85'))
+        LOCAL_SENTIMENT_THRESHOLD = LOCAL_SENTIMENT_MIN_CONFIDENCE if LOCAL_SENTIMENT_ENABLED else None
 
 class DevelopmentConfig(Config):
         """Development specific configuration."""
@@ -18,4 +178,18 @@ class ProductionConfig(Config):
         DEBUG = False
         TESTING = False
         # Ensure SECRET_KEY and MONGO_URI are set as environment variables in production
-    
\ No newline at end of file
+
+# create_app() picks one of these from the APP_ENV environment variable
+config_by_name = {
+        "development": DevelopmentConfig,
+        "production": ProductionConfig
+}
+
+
+def config_getter(config):
+        """
+        Returns a key -> value lookup for either a Flask config mapping or one of the classes above.
+        """
+        if isinstance(config, dict):
+                return config.get
+        return lambda key: getattr(config, key)
@@ -0,0 +1,23 @@
+"""
+Gunicorn settings, picked up automatically when gunicorn is started from this
+directory (e.g. `gunicorn app:app`).
+"""
+import os
+import shutil
+import tempfile
+
+# Each worker writes its metrics here and /metrics adds them up (services/metrics.py).
+# It has to be set before the workers import prometheus_client.
+os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR', os.path.join(tempfile.gettempdir(), 'mindease-metrics'))
+
+
+def on_starting(server):
+    # Files left over from a previous run would be counted again
+    path = os.environ['PROMETHEUS_MULTIPROC_DIR']
+    shutil.rmtree(path, ignore_errors=True)
+    os.makedirs(path)
+
+
+def child_exit(server, worker):
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,125 @@
+from flask import Blueprint, jsonify, request
+from pymongo.errors import DuplicateKeyError
+
+from services.db_services import get_db
+from services.password_hashing import PasswordHashingBusy, hash_password, verify_password
+from services.rollups import mark_rollups_complete
+
+auth_bp = Blueprint('auth', __name__)
+
+
+@auth_bp.errorhandler(PasswordHashingBusy)
+def password_hashing_busy(e):
+    # The hashing pool is full: shed the request rather than queue it behind the others
+    return jsonify({"error": "Server busy, please try again shortly"}), 503, {"Retry-After": "1"}
+
+
+# --- Custom Authentication Endpoints ---
+
+@auth_bp.route('/register', methods=['POST'])
+def register_user():
+    """
+    Endpoint for user registration.
+    Expects JSON: {"username": "user123", "password": "securepassword"}
+    """
+    data = request.get_json()
+    username = data.get('username')
+    password = data.get('password')
+
+    if not username or not password:
+        return jsonify({"error": "Username and password are required"}), 400
+
+    db = get_db()
+    if db is None: # Check if the database is configured
+        return jsonify({"error": "Database connection not available"}), 500
+
+    if db.users.find_one({"username": username}):
+        return jsonify({"error": "Username already exists"}), 409
+
+    hashed_password = hash_password(password)
+
+    user_data = {
+        "username": username,
+        "password": hashed_password
+    }
+
+    try:
+        db.users.insert_one(user_data)
+        # Their rollups count every entry from the first one, so summaries can read them straight away
+        mark_rollups_complete(db, username)
+        return jsonify({"message": "User registered successfully!"}), 201
+    except DuplicateKeyError:
+        # Registered by a concurrent request since the check above
+        return jsonify({"error": "Username already exists"}), 409
+    except Exception as e:
+        return jsonify({"error": f"Registration failed: {e}"}), 500
+
+@auth_bp.route('/login', methods=['POST'])
+def login_user():
+    """
+    Endpoint for user login.
+    Expects JSON: {"username": "user123", "password": "securepassword"}
+    """
+    data = request.get_json()
+    username = data.get('username')
+    password = data.get('password')
+
+    if not username or not password:
+        return jsonify({"error": "Username and password are required"}), 400
+
+    db = get_db()
+    if db is None: # Check if the database is configured
+        return jsonify({"error": "Database connection not available"}), 500
+
+    user = db.users.find_one({"username": username})
+    if not user:
+        return jsonify({"error": "Invalid username or password"}), 401
+
+    matches, new_hash = verify_password(user['password'], password)
+    if not matches:
+        return jsonify({"error": "Invalid username or password"}), 401
+
+    if new_hash:
+        # Stored with older hash parameters; upgrade it unless the password changed meanwhile
+        try:
+            db.users.update_one({"username": username, "password": user['password']},
+                                {"$set": {"password": new_hash}})
+        except Exception as e:
+            print(f"Could not upgrade the password hash for {username}: {e}")
+    return jsonify({"message": "Login successful!", "username": username}), 200
+
+@auth_bp.route('/change_password/<username>', methods=['PUT'])
+def change_password(username):
+    """
+    Endpoint for changing user password.
+    Expects JSON: {"old_password": "oldpassword", "new_password": "newpassword"}
+    """
+    data = request.get_json()
+    old_password = data.get('old_password')
+    new_password = data.get('new_password')
+
+    if not old_password or not new_password:
+        return jsonify({"error": "Old password and new password are required"}), 400
+
+    db = get_db()
+    if db is None: # Check if the database is configured
+        return jsonify({"error": "Database connection not available"}), 500
+
+    user = db.users.find_one({"username": username})
+
+    if not user:
+        return jsonify({"error": "User not found"}), 404
+
+    if not verify_password(user['password'], old_password)[0]:
+        return jsonify({"error": "Incorrect old password"}), 401
+
+    hashed_new_password = hash_password(new_password)
+
+    try:
+        db.users.update_one(
+            {"username": username},
+            {"$set": {"password": hashed_new_password}}
+        )
+        return jsonify({"message": "Password updated successfully!"}), 200
+    except Exception as e:
+        return jsonify({"error": f"Failed to update password: {e}"}), 500
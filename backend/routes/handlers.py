@@ -0,0 +1,498 @@
+"""
+Framework-independent handlers for the LLM-backed journal routes.
+
+Each handler is a generator that yields the slow steps it needs, an LLMText
+call or a Blocking (database) call, and returns either a (body, status) pair
+or an SSEReply. The Flask views run handlers with run_sync(), which performs
+each step inline; the ASGI app (asgi.py) runs the same handlers with
+run_async(), which awaits the async Gemini client and runs Blocking steps on a
+thread. Errors raised by a step are thrown back into the handler, so its
+try/except blocks behave the same in both modes.
+"""
+import asyncio
+import json
+import math
+from datetime import datetime
+
+from bson.objectid import ObjectId
+from pymongo import ReturnDocument
+
+from services.ai_services import (GeminiCircuitOpen, GeminiError, GeminiHTTPError, GeminiQuotaExceeded,
+                                  get_gemini_client, normalize_sentiment, sentiment_request)
+from services.embeddings import embedding_field, related_to_text
+from services.entry_schema import display_date
+from services.llm_scheduler import PRIORITY_INTERACTIVE, PRIORITY_SENTIMENT, llm_request
+from services.local_sentiment import TIER_LLM, TIER_LOCAL, get_local_classifier
+from services.period_summary import PeriodSummarizer
+from services.prompt_pool import (PROMPT_MAX_OUTPUT_TOKENS, PROMPT_TEMPERATURE, context_lines, journal_prompt_request,
+                                  prompt_context_text, schedule_refill, take_prompt)
+from services.rollups import record_sentiment_change
+from services.sentiment_queue import PENDING_SENTIMENT, enqueue_sentiment
+from services.versioning import bump_version
+
+# --- Steps ---
+
+class LLMText:
+    """
+    Step: generate text for a prompt. Yields back the text (or None).
+    The call is admitted by the LLM scheduler on behalf of user, in the given priority class
+    (quota=False if the handler already charged the user, see _charged_once);
+    hedge=True marks it latency-sensitive (see GeminiClient.generate).
+    """
+
+    def __init__(self, prompt, temperature, max_output_tokens, use_cache=True, user=None, priority=PRIORITY_INTERACTIVE,
+                 hedge=False, quota=True):
+        self.kwargs = {"prompt": prompt, "temperature": temperature,
+                       "max_output_tokens": max_output_tokens, "use_cache": use_cache, "hedge": hedge}
+        self.user = user
+        self.priority = priority
+        self.quota = quota
+
+    def run(self):
+        with llm_request(self.user, self.priority, self.quota):
+            return get_gemini_client().generate_text(**self.kwargs)
+
+    async def arun(self, llm):
+        with llm_request(self.user, self.priority, self.quota):
+            return await llm.generate_text(**self.kwargs)
+
+
+class LLMStream:
+    """Step: start streaming text for a prompt. Yields back the first chunk and the rest, or (None, None)."""
+
+    def __init__(self, prompt, temperature, max_output_tokens, user=None, priority=PRIORITY_INTERACTIVE, quota=True):
+        self.kwargs = {"prompt": prompt, "temperature": temperature, "max_output_tokens": max_output_tokens}
+        self.user = user
+        self.priority = priority
+        self.quota = quota
+
+    def run(self):
+        # The first chunk is awaited here, so failures before any output (including
+        # a refused admission, which happens before the request) reach the handler
+        with llm_request(self.user, self.priority, self.quota):
+            chunks = iter(get_gemini_client().stream_text(**self.kwargs))
+            first = next(chunks, None)
+        return (first, chunks) if first else (None, None)
+
+    async def arun(self, llm):
+        with llm_request(self.user, self.priority, self.quota):
+            chunks = llm.stream_text(**self.kwargs)
+            first = await anext(chunks, None)
+        return (first, chunks) if first else (None, None)
+
+
+class Blocking:
+    """Step: call fn(*args), which may block (e.g. MongoDB). Yields back its result."""
+
+    def __init__(self, fn, *args):
+        self.fn = fn
+        self.args = args
+
+    def run(self):
+        return self.fn(*self.args)
+
+    async def arun(self, llm):
+        return await asyncio.to_thread(self.fn, *self.args)
+
+
+class SSEReply:
+    """
+    Handler result for a streamed answer: {field: text} events for each chunk,
+    then an "error" event or a final "done" event carrying `done`.
+    """
+
+    def __init__(self, first, chunks, field, done=None):
+        self.first = first
+        self.chunks = chunks
+        self.field = field
+        self.done = done or {}
+
+
+def run_sync(handler):
+    """
+    Runs a handler in the calling thread and returns its result.
+    """
+    result, error = None, None
+    while True:
+        try:
+            step = handler.throw(error) if error is not None else handler.send(result)
+        except StopIteration as stop:
+            return stop.value
+        result, error = None, None
+        try:
+            result = step.run()
+        except Exception as e:
+            error = e
+
+
+async def run_async(handler, llm):
+    """
+    Runs a handler on the event loop with the AsyncGeminiClient llm and returns its result.
+    """
+    result, error = None, None
+    while True:
+        try:
+            step = handler.throw(error) if error is not None else handler.send(result)
+        except StopIteration as stop:
+            return stop.value
+        result, error = None, None
+        try:
+            result = await step.arun(llm)
+        except Exception as e:
+            error = e
+
+
+# --- Server-Sent Events helpers ---
+
+def wants_event_stream(args, headers):
+    """
+    True if the client opted into streaming with ?stream=true or Accept: text/event-stream.
+    """
+    return (args.get('stream', 'false').lower() == 'true'
+            or 'text/event-stream' in headers.get('Accept', ''))
+
+def sse_event(data, event=None):
+    prefix = f"event: {event}\n" if event else ""
+    return f"{prefix}data: {json.dumps(data)}\n\n"
+
+def sse_error(field, error):
+    print(f"Error while streaming {field} from Gemini API: {error}")
+    return sse_event({"error": f"Stream interrupted: {error}"}, event="error")
+
+SSE_HEADERS = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+
+# --- Handlers ---
+
+def quota_exceeded(e):
+    """
+    The (body, status) reply for a call the LLM scheduler refused.
+    """
+    return {"error": "Too many AI requests right now, please try again shortly.",
+            "retry_after": math.ceil(e.retry_after)}, 429
+
+
+def upstream_unavailable(e):
+    """
+    The (body, status) reply for a call failed fast by the open circuit breaker.
+    """
+    return {"error": "The AI service is temporarily unavailable, please try again shortly.",
+            "retry_after": math.ceil(e.retry_after)}, 503
+
+
+def _charged_once(username, fn, *args):
+    """
+    Charges username's LLM quota once, then calls fn(*args) with the Gemini
+    calls it makes attributed to username but not charged again (for
+    Blocking steps that make several calls for one request).
+    """
+    get_gemini_client().charge_user(username)
+    with llm_request(username, PRIORITY_INTERACTIVE, quota=False):
+        return fn(*args)
+
+
+def _llm_sentiment(text, username=None):
+    """
+    Classifies text with Gemini, returning 'error' if the call failed.
+    GeminiCircuitOpen is raised, so callers can do better than 'error'.
+    """
+    try:
+        return normalize_sentiment((yield LLMText(**sentiment_request(text), user=username, priority=PRIORITY_SENTIMENT,
+                                                  hedge=True)))
+    except GeminiCircuitOpen:
+        raise
+    except GeminiError as e:
+        print(f"Error calling Gemini API for sentiment: {e}")
+        return "error"
+
+
+def _save_entry(db, journal_entry):
+    result = db.journal_entries.insert_one(journal_entry)
+    record_sentiment_change(db, journal_entry["username"], journal_entry["timestamp"], None, journal_entry["sentiment"])
+    bump_version(db, journal_entry["username"], entries=True)
+    if journal_entry["sentiment"] == PENDING_SENTIMENT:
+        enqueue_sentiment(db, result.inserted_id, journal_entry["username"])
+    return result.inserted_id
+
+
+def add_journal_entry(db, config, username, data):
+    if not data or 'text' not in data:
+        return {"error": "Missing 'text' field in request"}, 400
+    if not isinstance(data['text'], str):
+        return {"error": "'text' must be a string"}, 400
+
+    if db is None: # Check if the database is configured
+        return {"error": "Database connection not available"}, 500
+
+    entry_text = data['text']
+    timestamp = datetime.now()
+
+    sentiment, tier = None, None
+    threshold = config['LOCAL_SENTIMENT_THRESHOLD']
+    if threshold is not None:
+        label, confidence = yield Blocking(lambda: get_local_classifier(db).predict([entry_text])[0])
+        if confidence >= threshold:
+            sentiment, tier = label, TIER_LOCAL
+    if sentiment is None and config['SENTIMENT_ASYNC']:
+        sentiment = PENDING_SENTIMENT
+    elif sentiment is None:
+        try:
+            sentiment, tier = (yield from _llm_sentiment(entry_text, username)), TIER_LLM
+        except GeminiCircuitOpen:
+            # Gemini is down: the local classifier's best guess beats storing "error"
+            sentiment, _ = yield Blocking(lambda: get_local_classifier(db).predict([entry_text])[0])
+            tier = TIER_LOCAL
+        print(f"Generated sentiment for entry: '{entry_text[:30]}...' is '{sentiment}'")
+
+    journal_entry = {
+        "text": entry_text,
+        "timestamp": timestamp,
+        "username": username,
+        "sentiment": sentiment, # Store the sentiment
+        "updated_at": datetime.utcnow(), # For /journal/<username>/changes
+        "embedding": embedding_field(entry_text) # For related-entry lookups
+    }
+    if tier is not None:
+        # "local" or "llm"; left out while pending, as in the compact schema
+        journal_entry["sentiment_tier"] = tier
+
+    try:
+        save = _save_entry_and_schedule_prompt if config['PROMPT_POOL_ENABLED'] else _save_entry
+        inserted_id = yield Blocking(save, db, journal_entry)
+        return {
+            "message": "Journal entry added successfully!",
+            "id": str(inserted_id),
+            "entry": {
+                "id": str(inserted_id),
+                "text": entry_text,
+                "date": display_date(timestamp),
+                "sentiment": sentiment # Include sentiment in the response
+            }
+        }, 201
+    except Exception as e:
+        return {"error": f"Failed to save journal entry: {e}"}, 500
+
+
+def journal_insight(db, config, data, stream=False):
+    print("\n--- Insight Request Received ---")
+
+    if not data or 'text' not in data:
+        print("Insight Error: Missing 'text' field in insight request.")
+        return {"error": "Missing 'text' field in request"}, 400
+
+    journal_text = data['text']
+    print(f"Insight Request Text: '{journal_text[:50]}...'")
+
+    # With a username, the user's most similar past entries are added as context
+    related_context = ""
+    if data.get('username') and db is not None:
+        try:
+            related = yield Blocking(related_to_text, db, data['username'], journal_text,
+                                     config['RELATED_CONTEXT_ENTRIES'])
+            if related:
+                related_context = f"""
+
+    Related past entries by the same user (for context only):
+    {context_lines(related, config['RELATED_CONTEXT_CHARS'])}"""
+        except Exception as e:
+            # The insight is still useful without the context
+            print(f"Insight Warning: could not look up related entries: {e}")
+
+    prompt = f"""Analyze the following journal entry and provide a concise, supportive, and insightful summary or reflection. Focus on identifying key emotions, themes, or potential areas for growth. Keep it under 100 words.
+
+    Journal Entry:
+    "{journal_text}"{related_context}
+
+    Insight:"""
+
+    try:
+        if stream:
+            first, chunks = yield LLMStream(prompt, temperature=0.7, max_output_tokens=200, user=data.get('username'))
+            if first is None:
+                return {"error": "No insight generated by LLM (LLM response empty or malformed)."}, 500
+            return SSEReply(first, chunks, "insight")
+
+        insight_text = yield LLMText(prompt, temperature=0.7, max_output_tokens=200, user=data.get('username'), hedge=True)
+
+        if insight_text:
+            print(f"Insight Generated Successfully: {insight_text[:50]}...")
+            return {"insight": insight_text}, 200
+        else:
+            print("Insight Error: LLM returned no candidates or content (500).")
+            return {"error": "No insight generated by LLM (LLM response empty or malformed)."}, 500
+
+    except GeminiQuotaExceeded as e:
+        print(f"Insight Error: {e}")
+        return quota_exceeded(e)
+    except GeminiCircuitOpen as e:
+        print(f"Insight Error: {e}")
+        return upstream_unavailable(e)
+    except GeminiHTTPError as e:
+        print(f"Insight Error: HTTP Error calling Gemini API: {e.status_code} - {e.body}")
+        return {"error": f"Failed to get insight from LLM (HTTP Error): {e.status_code}"}, 500
+    except GeminiError as e:
+        print(f"Insight Error: Network/Connection Error calling Gemini API: {e}")
+        return {"error": f"Failed to get insight from LLM (Network Error): {e}"}, 500
+    except Exception as e:
+        print(f"Insight Error: An unexpected error occurred during insight generation: {e}")
+        return {"error": f"An unexpected error occurred during insight generation: {e}"}, 500
+
+
+def _apply_sentiment_update(db, username, entry_id, new_sentiment):
+    # Returns the document as it was before the update, so the rollups
+    # can take the previous sentiment off even if it changed meanwhile
+    previous = db.journal_entries.find_one_and_update(
+        {"_id": ObjectId(entry_id), "username": username},
+        {"$set": {"sentiment": new_sentiment, "sentiment_tier": TIER_LLM, "updated_at": datetime.utcnow()}},
+        projection={"sentiment": 1, "timestamp": 1},
+        return_document=ReturnDocument.BEFORE
+    )
+    if previous:
+        record_sentiment_change(db, username, previous['timestamp'], previous.get('sentiment') or 'unknown', new_sentiment)
+        bump_version(db, username)
+
+
+def update_journal_sentiment(db, username, entry_id):
+    if db is None: # Check if the database is configured
+        return {"error": "Database connection not available"}, 500
+
+    try:
+        entry = yield Blocking(db.journal_entries.find_one, {"_id": ObjectId(entry_id), "username": username}, {"text": 1})
+
+        if not entry:
+            return {"error": "Journal entry not found or unauthorized"}, 404
+
+        entry_text = entry['text']
+
+        new_sentiment = yield from _llm_sentiment(entry_text, username)
+        print(f"Updating sentiment for entry {entry_id} to: {new_sentiment}")
+
+        yield Blocking(_apply_sentiment_update, db, username, entry_id, new_sentiment)
+
+        return {
+            "message": "Sentiment updated successfully!",
+            "id": entry_id,
+            "new_sentiment": new_sentiment
+        }, 200
+    except GeminiCircuitOpen as e:
+        # Keep the current sentiment rather than overwriting it with "error"
+        return upstream_unavailable(e)
+    except Exception as e:
+        print(f"Error updating sentiment for entry {entry_id}: {e}")
+        return {"error": f"Failed to update sentiment: {e}"}, 500
+
+
+def _save_entry_and_schedule_prompt(db, journal_entry):
+    inserted_id = _save_entry(db, journal_entry)
+    # The next suggested prompt should reflect this entry
+    schedule_refill(db, journal_entry["username"])
+    return inserted_id
+
+
+def generate_journal_prompt(db, config, username):
+    try:
+        if db is None: # Check if the database is configured
+            return {"error": "Database connection not available"}, 500
+
+        if config['PROMPT_POOL_ENABLED']:
+            pooled_prompt = yield Blocking(take_prompt, db, username, config['PROMPT_POOL_MAX_AGE'])
+            if pooled_prompt:
+                return {"prompt": pooled_prompt}, 200
+
+        # Pool empty (or disabled): generate one now
+        context_text = yield Blocking(prompt_context_text, db, username,
+                                      config['RELATED_CONTEXT_ENTRIES'], config['RELATED_CONTEXT_CHARS'])
+        llm_prompt = journal_prompt_request(context_text)
+
+        # Slightly higher temperature for more creative prompts. Not cached: asking
+        # again should give the user a different suggestion.
+        generated_prompt = yield LLMText(llm_prompt, temperature=PROMPT_TEMPERATURE,
+                                         max_output_tokens=PROMPT_MAX_OUTPUT_TOKENS, use_cache=False, user=username,
+                                         hedge=True)
+
+        if generated_prompt:
+            return {"prompt": generated_prompt.strip()}, 200
+        else:
+            return {"error": "Failed to generate a journaling prompt from LLM."}, 500
+
+    except GeminiQuotaExceeded as e:
+        print(f"Prompt generation refused: {e}")
+        return quota_exceeded(e)
+    except GeminiCircuitOpen as e:
+        print(f"Prompt generation failed fast: {e}")
+        return upstream_unavailable(e)
+    except GeminiHTTPError as e:
+        print(f"Error calling Gemini API for prompt generation: {e.status_code} - {e.body}")
+        return {"error": f"Failed to generate prompt (HTTP Error): {e.status_code}"}, 500
+    except GeminiError as e:
+        print(f"Network error calling Gemini API for prompt generation: {e}")
+        return {"error": f"Failed to generate prompt (Network Error): {e}"}, 500
+    except Exception as e:
+        print(f"Unexpected error in prompt generation: {e}")
+        return {"error": f"An unexpected error occurred during prompt generation: {e}"}, 500
+
+
+def get_period_summary(db, config, username, data, stream=False):
+    data = data or {}
+    start_date_str = data.get('start_date')
+    end_date_str = data.get('end_date')
+
+    if not start_date_str or not end_date_str:
+        return {"error": "Start date and end date are required."}, 400
+
+    if db is None: # Check if the database is configured
+        return {"error": "Database connection not available"}, 500
+
+    try:
+        # Convert date strings to datetime objects
+        start_date = datetime.strptime(start_date_str, "%Y-%m-%d")
+        end_date = datetime.strptime(end_date_str, "%Y-%m-%d")
+        # To include entries on the end_date, set its time to the end of the day
+        end_date = end_date.replace(hour=23, minute=59, second=59, microsecond=999999)
+
+        # Long ranges are summarized per bucket first and the bucket summaries reduced.
+        # This step reads MongoDB and may make the (sync) bucket LLM calls, so it counts as blocking.
+        summarizer = PeriodSummarizer(
+            db,
+            direct_chars=config['PERIOD_SUMMARY_DIRECT_CHARS'],
+            max_buckets=config['PERIOD_SUMMARY_MAX_BUCKETS'],
+            bucket_chars=config['PERIOD_SUMMARY_BUCKET_CHARS']
+        )
+        # One request from the user's quota covers the bucket calls and the final call
+        llm_prompt, entry_count = yield Blocking(_charged_once, username, summarizer.build_prompt, username, start_date,
+                                                 end_date)
+
+        if llm_prompt is None:
+            return {"summary": "No journal entries found for the selected period."}, 200
+
+        # Higher max tokens for a more comprehensive summary
+        if stream:
+            first, chunks = yield LLMStream(llm_prompt, temperature=0.7, max_output_tokens=300, user=username, quota=False)
+            if first is None:
+                return {"error": "Failed to generate a period summary from LLM."}, 500
+            return SSEReply(first, chunks, "summary", done={"entry_count": entry_count})
+
+        generated_summary = yield LLMText(llm_prompt, temperature=0.7, max_output_tokens=300, user=username,
+                                          quota=False)
+
+        if generated_summary:
+            return {"summary": generated_summary.strip(), "entry_count": entry_count}, 200
+        else:
+            return {"error": "Failed to generate a period summary from LLM."}, 500
+
+    except ValueError:
+        return {"error": "Invalid date format. Please use YYYY-MM-DD."}, 400 # Fixed line
+    except GeminiQuotaExceeded as e:
+        print(f"Period summary refused: {e}")
+        return quota_exceeded(e)
+    except GeminiCircuitOpen as e:
+        print(f"Period summary failed fast: {e}")
+        return upstream_unavailable(e)
+    except GeminiHTTPError as e:
+        print(f"Error calling Gemini API for period summary: {e.status_code} - {e.body}")
+        return {"error": f"Failed to generate period summary (HTTP Error): {e.status_code}"}, 500
+    except GeminiError as e:
+        print(f"Network error calling Gemini API for period summary: {e}")
+        return {"error": f"Failed to generate period summary (Network Error): {e}"}, 500
+    except Exception as e:
+        print(f"Unexpected error in period summary generation: {e}")
+        return {"error": f"An unexpected error occurred during period summary generation: {e}"}, 500
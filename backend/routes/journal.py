@@ -0,0 +1,344 @@
+import json
+import unicodedata
+from datetime import datetime, timedelta
+from urllib.parse import quote as url_quote
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+from flask import Blueprint, Response, current_app, jsonify, request
+
+from routes import handlers
+from routes.handlers import run_sync, wants_event_stream
+from services.ai_services import GeminiError
+from services.db_services import InvalidCursor, fetch_entries_page, get_db, iter_all_entries
+from services.embeddings import related_entries
+from services.journal_sync import fetch_changes
+from services.journal_transfer import export_lines, import_lines, read_lines
+from services.rollups import TREND_GRANULARITIES, read_summary, read_trends
+from services.search import InvalidQuery, search_entries
+from services.versioning import conditional_on_user_version
+
+journal_bp = Blueprint('journal', __name__)
+
+# ETag / If-None-Match support for the per-user GET routes
+user_etag = conditional_on_user_version(get_db)
+
+def set_download_name(response, name):
+    """
+    Sets an attachment Content-Disposition the way send_file(download_name=...)
+    does: usernames can hold quotes, control and non-ASCII characters, so
+    those get a printable ASCII fallback plus an RFC 5987 filename*.
+    """
+    if name.isascii() and name.isprintable():
+        names = {"filename": name}
+    else:
+        fallback = unicodedata.normalize("NFKD", name).encode("ascii", "ignore").decode("ascii")
+        names = {"filename": "".join(c for c in fallback if c.isprintable()),
+                 "filename*": f"UTF-8''{url_quote(name, safe='!#$&+^`|~')}"}
+    response.headers.set("Content-Disposition", "attachment", **names)
+
+def reply(result):
+    """
+    Turns a handler result into a Flask response.
+    """
+    if not isinstance(result, handlers.SSEReply):
+        body, status = result
+        return jsonify(body), status
+
+    def events():
+        yield handlers.sse_event({result.field: result.first})
+        try:
+            for text in result.chunks:
+                yield handlers.sse_event({result.field: text})
+        except GeminiError as e:
+            yield handlers.sse_error(result.field, e)
+            return
+        yield handlers.sse_event(result.done, event="done")
+
+    return Response(events(), mimetype='text/event-stream', headers=handlers.SSE_HEADERS)
+
+def json_array(first, rest):
+    """
+    Streams a JSON array from already-serialized items, first being None for an empty array.
+    """
+    if first is None:
+        yield "[]"
+        return
+    yield "[" + first
+    for item in rest:
+        yield "," + item
+    yield "]"
+
+# --- Journal Endpoints ---
+
+@journal_bp.route('/journal/<username>', methods=['POST'])
+def add_journal_entry(username):
+    """
+    Endpoint to add a new journal entry for a specific user,
+    including LLM-generated sentiment.
+    Entries the local classifier is confident about are labelled immediately;
+    otherwise, with SENTIMENT_ASYNC, the entry is saved as "pending" and classified in the background.
+    Expects JSON: {"text": "Your journal entry here"}
+    """
+    return reply(run_sync(handlers.add_journal_entry(get_db(), current_app.config, username, request.get_json())))
+
+@journal_bp.route('/journal/<username>', methods=['GET'])
+@user_etag
+def get_journal_entries(username):
+    """
+    Endpoint to retrieve journal entries for a specific user, newest first.
+    Query params: limit (page size) and cursor (the next_cursor of the previous page).
+    Returns {"entries": [...], "next_cursor": "..." or null}.
+    With all=true, returns every entry as a plain list (the original response).
+    Entries still waiting for background classification have sentiment "pending".
+    """
+    db = get_db()
+    if db is None: # Check if the database is configured
+        return jsonify({"error": "Database connection not available"}), 500
+
+    try:
+        if request.args.get('all', 'false').lower() == 'true':
+            entries = iter_all_entries(db, username)
+            # Run the query now, so a failure is still a 500 rather than a cut-off body
+            first = next(entries, None)
+            return Response(json_array(first, entries), mimetype='application/json'), 200
+
+        limit = request.args.get('limit', current_app.config['JOURNAL_PAGE_SIZE'], type=int)
+        if limit < 1:
+            return jsonify({"error": "limit must be a positive integer"}), 400
+        limit = min(limit, current_app.config['JOURNAL_PAGE_SIZE_MAX'])
+
+        entries, next_cursor = fetch_entries_page(db, username, limit, request.args.get('cursor'))
+        body = f'{{"entries":[{",".join(entries)}],"next_cursor":{json.dumps(next_cursor)}}}'
+        return Response(body, mimetype='application/json'), 200
+    except InvalidCursor as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": f"Failed to retrieve journal entries: {e}"}), 500
+
+@journal_bp.route('/journal/<username>/changes', methods=['GET'])
+@user_etag
+def get_journal_changes(username):
+    """
+    Endpoint for delta sync: the entries inserted or modified since a sync token, oldest change first.
+    Query params: since (the next_token of the previous call; omit it for a full sync) and limit.
+    Returns {"entries": [...], "next_token": "...", "has_more": bool}; each entry has an updated_at.
+    Recent changes can be returned twice, so clients should apply them by entry id.
+    """
+    db = get_db()
+    if db is None: # Check if the database is configured
+        return jsonify({"error": "Database connection not available"}), 500
+
+    try:
+        limit = request.args.get('limit', current_app.config['JOURNAL_CHANGES_PAGE_SIZE'], type=int)
+        if limit < 1:
+            return jsonify({"error": "limit must be a positive integer"}), 400
+        limit = min(limit, current_app.config['JOURNAL_CHANGES_PAGE_SIZE'])
+
+        entries, next_token, has_more = fetch_changes(db, username, limit, request.args.get('since'),
+                                                      current_app.config['JOURNAL_CHANGES_LAG_SECONDS'])
+        return jsonify({"entries": entries, "next_token": next_token, "has_more": has_more}), 200
+    except InvalidCursor as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": f"Failed to retrieve journal changes: {e}"}), 500
+
+@journal_bp.route('/journal/<username>/search', methods=['GET'])
+@user_etag
+def search_journal(username):
+    """
+    Endpoint to search a user's entries by keyword, best match first.
+    Query params: q (required), sentiment (comma-separated labels), start_date and
+    end_date (YYYY-MM-DD, inclusive), limit, and cursor (the next_cursor of the previous page).
+    Returns {"results": [...], "next_cursor": "..." or null}; each result has a score,
+    a snippet and highlights, the [start, end) character ranges of matching words in the snippet.
+    """
+    db = get_db()
+    if db is None: # Check if the database is configured
+        return jsonify({"error": "Database connection not available"}), 500
+
+    try:
+        limit = request.args.get('limit', current_app.config['JOURNAL_PAGE_SIZE'], type=int)
+        if limit < 1:
+            return jsonify({"error": "limit must be a positive integer"}), 400
+        limit = min(limit, current_app.config['JOURNAL_PAGE_SIZE_MAX'])
+
+        sentiments = [s for s in request.args.get('sentiment', '').split(',') if s]
+        try:
+            start = request.args.get('start_date')
+            start = datetime.strptime(start, "%Y-%m-%d") if start else None
+            end = request.args.get('end_date')
+            # Include the whole end day
+            end = datetime.strptime(end, "%Y-%m-%d") + timedelta(days=1) if end else None
+        except ValueError:
+            return jsonify({"error": "Invalid date format. Please use YYYY-MM-DD."}), 400
+
+        results, next_cursor = search_entries(db, username, request.args.get('q', ''), limit,
+                                              request.args.get('cursor'), sentiments, start, end)
+        return jsonify({"results": results, "next_cursor": next_cursor}), 200
+    except (InvalidQuery, InvalidCursor) as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": f"Failed to search journal entries: {e}"}), 500
+
+@journal_bp.route('/journal/<username>/related/<entry_id>', methods=['GET'])
+@user_etag
+def get_related_entries(username, entry_id):
+    """
+    Endpoint to retrieve the user's past entries most similar in content to one of their entries.
+    Query params: limit. Returns {"entries": [...]}, most similar first, each with a
+    cosine similarity score; entries with little in common are left out.
+    """
+    db = get_db()
+    if db is None: # Check if the database is configured
+        return jsonify({"error": "Database connection not available"}), 500
+
+    try:
+        limit = request.args.get('limit', current_app.config['RELATED_ENTRIES_LIMIT'], type=int)
+        if limit < 1:
+            return jsonify({"error": "limit must be a positive integer"}), 400
+        limit = min(limit, current_app.config['RELATED_ENTRIES_LIMIT_MAX'])
+
+        entries = related_entries(db, username, entry_id, limit)
+        if entries is None:
+            return jsonify({"error": "Journal entry not found or unauthorized"}), 404
+        return jsonify({"entries": entries}), 200
+    except Exception as e:
+        return jsonify({"error": f"Failed to retrieve related entries: {e}"}), 500
+
+@journal_bp.route('/journal/<username>/export', methods=['GET'])
+def export_journal(username):
+    """
+    Endpoint to download all of a user's entries as NDJSON, oldest first.
+    Streamed from the database cursor, so large journals are not held in memory.
+    """
+    db = get_db()
+    if db is None: # Check if the database is configured
+        return jsonify({"error": "Database connection not available"}), 500
+
+    response = Response(export_lines(db, username), mimetype='application/x-ndjson')
+    set_download_name(response, f"{username}-journal.ndjson")
+    return response
+
+@journal_bp.route('/journal/<username>/import', methods=['POST'])
+def import_journal(username):
+    """
+    Endpoint to bulk-import entries from an NDJSON body (one {"text", "timestamp"} object per line).
+    The body is read incrementally; entries keep their timestamps and are classified in the background.
+    Returns {"imported": n, "skipped": n, "errors": [{"line": n, "error": "..."}]}.
+    """
+    db = get_db()
+    if db is None: # Check if the database is configured
+        return jsonify({"error": "Database connection not available"}), 500
+
+    try:
+        lines = read_lines(request.stream, current_app.config['JOURNAL_IMPORT_MAX_LINE_BYTES'])
+        result = import_lines(db, username, lines, current_app.config['JOURNAL_IMPORT_BATCH_SIZE'])
+        return jsonify(result), 200
+    except Exception as e:
+        return jsonify({"error": f"Failed to import journal entries: {e}"}), 500
+
+@journal_bp.route('/journal/insight', methods=['POST'])
+def get_journal_insight():
+    """
+    Endpoint to get an LLM-generated insight for a journal entry.
+    Expects JSON: {"text": "The journal entry text"}, optionally with "username",
+    in which case the user's most similar past entries are given to the LLM as context.
+    With ?stream=true (or Accept: text/event-stream) the insight is streamed as SSE events.
+    """
+    return reply(run_sync(handlers.journal_insight(get_db(), current_app.config, request.get_json(),
+                                                   wants_event_stream(request.args, request.headers))))
+
+# --- Endpoint for Sentiment Summary ---
+@journal_bp.route('/journal/sentiment_summary/<username>', methods=['GET'])
+@user_etag
+def get_sentiment_summary(username):
+    """
+    Endpoint to retrieve a summary of sentiment counts for a specific user.
+    Returns counts of 'positive', 'negative', 'neutral', 'mixed', and 'unknown' entries
+    ('pending' and 'error' entries are counted as 'unknown').
+    """
+    db = get_db()
+    if db is None: # Check if the database is configured
+        return jsonify({"error": "Database connection not available"}), 500
+
+    try:
+        # Read from the per-day rollups instead of aggregating every entry
+        return jsonify(read_summary(db, username)), 200
+    except Exception as e:
+        print(f"Error getting sentiment summary: {e}")
+        return jsonify({"error": f"Failed to retrieve sentiment summary: {e}"}), 500
+
+# --- Endpoint for Updating Sentiment of a Specific Entry ---
+@journal_bp.route('/journal/update_sentiment/<username>/<entry_id>', methods=['PUT'])
+def update_journal_sentiment(username, entry_id):
+    """
+    Endpoint to update the sentiment of a specific journal entry.
+    """
+    return reply(run_sync(handlers.update_journal_sentiment(get_db(), username, entry_id)))
+
+# --- Endpoint for Time-Series Sentiment Trends ---
+@journal_bp.route('/journal/sentiment_trends/<username>', methods=['GET'])
+@user_etag
+def get_sentiment_trends(username):
+    """
+    Endpoint to retrieve sentiment trends over time for a specific user.
+    Returns counts of positive, negative, neutral, mixed, and unknown sentiments per period, oldest first.
+    Query params (all optional): start_date and end_date (YYYY-MM-DD, inclusive),
+    granularity (day, week or month; default day), timezone (an IANA name such as
+    Europe/Berlin, which decides where days begin; default the server's), max_points
+    (merge adjacent periods down to at most this many), and format=columns for
+    {"dates": [...], "counts": {"positive": [...], ...}} instead of one object per period.
+    """
+    db = get_db()
+    if db is None: # Check if the database is configured
+        return jsonify({"error": "Database connection not available"}), 500
+
+    try:
+        granularity = request.args.get('granularity', 'day')
+        if granularity not in TREND_GRANULARITIES:
+            return jsonify({"error": f"granularity must be one of {', '.join(TREND_GRANULARITIES)}"}), 400
+        max_points = request.args.get('max_points', type=int)
+        if max_points is not None and max_points < 1:
+            return jsonify({"error": "max_points must be a positive integer"}), 400
+        timezone = request.args.get('timezone', current_app.config['SERVER_TIMEZONE'])
+        try:
+            ZoneInfo(timezone)
+        except (ValueError, ZoneInfoNotFoundError):
+            return jsonify({"error": f"Unknown timezone: {timezone}"}), 400
+        try:
+            start = request.args.get('start_date')
+            start = datetime.strptime(start, "%Y-%m-%d").date() if start else None
+            end = request.args.get('end_date')
+            end = datetime.strptime(end, "%Y-%m-%d").date() if end else None
+        except ValueError:
+            return jsonify({"error": "Invalid date format. Please use YYYY-MM-DD."}), 400
+
+        columnar = request.args.get('format') == 'columns'
+        trends = read_trends(db, username, granularity, start, end, timezone,
+                             current_app.config['SERVER_TIMEZONE'], max_points, columnar)
+        if columnar:
+            trends = {"granularity": granularity, "timezone": timezone, **trends}
+        return jsonify(trends), 200
+    except Exception as e:
+        print(f"Error getting sentiment trends: {e}")
+        return jsonify({"error": f"Failed to retrieve sentiment trends: {e}"}), 500
+
+# --- Endpoint for Generating Journaling Prompts ---
+@journal_bp.route('/journal/generate_prompt/<username>', methods=['POST'])
+def generate_journal_prompt(username):
+    """
+    Endpoint to generate a personalized journaling prompt based on the latest entry
+    and the past entries most related to it.
+    """
+    return reply(run_sync(handlers.generate_journal_prompt(get_db(), current_app.config, username)))
+
+# --- Endpoint for Period Summary with Narrative ---
+@journal_bp.route('/journal/period_summary/<username>', methods=['POST'])
+def get_period_summary(username):
+    """
+    Endpoint to generate a narrative summary of journal entries for a given period.
+    Expects JSON: {"start_date": "YYYY-MM-DD", "end_date": "YYYY-MM-DD"}
+    With ?stream=true (or Accept: text/event-stream) the summary is streamed as SSE events.
+    """
+    return reply(run_sync(handlers.get_period_summary(get_db(), current_app.config, username, request.get_json(),
+                                                      wants_event_stream(request.args, request.headers))))
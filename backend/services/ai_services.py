@@ -0,0 +1,562 @@
+"""
+Shared client for the Gemini API.
+
+All LLM-backed routes go through GeminiClient so that every call in a worker
+reuses one pooled keep-alive session, gets the same connect/read timeouts and
+retry policy, and parses responses the same way.
+"""
+import json
+import os
+import random
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from config import Config, config_getter
+from services.circuit_breaker import CLOSED, CircuitBreaker
+from services.llm_cache import LLMResponseCache, cache_key
+from services.llm_scheduler import LLMScheduler, current_llm_request, estimate_tokens
+from services.metrics import observe_gemini, observe_gemini_hedge, record_gemini_usage
+
+SENTIMENT_LABELS = ['positive', 'neutral', 'negative', 'mixed']
+
+# Upstream statuses worth retrying: rate limiting and transient server errors
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+class GeminiError(Exception):
+    """Base class for errors raised by the Gemini client."""
+
+
+class GeminiHTTPError(GeminiError):
+    """Gemini answered with a non-2xx status."""
+
+    def __init__(self, status_code, body=""):
+        super().__init__(f"Gemini API returned HTTP {status_code}")
+        self.status_code = status_code
+        self.body = body
+
+
+class GeminiRequestError(GeminiError):
+    """The request never produced a usable response (network error, timeout, deadline)."""
+
+
+class GeminiQuotaExceeded(GeminiError):
+    """The LLM scheduler refused the call: the user's or the global quota is used up."""
+
+    def __init__(self, retry_after):
+        super().__init__(f"LLM quota exceeded, retry in {retry_after:.0f}s")
+        self.retry_after = retry_after
+
+
+class GeminiCircuitOpen(GeminiError):
+    """The circuit breaker is open: Gemini has been failing or too slow, so the call was not attempted."""
+
+    def __init__(self, retry_after):
+        super().__init__(f"Gemini circuit breaker is open, retry in {retry_after:.0f}s")
+        self.retry_after = retry_after
+
+
+def build_payload(prompt, temperature, max_output_tokens):
+    """
+    Builds a generateContent request body for a single-turn text prompt.
+    """
+    return {
+        "contents": [{"role": "user", "parts": [{"text": prompt}]}],
+        "generationConfig": {
+            "temperature": temperature,
+            "maxOutputTokens": max_output_tokens
+        }
+    }
+
+
+def extract_text(gemini_response):
+    """
+    Returns the text of the first candidate, or None if the response has no content.
+    """
+    if not gemini_response or not gemini_response.get('candidates'):
+        return None
+    try:
+        return gemini_response['candidates'][0]['content']['parts'][0]['text']
+    except (KeyError, IndexError, TypeError):
+        return None
+
+
+class GeminiClient:
+    """
+    Thin Gemini REST client with a per-process connection pool.
+
+    The requests.Session is created lazily and re-created if the process id
+    changes, so a client built before a gunicorn fork never shares sockets
+    with its parent.
+    """
+
+    def __init__(self, api_key, api_base, model, connect_timeout=3.05, read_timeout=20.0,
+                 total_deadline=30.0, max_retries=2, backoff_base=0.25, backoff_cap=4.0,
+                 pool_maxsize=10, cache=None, scheduler=None, breaker=None, hedge=False, hedge_min_delay=0.25):
+        self.api_key = api_key
+        self.api_base = api_base.rstrip('/')
+        self.model = model
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.total_deadline = total_deadline
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.pool_maxsize = pool_maxsize
+        # Optional LLMResponseCache; None disables caching
+        self.cache = cache
+        # Optional LLMScheduler every upstream call must be admitted by; None admits everything
+        self.scheduler = scheduler
+        # Optional CircuitBreaker; hedged requests need it for their latency statistics
+        self.breaker = breaker
+        self.hedge = hedge and breaker is not None
+        self.hedge_min_delay = hedge_min_delay
+        # (primary executor, hedge executor, free hedge slots); see _get_hedge_executors()
+        self._hedge_executors = None
+        self._hedge_executors_pid = None
+        self._session = None
+        self._session_pid = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config):
+        """
+        Builds a client from a config object (e.g. config.Config) or a Flask config mapping.
+        """
+        get = config_getter(config)
+        cache = None
+        if get('LLM_CACHE_ENABLED'):
+            cache = LLMResponseCache(
+                max_entries=get('LLM_CACHE_MAX_ENTRIES'),
+                ttl=get('LLM_CACHE_TTL'),
+                persistent_ttl=get('LLM_CACHE_PERSISTENT_TTL'),
+            )
+        return cls(
+            api_key=get('GEMINI_API_KEY'),
+            api_base=get('GEMINI_API_BASE'),
+            model=get('GEMINI_MODEL'),
+            connect_timeout=get('GEMINI_CONNECT_TIMEOUT'),
+            read_timeout=get('GEMINI_READ_TIMEOUT'),
+            total_deadline=get('GEMINI_TOTAL_DEADLINE'),
+            max_retries=get('GEMINI_MAX_RETRIES'),
+            backoff_base=get('GEMINI_BACKOFF_BASE'),
+            backoff_cap=get('GEMINI_BACKOFF_CAP'),
+            pool_maxsize=get('GEMINI_POOL_MAXSIZE'),
+            cache=cache,
+            scheduler=LLMScheduler.from_config(config) if get('LLM_SCHEDULER_ENABLED') else None,
+            breaker=CircuitBreaker.from_config(config) if get('GEMINI_BREAKER_ENABLED') else None,
+            hedge=get('GEMINI_HEDGE_ENABLED'),
+            hedge_min_delay=get('GEMINI_HEDGE_MIN_DELAY'),
+        )
+
+    def url(self, method="generateContent"):
+        return f"{self.api_base}/models/{self.model}:{method}"
+
+    def _get_session(self):
+        pid = os.getpid()
+        if self._session is None or self._session_pid != pid:
+            with self._lock:
+                if self._session is None or self._session_pid != pid:
+                    session = requests.Session()
+                    # Retries are handled by post() so they respect the total deadline
+                    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_maxsize, max_retries=0)
+                    session.mount('https://', adapter)
+                    session.mount('http://', adapter)
+                    # The key goes in a header rather than the query string so it never shows up in logged URLs
+                    session.headers.update({
+                        'Content-Type': 'application/json',
+                        'x-goog-api-key': self.api_key or '',
+                    })
+                    self._session = session
+                    self._session_pid = pid
+        return self._session
+
+    def _observe(self, method, started, error=None, upstream_failed=True, ticket=None):
+        """
+        Records one HTTP attempt in the metrics and the circuit breaker, with
+        the ticket breaker.allow() gave it. Errors that are the request's fault
+        (upstream_failed=False, e.g. HTTP 400) count as healthy answers for the breaker.
+        """
+        observe_gemini(method, started, error)
+        if self.breaker is not None:
+            self.breaker.record(not error or not upstream_failed, time.monotonic() - started, ticket)
+
+    def fail_fast(self):
+        """
+        Raises GeminiCircuitOpen while the breaker is open, before any admission or attempt.
+        """
+        if self.breaker is not None and self.breaker.open_for():
+            raise GeminiCircuitOpen(self.breaker.open_for())
+
+    def hedge_delay(self):
+        """
+        Seconds to wait before hedging a call: the recent p95 latency, or None
+        if hedging is off, the breaker is not closed or there are too few samples.
+        """
+        if not self.hedge or self.breaker.state != CLOSED:
+            return None
+        p95 = self.breaker.latency_quantile(0.95)
+        return None if p95 is None else max(self.hedge_min_delay, p95)
+
+    def _backoff_delay(self, attempt, retry_after=None):
+        """
+        Full-jitter exponential backoff, never shorter than a server-supplied Retry-After.
+        """
+        delay = random.uniform(0, min(self.backoff_cap, self.backoff_base * (2 ** attempt)))
+        if retry_after:
+            try:
+                delay = max(delay, float(retry_after))
+            except ValueError:
+                pass
+        return delay
+
+    def post(self, payload, method="generateContent", stream=False, params=None):
+        """
+        POSTs payload to the given model method and returns the requests.Response.
+
+        Connection errors, timeouts and retryable statuses are retried with
+        jittered backoff until max_retries or the total deadline runs out.
+        With stream=True the body is left unread for the caller to iterate.
+        Raises GeminiHTTPError or GeminiRequestError on failure.
+        """
+        session = self._get_session()
+        url = self.url(method)
+        deadline = time.monotonic() + self.total_deadline
+        attempt = 0
+
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise GeminiRequestError("Gemini API call exceeded its total deadline")
+            ticket = self.breaker.allow() if self.breaker is not None else True
+            if not ticket:
+                raise GeminiCircuitOpen(self.breaker.open_for())
+            timeout = (min(self.connect_timeout, remaining), min(self.read_timeout, remaining))
+            retry_after = None
+            started = time.monotonic()
+
+            try:
+                response = session.post(url, json=payload, params=params, timeout=timeout, stream=stream)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                self._observe(method, started, type(e).__name__, ticket=ticket)
+                error = GeminiRequestError(f"{type(e).__name__} calling Gemini API")
+            except requests.exceptions.RequestException as e:
+                self._observe(method, started, type(e).__name__, ticket=ticket)
+                raise GeminiRequestError(f"{type(e).__name__} calling Gemini API") from e
+            else:
+                if response.status_code < 400:
+                    self._observe(method, started, ticket=ticket)
+                    return response
+                self._observe(method, started, f"http_{response.status_code}",
+                              upstream_failed=response.status_code in RETRYABLE_STATUS_CODES, ticket=ticket)
+                error = GeminiHTTPError(response.status_code, response.text[:500])
+                if response.status_code not in RETRYABLE_STATUS_CODES:
+                    raise error
+                retry_after = response.headers.get('Retry-After')
+
+            if attempt >= self.max_retries:
+                raise error
+            delay = self._backoff_delay(attempt, retry_after)
+            if time.monotonic() + delay >= deadline:
+                raise error
+            print(f"Gemini call failed ({error}), retrying in {delay:.2f}s (attempt {attempt + 1}/{self.max_retries})")
+            time.sleep(delay)
+            attempt += 1
+
+    def admit(self, payload):
+        """
+        Waits for the scheduler to admit a call for the current llm_request().
+        Raises GeminiQuotaExceeded if it is refused.
+        """
+        if self.scheduler is None:
+            return
+        username, priority, quota = current_llm_request()
+        retry_after = self.scheduler.admit(username, priority, estimate_tokens(payload), quota)
+        if retry_after is not None:
+            raise GeminiQuotaExceeded(retry_after)
+
+    def admit_hedge(self, payload):
+        """
+        True if a hedge request for the current llm_request() may go upstream
+        now; hedges never wait for the scheduler.
+        """
+        if self.scheduler is None:
+            return True
+        username, priority, _ = current_llm_request()
+        return self.scheduler.try_admit(username, priority, estimate_tokens(payload))
+
+    def charge_user(self, username):
+        """
+        Charges username's request quota once for a route that makes several
+        calls (which then run under llm_request(..., quota=False)).
+        Raises GeminiQuotaExceeded if the user is over their budget.
+        """
+        if self.scheduler is None or username is None:
+            return
+        retry_after = self.scheduler.charge_user(username)
+        if retry_after is not None:
+            raise GeminiQuotaExceeded(retry_after)
+
+    def _get_hedge_executors(self):
+        """
+        Primaries and hedges run on separate executors, so hedges never queue
+        behind the primaries (or each other) they are meant to overtake.
+        """
+        if self._hedge_executors is None or self._hedge_executors_pid != os.getpid():
+            with self._lock:
+                if self._hedge_executors is None or self._hedge_executors_pid != os.getpid():
+                    self._hedge_executors = (
+                        ThreadPoolExecutor(max_workers=self.pool_maxsize, thread_name_prefix="gemini-primary"),
+                        ThreadPoolExecutor(max_workers=self.pool_maxsize, thread_name_prefix="gemini-hedge"),
+                        threading.BoundedSemaphore(self.pool_maxsize),
+                    )
+                    self._hedge_executors_pid = os.getpid()
+        return self._hedge_executors
+
+    def _hedged_post(self, payload, delay):
+        """
+        post() that sends a second, identical request if the first has not
+        answered within delay seconds of being sent, and returns whichever
+        answers first. The hedge counts against the LLM scheduler's global
+        budget; if there is no room for it, or every hedge thread is busy,
+        only the first request is waited for.
+        """
+        primaries, hedges, hedge_slots = self._get_hedge_executors()
+        sent = threading.Event()
+
+        def send_primary():
+            sent.set()
+            return self.post(payload)
+        primary = primaries.submit(send_primary)
+        # Time spent queued for a thread is not upstream latency; start the clock when it is sent
+        sent.wait()
+        try:
+            return primary.result(timeout=delay)
+        except FutureTimeoutError:
+            pass
+        if not hedge_slots.acquire(blocking=False):
+            observe_gemini_hedge("skipped")
+            return primary.result()
+        if not self.admit_hedge(payload):
+            hedge_slots.release()
+            observe_gemini_hedge("skipped")
+            return primary.result()
+        hedge = hedges.submit(self.post, payload)
+        hedge.add_done_callback(lambda f: hedge_slots.release())
+        pending, error = {primary, hedge}, None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is not None:
+                    error = future.exception()
+                    continue
+                observe_gemini_hedge("primary" if future is primary else "hedge")
+                # The slower request cannot be cancelled; release its connection when it is done
+                for other in pending:
+                    other.add_done_callback(lambda f: f.exception() is None and f.result().close())
+                return future.result()
+        observe_gemini_hedge("none")
+        raise error
+
+    def _generate_uncached(self, payload, hedge=False):
+        self.fail_fast()
+        self.admit(payload)
+        delay = self.hedge_delay() if hedge else None
+        response = self.post(payload) if delay is None else self._hedged_post(payload, delay)
+        try:
+            body = response.json()
+        except ValueError as e:
+            raise GeminiRequestError("Gemini API returned a non-JSON response") from e
+        record_gemini_usage(body)
+        return body
+
+    def generate(self, payload, use_cache=True, hedge=False):
+        """
+        Calls generateContent and returns the decoded JSON response.
+
+        Identical requests are served from the response cache when one is
+        configured; only responses that contain text are cached. With
+        hedge=True (and hedging enabled) a slow call is raced against a
+        second request sent after the recent p95 latency.
+        """
+        if self.cache is None or not use_cache:
+            return self._generate_uncached(payload, hedge)
+        return self.cache.get_or_compute(
+            cache_key(self.model, payload),
+            lambda: self._generate_uncached(payload, hedge),
+            cacheable=lambda response: extract_text(response) is not None,
+            # A refusal is for the leader's user; the others try under their own quota
+            private_errors=(GeminiQuotaExceeded,)
+        )
+
+    def generate_text(self, prompt, temperature, max_output_tokens, use_cache=True, hedge=False):
+        """
+        Sends a single-turn prompt and returns the generated text, or None if
+        Gemini returned no candidates.
+        """
+        payload = build_payload(prompt, temperature, max_output_tokens)
+        return extract_text(self.generate(payload, use_cache=use_cache, hedge=hedge))
+
+    def stream_text(self, prompt, temperature, max_output_tokens, use_cache=True):
+        """
+        Yields the generated text in pieces as Gemini produces them, using
+        streamGenerateContent with server-sent events.
+
+        A cached answer for the same request is yielded in one piece, and a
+        completed stream is cached like a generateContent response.
+        """
+        payload = build_payload(prompt, temperature, max_output_tokens)
+        key = cache_key(self.model, payload) if self.cache is not None and use_cache else None
+        if key:
+            cached = self.cache.get(key)
+            if cached is not None:
+                text = extract_text(cached)
+                if text:
+                    yield text
+                return
+
+        self.fail_fast()
+        self.admit(payload)
+        started = time.monotonic()
+        deadline = started + self.total_deadline
+        response = self.post(payload, method="streamGenerateContent", stream=True, params={"alt": "sse"})
+        response.encoding = 'utf-8'
+        parts = []
+        # Every event carries the running usageMetadata; the last one has the totals
+        last_event = None
+        try:
+            # chunk_size=None hands over data as soon as it arrives
+            for line in response.iter_lines(chunk_size=None, decode_unicode=True):
+                if time.monotonic() > deadline:
+                    raise GeminiRequestError("Gemini API stream exceeded its total deadline")
+                if not line.startswith('data:'):
+                    continue
+                try:
+                    last_event = json.loads(line[5:])
+                except ValueError as e:
+                    raise GeminiRequestError("Gemini API sent a malformed stream event") from e
+                text = extract_text(last_event)
+                if text:
+                    parts.append(text)
+                    yield text
+        except requests.exceptions.RequestException as e:
+            raise GeminiRequestError(f"{type(e).__name__} while streaming from Gemini API") from e
+        finally:
+            response.close()
+            record_gemini_usage(last_event)
+
+        if key and parts:
+            assembled = {"candidates": [{"content": {"role": "model", "parts": [{"text": "".join(parts)}]}}]}
+            self.cache.put(key, assembled, time.monotonic() - started)
+
+
+_client = None
+_client_config = Config
+
+
+def configure_gemini_client(config):
+    """
+    Makes get_gemini_client() build its client from config (e.g. a Flask app's config).
+    """
+    global _client, _client_config
+    _client_config = config
+    _client = None
+
+
+def get_gemini_client():
+    """
+    Returns the process-wide Gemini client, creating it on first use.
+    """
+    global _client
+    if _client is None:
+        _client = GeminiClient.from_config(_client_config)
+    return _client
+
+
+def normalize_sentiment(raw):
+    """
+    Maps raw model output to one of SENTIMENT_LABELS, or 'unknown'.
+    """
+    if raw is None:
+        return "unknown"
+    sentiment = str(raw).strip().strip('."\'').lower()
+    return sentiment if sentiment in SENTIMENT_LABELS else "unknown"
+
+
+def sentiment_request(text):
+    """
+    Returns the generate_text() arguments for classifying one journal entry.
+    """
+    prompt = f"""Analyze the sentiment of the following journal entry. Respond with a single word: positive, neutral, negative, or mixed.
+
+    Journal Entry:
+    "{text}"
+
+    Sentiment:"""
+
+    # Lower temperature for more deterministic sentiment
+    return {"prompt": prompt, "temperature": 0.2, "max_output_tokens": 10}
+
+
+def classify_sentiment(text):
+    """
+    Classifies one journal entry. Raises GeminiError if the call fails.
+    """
+    return normalize_sentiment(get_gemini_client().generate_text(**sentiment_request(text)))
+
+
+def classify_sentiments_batch(texts, before_call=None):
+    """
+    Classifies several journal entries with a single Gemini call.
+
+    Returns a list of labels in the same order as texts. If the model's
+    answer cannot be matched up with the inputs, falls back to one call per
+    entry. before_call, if given, is called before every Gemini call (e.g. to
+    take a rate limit token). Raises GeminiError if the call fails.
+    """
+    before_call = before_call or (lambda: None)
+    if len(texts) == 1:
+        before_call()
+        return [classify_sentiment(texts[0])]
+
+    numbered = "\n\n".join(f'Entry {i + 1}:\n"{text}"' for i, text in enumerate(texts))
+    prompt = f"""Analyze the sentiment of each of the following {len(texts)} journal entries. Respond with only a JSON array of {len(texts)} strings, in the same order as the entries, where each string is one of: positive, neutral, negative, mixed.
+
+    {numbered}
+
+    Sentiments:"""
+
+    before_call()
+    raw = get_gemini_client().generate_text(prompt, temperature=0.2, max_output_tokens=10 * len(texts) + 20)
+    try:
+        # Models sometimes wrap JSON in a markdown code fence
+        labels = json.loads(raw.strip().removeprefix("```json").strip("`").strip())
+    except (AttributeError, ValueError):
+        labels = None
+
+    if not isinstance(labels, list) or len(labels) != len(texts):
+        print(f"Batch sentiment response did not match {len(texts)} entries; classifying individually")
+        labels = []
+        for text in texts:
+            before_call()
+            labels.append(classify_sentiment(text))
+        return labels
+    return [normalize_sentiment(label) for label in labels]
+
+
+def get_sentiment_from_llm(text):
+    """
+    Calls the Gemini API to get a sentiment analysis for the given text.
+    Returns a string like 'positive', 'neutral', 'negative', or 'mixed',
+    or 'error' if the call failed.
+    """
+    try:
+        return classify_sentiment(text)
+    except GeminiError as e:
+        print(f"Error calling Gemini API for sentiment: {e}")
+        return "error"
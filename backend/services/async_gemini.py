@@ -0,0 +1,338 @@
+"""
+asyncio counterpart of GeminiClient, used by the ASGI entry point (asgi.py).
+
+It keeps the same timeouts, retry policy, deadline and response parsing as
+the sync client and shares its LLMResponseCache, but waits on an
+httpx.AsyncClient, so one worker process can hold hundreds of Gemini calls
+in flight on a single event loop instead of one per thread.
+"""
+import asyncio
+import itertools
+import json
+import os
+import time
+
+import httpx
+
+from services.ai_services import (
+    GeminiCircuitOpen, GeminiClient, GeminiHTTPError, GeminiQuotaExceeded, GeminiRequestError, RETRYABLE_STATUS_CODES,
+    build_payload, extract_text
+)
+from services.llm_cache import cache_key
+from services.llm_scheduler import current_llm_request, estimate_tokens
+from services.metrics import observe_gemini_hedge, record_gemini_usage
+
+# httpcore rescans every connection for every queued request when it hands out
+# connections, so one large pool costs O(queued x connections) CPU per request.
+# The client spreads its connections over several pools of at most this size.
+CONNECTIONS_PER_POOL = 25
+
+
+class AsyncGeminiClient:
+    """
+    Async Gemini REST client with per-process, per-event-loop connection pools.
+    """
+
+    # Pure helpers shared with the sync client
+    url = GeminiClient.url
+    _backoff_delay = GeminiClient._backoff_delay
+    _observe = GeminiClient._observe
+    fail_fast = GeminiClient.fail_fast
+    hedge_delay = GeminiClient.hedge_delay
+
+    def __init__(self, api_key, api_base, model, connect_timeout=3.05, read_timeout=20.0,
+                 total_deadline=30.0, max_retries=2, backoff_base=0.25, backoff_cap=4.0,
+                 max_connections=200, cache=None, scheduler=None, breaker=None, hedge=False, hedge_min_delay=0.25):
+        self.api_key = api_key
+        self.api_base = api_base.rstrip('/')
+        self.model = model
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.total_deadline = total_deadline
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.max_connections = max_connections
+        self.cache = cache
+        self.scheduler = scheduler
+        self.breaker = breaker
+        self.hedge = hedge and breaker is not None
+        self.hedge_min_delay = hedge_min_delay
+        self._pools = None
+        self._pools_owner = None
+        self._next_pool = itertools.count()
+        # cache key -> Future of (response, upstream_seconds), for single-flight on this loop
+        self._in_flight = {}
+
+    @classmethod
+    def from_sync_client(cls, client, max_connections=200):
+        """
+        Builds an async client with the same settings, cache, scheduler and
+        circuit breaker as a GeminiClient.
+        """
+        return cls(
+            api_key=client.api_key,
+            api_base=client.api_base,
+            model=client.model,
+            connect_timeout=client.connect_timeout,
+            read_timeout=client.read_timeout,
+            total_deadline=client.total_deadline,
+            max_retries=client.max_retries,
+            backoff_base=client.backoff_base,
+            backoff_cap=client.backoff_cap,
+            max_connections=max_connections,
+            cache=client.cache,
+            scheduler=client.scheduler,
+            breaker=client.breaker,
+            hedge=client.hedge,
+            hedge_min_delay=client.hedge_min_delay,
+        )
+
+    def _get_pool(self):
+        """
+        Returns the next (httpx.AsyncClient, semaphore) pair, round-robin.
+        Requests queue on the semaphore rather than inside httpcore.
+        """
+        # httpx.AsyncClient is bound to the loop it first runs on and must not cross a fork
+        owner = (os.getpid(), asyncio.get_running_loop())
+        if self._pools is None or self._pools_owner != owner:
+            count = max(1, -(-self.max_connections // CONNECTIONS_PER_POOL))
+            size = max(1, -(-self.max_connections // count))
+            self._pools = [
+                (httpx.AsyncClient(
+                    headers={'Content-Type': 'application/json', 'x-goog-api-key': self.api_key or ''},
+                    limits=httpx.Limits(max_connections=size, max_keepalive_connections=size),
+                ), asyncio.Semaphore(size))
+                for _ in range(count)
+            ]
+            self._pools_owner = owner
+        return self._pools[next(self._next_pool) % len(self._pools)]
+
+    async def aclose(self):
+        if self._pools is not None:
+            for http, _ in self._pools:
+                await http.aclose()
+            self._pools = None
+
+    async def post(self, payload, method="generateContent", stream=False, params=None):
+        """
+        Same contract as GeminiClient.post(), returning an httpx.Response.
+        With stream=True the body is left unread; the caller must aclose() it.
+        """
+        http, slots = self._get_pool()
+        url = self.url(method)
+        deadline = time.monotonic() + self.total_deadline
+        attempt = 0
+
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise GeminiRequestError("Gemini API call exceeded its total deadline")
+            ticket = self.breaker.allow() if self.breaker is not None else True
+            if not ticket:
+                raise GeminiCircuitOpen(self.breaker.open_for())
+            timeout = httpx.Timeout(connect=min(self.connect_timeout, remaining),
+                                    read=min(self.read_timeout, remaining),
+                                    write=min(self.read_timeout, remaining),
+                                    pool=remaining)
+            retry_after = None
+            started = time.monotonic()
+
+            try:
+                request = http.build_request("POST", url, json=payload, params=params, timeout=timeout)
+                async with slots:
+                    response = await http.send(request, stream=stream)
+            except httpx.TransportError as e:
+                self._observe(method, started, type(e).__name__, ticket=ticket)
+                error = GeminiRequestError(f"{type(e).__name__} calling Gemini API")
+            except httpx.HTTPError as e:
+                self._observe(method, started, type(e).__name__, ticket=ticket)
+                raise GeminiRequestError(f"{type(e).__name__} calling Gemini API") from e
+            else:
+                if response.status_code < 400:
+                    self._observe(method, started, ticket=ticket)
+                    return response
+                self._observe(method, started, f"http_{response.status_code}",
+                              upstream_failed=response.status_code in RETRYABLE_STATUS_CODES, ticket=ticket)
+                if stream:
+                    await response.aread()
+                    await response.aclose()
+                error = GeminiHTTPError(response.status_code, response.text[:500])
+                if response.status_code not in RETRYABLE_STATUS_CODES:
+                    raise error
+                retry_after = response.headers.get('Retry-After')
+
+            if attempt >= self.max_retries:
+                raise error
+            delay = self._backoff_delay(attempt, retry_after)
+            if time.monotonic() + delay >= deadline:
+                raise error
+            print(f"Gemini call failed ({error}), retrying in {delay:.2f}s (attempt {attempt + 1}/{self.max_retries})")
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    async def admit(self, payload):
+        """
+        Same contract as GeminiClient.admit(); the wait does not block the event loop.
+        """
+        if self.scheduler is None:
+            return
+        username, priority, quota = current_llm_request()
+        retry_after = await self.scheduler.aadmit(username, priority, estimate_tokens(payload), quota)
+        if retry_after is not None:
+            raise GeminiQuotaExceeded(retry_after)
+
+    async def admit_hedge(self, payload):
+        """
+        GeminiClient.admit_hedge() with the SQLite step off the event loop.
+        """
+        if self.scheduler is None:
+            return True
+        username, priority, _ = current_llm_request()
+        return await asyncio.to_thread(self.scheduler.try_admit, username, priority, estimate_tokens(payload))
+
+    async def _hedged_post(self, payload, delay):
+        """
+        GeminiClient._hedged_post() on the event loop; the slower request is cancelled.
+        """
+        primary = asyncio.ensure_future(self.post(payload))
+        done, _ = await asyncio.wait({primary}, timeout=delay)
+        if done:
+            return primary.result()
+        if not await self.admit_hedge(payload):
+            observe_gemini_hedge("skipped")
+            return await primary
+        hedge = asyncio.ensure_future(self.post(payload))
+        pending, error = {primary, hedge}, None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is not None:
+                        error = task.exception()
+                        continue
+                    observe_gemini_hedge("primary" if task is primary else "hedge")
+                    return task.result()
+            observe_gemini_hedge("none")
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def _generate_uncached(self, payload, hedge=False):
+        self.fail_fast()
+        await self.admit(payload)
+        delay = self.hedge_delay() if hedge else None
+        response = await (self.post(payload) if delay is None else self._hedged_post(payload, delay))
+        try:
+            body = response.json()
+        except ValueError as e:
+            raise GeminiRequestError("Gemini API returned a non-JSON response") from e
+        record_gemini_usage(body)
+        return body
+
+    async def _cache_call(self, method, *args):
+        # The persistent tier does blocking Mongo I/O; keep it off the event loop
+        if self.cache.collection is None:
+            return method(*args)
+        return await asyncio.to_thread(method, *args)
+
+    async def generate(self, payload, use_cache=True, hedge=False):
+        """
+        Calls generateContent and returns the decoded JSON response, with the
+        same caching and single-flight behaviour as GeminiClient.generate().
+        """
+        if self.cache is None or not use_cache:
+            return await self._generate_uncached(payload, hedge)
+
+        key = cache_key(self.model, payload)
+        loop = asyncio.get_running_loop()
+        flight = self._in_flight.get(key)
+        # A future can only be awaited on its own loop (there is normally just one)
+        while flight is not None and flight.get_loop() is loop:
+            self.cache.record(coalesced=1)
+            try:
+                value, upstream_seconds = await asyncio.shield(flight)
+            except GeminiQuotaExceeded:
+                # The leader's user was refused; try again under this caller's own quota
+                flight = self._in_flight.get(key)
+                continue
+            self.cache.record(saved_seconds=upstream_seconds)
+            return value
+
+        flight = loop.create_future()
+        self._in_flight[key] = flight
+        try:
+            value = await self._cache_call(self.cache.get, key)
+            upstream_seconds = 0.0
+            if value is None:
+                started = time.monotonic()
+                try:
+                    value = await self._generate_uncached(payload, hedge)
+                except Exception:
+                    self.cache.record(upstream_calls=1, upstream_errors=1)
+                    raise
+                upstream_seconds = time.monotonic() - started
+                if extract_text(value) is not None:
+                    await self._cache_call(self.cache.put, key, value, upstream_seconds)
+                else:
+                    self.cache.record(upstream_calls=1)
+            flight.set_result((value, upstream_seconds))
+            return value
+        except Exception as e:
+            flight.set_exception(e)
+            # Mark it retrieved so a flight nobody joined does not warn
+            flight.exception()
+            raise
+        finally:
+            if self._in_flight.get(key) is flight:
+                del self._in_flight[key]
+
+    async def generate_text(self, prompt, temperature, max_output_tokens, use_cache=True, hedge=False):
+        payload = build_payload(prompt, temperature, max_output_tokens)
+        return extract_text(await self.generate(payload, use_cache=use_cache, hedge=hedge))
+
+    async def stream_text(self, prompt, temperature, max_output_tokens, use_cache=True):
+        """
+        Async generator counterpart of GeminiClient.stream_text().
+        """
+        payload = build_payload(prompt, temperature, max_output_tokens)
+        key = cache_key(self.model, payload) if self.cache is not None and use_cache else None
+        if key:
+            cached = await self._cache_call(self.cache.get, key)
+            if cached is not None:
+                text = extract_text(cached)
+                if text:
+                    yield text
+                return
+
+        self.fail_fast()
+        await self.admit(payload)
+        started = time.monotonic()
+        deadline = started + self.total_deadline
+        response = await self.post(payload, method="streamGenerateContent", stream=True, params={"alt": "sse"})
+        parts = []
+        last_event = None
+        try:
+            async for line in response.aiter_lines():
+                if time.monotonic() > deadline:
+                    raise GeminiRequestError("Gemini API stream exceeded its total deadline")
+                if not line.startswith('data:'):
+                    continue
+                try:
+                    last_event = json.loads(line[5:])
+                except ValueError as e:
+                    raise GeminiRequestError("Gemini API sent a malformed stream event") from e
+                text = extract_text(last_event)
+                if text:
+                    parts.append(text)
+                    yield text
+        except httpx.HTTPError as e:
+            raise GeminiRequestError(f"{type(e).__name__} while streaming from Gemini API") from e
+        finally:
+            await response.aclose()
+            record_gemini_usage(last_event)
+
+        if key and parts:
+            assembled = {"candidates": [{"content": {"role": "model", "parts": [{"text": "".join(parts)}]}}]}
+            await self._cache_call(self.cache.put, key, assembled, time.monotonic() - started)
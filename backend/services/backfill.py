@@ -0,0 +1,213 @@
+"""
+Bulk sentiment (re)classification of stored journal entries.
+
+Entries matching a filter are streamed in _id order, classified in batches on
+a bounded thread pool (local tier first, Gemini behind a token-bucket rate
+limit for the rest), and written back with bulk_write. Progress is checkpointed in the job_checkpoints collection after
+every window, so an interrupted run resumes where it stopped. The ids of
+entries whose batch failed are kept in the checkpoint too: the job stays
+unfinished, and the next run of the same command retries them first.
+"""
+import hashlib
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from pymongo import UpdateOne
+
+from services.ai_services import GeminiError, classify_sentiments_batch
+from services.llm_scheduler import PRIORITY_BACKGROUND, llm_request
+from services.local_sentiment import TIER_LOCAL, classify_tiered
+from services.rate_limit import TokenBucket
+from services.rollups import day_of, record_sentiment_changes, refresh_rollup_days
+from services.versioning import bump_version
+
+
+def build_backfill_filter(statuses=None, username=None, since=None, until=None):
+    """
+    Builds the journal_entries filter for a backfill run.
+    since/until are datetimes; until is inclusive.
+    """
+    query = {}
+    if statuses:
+        # A missing or null sentiment is what the read routes report as "unknown"
+        if "unknown" in statuses:
+            query["$or"] = [{"sentiment": {"$in": list(statuses)}}, {"sentiment": None}]
+        else:
+            query["sentiment"] = {"$in": list(statuses)}
+    if username:
+        query["username"] = username
+    if since or until:
+        query["timestamp"] = {}
+        if since:
+            query["timestamp"]["$gte"] = since
+        if until:
+            query["timestamp"]["$lte"] = until
+    return query
+
+
+def default_job_name(query):
+    """
+    Derives a stable checkpoint name from the filter, so re-running the same command resumes it.
+    """
+    canonical = json.dumps(query, sort_keys=True, default=str)
+    return "backfill-" + hashlib.sha1(canonical.encode('utf-8')).hexdigest()[:12]
+
+
+class SentimentBackfill:
+    """
+    One resumable backfill run over journal_entries.
+    """
+
+    def __init__(self, db, query, job_name=None, concurrency=4, batch_size=8, rate=5.0,
+                 local_threshold=None, classify=classify_sentiments_batch, report_every=10.0):
+        self.db = db
+        self.query = query
+        self.job_name = job_name or default_job_name(query)
+        self.concurrency = concurrency
+        self.batch_size = batch_size
+        # One token per Gemini call
+        self.bucket = TokenBucket(rate, capacity=max(1, concurrency))
+        self.local_threshold = local_threshold
+        self.classify = classify
+        self.report_every = report_every
+        self.stats = {"scanned": 0, "updated": 0, "failed": 0, "calls": 0, "local": 0}
+        self._calls_lock = threading.Lock()
+        # Ids of entries whose batch failed, retried by the next run
+        self._failed_ids = set()
+
+    def load_checkpoint(self):
+        return self.db.job_checkpoints.find_one({"_id": self.job_name})
+
+    def reset_checkpoint(self):
+        self.db.job_checkpoints.delete_one({"_id": self.job_name})
+
+    def _save_checkpoint(self, last_id, finished=False):
+        self.db.job_checkpoints.update_one(
+            {"_id": self.job_name},
+            {
+                "$set": {"last_id": last_id, "finished": finished, "updated_at": datetime.utcnow(),
+                         "failed_ids": sorted(self._failed_ids), "filter": json.dumps(self.query, default=str)},
+                "$inc": {"updated": self.stats["updated"] - self._saved_updated}
+            },
+            upsert=True
+        )
+        self._saved_updated = self.stats["updated"]
+
+    def _before_call(self):
+        # One token per upstream call, including the per-entry fallback after a malformed batch reply
+        self.bucket.acquire()
+        with self._calls_lock:
+            self.stats["calls"] += 1
+
+    def _escalate(self, texts):
+        # Only entries the local tier was unsure about cost Gemini calls (and tokens)
+        # Runs on executor threads, so the scheduler context is set here rather than by the caller
+        with llm_request(None, PRIORITY_BACKGROUND):
+            return self.classify(texts, before_call=self._before_call)
+
+    def _classify_batch(self, batch):
+        try:
+            return batch, classify_tiered(self.db, [entry["text"] for entry in batch], self.local_threshold,
+                                          escalate=self._escalate)
+        except GeminiError as e:
+            print(f"Backfill: batch of {len(batch)} failed: {e}")
+            return batch, None
+
+    def _process_window(self, executor, window):
+        batches = [window[i:i + self.batch_size] for i in range(0, len(window), self.batch_size)]
+        results = []
+        for batch, labels in executor.map(self._classify_batch, batches):
+            if labels is None:
+                self.stats["failed"] += len(batch)
+                self._failed_ids.update(entry["_id"] for entry in batch)
+                continue
+            results.extend((entry, label, tier) for entry, (label, tier) in zip(batch, labels))
+            self.stats["local"] += sum(1 for _, tier in labels if tier == TIER_LOCAL)
+        if not results:
+            return
+
+        # Only overwrite if nobody changed the sentiment while we were classifying
+        now = datetime.utcnow()
+        result = self.db.journal_entries.bulk_write([
+            UpdateOne({"_id": entry["_id"], "sentiment": entry.get("sentiment")},
+                      {"$set": {"sentiment": label, "sentiment_tier": tier, "updated_at": now}})
+            for entry, label, tier in results
+        ], ordered=False)
+        self.stats["updated"] += result.modified_count
+        if result.modified_count == len(results):
+            record_sentiment_changes(self.db, [
+                # A missing sentiment is counted as "unknown"
+                (entry["username"], entry["timestamp"], entry.get("sentiment") or "unknown", label)
+                for entry, label, _ in results
+            ])
+        else:
+            refresh_rollup_days(self.db, {(entry["username"], day_of(entry["timestamp"])) for entry, _, _ in results})
+        if result.modified_count:
+            bump_version(self.db, *(entry["username"] for entry, _, _ in results))
+
+    def _report(self, started, final=False):
+        elapsed = max(time.monotonic() - started, 1e-9)
+        prefix = "Backfill finished" if final else "Backfill progress"
+        print(f"{prefix}: scanned {self.stats['scanned']}, updated {self.stats['updated']}, "
+              f"failed {self.stats['failed']}, {self.stats['local']} labelled locally, {self.stats['calls']} Gemini calls in {elapsed:.1f}s "
+              f"({self.stats['scanned'] / elapsed:.1f} entries/s, {self.stats['calls'] / elapsed:.2f} calls/s)")
+
+    def run(self):
+        """
+        Runs (or resumes) the backfill to completion and returns the stats.
+        """
+        checkpoint = self.load_checkpoint()
+        query = dict(self.query)
+        retry_ids = checkpoint.get("failed_ids", []) if checkpoint else []
+        if checkpoint and checkpoint.get("last_id") is not None:
+            if checkpoint.get("finished") and not retry_ids:
+                print(f"Backfill {self.job_name} already finished; use --restart to run it again")
+                return self.stats
+            print(f"Resuming backfill {self.job_name} after {checkpoint['last_id']}")
+            query = {"$and": [self.query, {"_id": {"$gt": checkpoint["last_id"]}}]}
+        self._saved_updated = 0
+
+        projection = {"text": 1, "sentiment": 1, "username": 1, "timestamp": 1}
+        window_size = self.batch_size * self.concurrency
+        started = last_report = time.monotonic()
+        last_id = checkpoint.get("last_id") if checkpoint else None
+
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            if retry_ids:
+                # Entries relabelled since then no longer match the filter and are skipped
+                print(f"Retrying {len(retry_ids)} entries that failed in an earlier run")
+                retry = list(self.db.journal_entries.find({"$and": [self.query, {"_id": {"$in": retry_ids}}]},
+                                                          projection))
+                for i in range(0, len(retry), window_size):
+                    self._process_window(executor, retry[i:i + window_size])
+                    self.stats["scanned"] += len(retry[i:i + window_size])
+                self._save_checkpoint(last_id)
+
+            cursor = self.db.journal_entries.find(query, projection).sort("_id", 1).batch_size(window_size)
+            window = []
+            for entry in cursor:
+                window.append(entry)
+                if len(window) >= window_size:
+                    self._process_window(executor, window)
+                    self.stats["scanned"] += len(window)
+                    last_id = window[-1]["_id"]
+                    self._save_checkpoint(last_id)
+                    window = []
+                    if time.monotonic() - last_report >= self.report_every:
+                        self._report(started)
+                        last_report = time.monotonic()
+            if window:
+                self._process_window(executor, window)
+                self.stats["scanned"] += len(window)
+                last_id = window[-1]["_id"]
+
+        # A run with failed batches stays unfinished so that running it again retries them
+        self._save_checkpoint(last_id, finished=not self._failed_ids)
+        self._report(started, final=True)
+        if self._failed_ids:
+            print(f"Backfill {self.job_name}: {len(self._failed_ids)} entries failed; run the same command again "
+                  f"to retry them")
+        return self.stats
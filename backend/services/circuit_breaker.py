@@ -0,0 +1,200 @@
+"""
+Circuit breaker for the Gemini upstream, shared by every caller in a worker process.
+
+Each HTTP attempt is recorded in a rolling window of one-second buckets. The
+breaker opens when, over the last GEMINI_BREAKER_WINDOW seconds and at least
+GEMINI_BREAKER_MIN_CALLS attempts, the share of failures (network errors,
+timeouts, 429 and 5xx answers) reaches GEMINI_BREAKER_ERROR_RATE or the share
+of attempts slower than GEMINI_BREAKER_SLOW_CALL reaches
+GEMINI_BREAKER_SLOW_RATE.
+
+While open, calls fail at once with GeminiCircuitOpen instead of waiting out
+the outage. After GEMINI_BREAKER_OPEN_SECONDS it is half-open: one probe
+attempt goes through, and its outcome closes the breaker again or reopens it.
+allow() hands the probe a Probe ticket it passes back to record(); results
+of attempts that started before the breaker opened carry no ticket and are
+ignored until it closes.
+
+The breaker lives in one worker process: each gunicorn worker counts its own
+attempts, opens on its own and sends its own probe.
+
+The window also keeps recent successful latencies, which set the delay for
+hedged requests (GeminiClient.generate(hedge=True)).
+"""
+import threading
+import time
+from collections import deque
+
+from config import config_getter
+from services.metrics import observe_breaker_transition
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+# Successful attempt latencies kept for latency_quantile()
+LATENCY_SAMPLES = 200
+
+
+class Probe:
+    """Ticket for the half-open probe attempt admitted by CircuitBreaker.allow()."""
+
+    def __init__(self, started):
+        self.started = started
+
+
+class CircuitBreaker:
+    """
+    Thread-safe closed / open / half-open breaker over a rolling window.
+    """
+
+    def __init__(self, window=30, min_calls=10, error_rate=0.5, slow_call=10.0, slow_rate=0.8, open_seconds=15.0,
+                 probes=1):
+        self.window = int(window)
+        self.min_calls = min_calls
+        self.error_rate = error_rate
+        self.slow_call = slow_call
+        self.slow_rate = slow_rate
+        self.open_seconds = open_seconds
+        self.probes = probes
+        self.state = CLOSED
+        self._opened_at = 0.0
+        # [second, calls, failures, slow calls], oldest first, plus running totals over them
+        self._buckets = deque()
+        self._totals = [0, 0, 0]
+        self._latencies = deque(maxlen=LATENCY_SAMPLES)
+        # Probes in flight, oldest first; a probe whose caller never reported back expires
+        self._probes = deque()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config):
+        get = config_getter(config)
+        return cls(
+            window=get('GEMINI_BREAKER_WINDOW'),
+            min_calls=get('GEMINI_BREAKER_MIN_CALLS'),
+            error_rate=get('GEMINI_BREAKER_ERROR_RATE'),
+            slow_call=get('GEMINI_BREAKER_SLOW_CALL'),
+            slow_rate=get('GEMINI_BREAKER_SLOW_RATE'),
+            open_seconds=get('GEMINI_BREAKER_OPEN_SECONDS'),
+        )
+
+    def _transition(self, state, now):
+        # Caller holds self._lock
+        if state == self.state:
+            return
+        print(f"Gemini circuit breaker: {self.state} -> {state}")
+        self.state = state
+        if state == OPEN:
+            self._opened_at = now
+        else:
+            self._probes.clear()
+        if state == CLOSED:
+            self._buckets.clear()
+            self._totals = [0, 0, 0]
+        observe_breaker_transition(state)
+
+    def _evict(self, second):
+        # Caller holds self._lock
+        while self._buckets and self._buckets[0][0] <= second - self.window:
+            _, calls, failures, slow = self._buckets.popleft()
+            self._totals[0] -= calls
+            self._totals[1] -= failures
+            self._totals[2] -= slow
+
+    def open_for(self):
+        """
+        Seconds until the breaker lets a probe through; 0 if calls may be attempted.
+        """
+        if self.state != OPEN:
+            return 0.0
+        return max(0.0, self._opened_at + self.open_seconds - time.monotonic())
+
+    def allow(self):
+        """
+        Truthy if an attempt may be made now. In the half-open state the
+        caller gets a Probe, which it must pass back to record().
+        """
+        if self.state == CLOSED:
+            return True
+        with self._lock:
+            now = time.monotonic()
+            if self.state == OPEN:
+                if now < self._opened_at + self.open_seconds:
+                    return False
+                self._transition(HALF_OPEN, now)
+            if self.state == CLOSED:
+                return True
+            while self._probes and self._probes[0].started < now - self.open_seconds:
+                self._probes.popleft()
+            if len(self._probes) >= self.probes:
+                return False
+            probe = Probe(now)
+            self._probes.append(probe)
+            return probe
+
+    def record(self, ok, seconds, ticket=None):
+        """
+        Records one attempt: ok is False for failures, seconds its latency,
+        ticket what allow() returned for it.
+        """
+        slow = seconds >= self.slow_call
+        with self._lock:
+            now = time.monotonic()
+            if self.state == HALF_OPEN:
+                # Only the probes decide; other attempts started before the breaker opened
+                if isinstance(ticket, Probe) and ticket in self._probes:
+                    self._probes.remove(ticket)
+                    self._transition(CLOSED if ok and not slow else OPEN, now)
+                    if ok:
+                        self._latencies.append(seconds)
+                return
+            if self.state == OPEN:
+                # Attempts that started before the breaker opened, or a probe that outlived its reopening
+                return
+
+            if ok:
+                self._latencies.append(seconds)
+            second = int(now)
+            self._evict(second)
+            if not self._buckets or self._buckets[-1][0] != second:
+                self._buckets.append([second, 0, 0, 0])
+            bucket = self._buckets[-1]
+            bucket[1] += 1
+            bucket[2] += not ok
+            bucket[3] += slow
+            self._totals[0] += 1
+            self._totals[1] += not ok
+            self._totals[2] += slow
+
+            calls, failures, slow_calls = self._totals
+            if calls >= self.min_calls and (failures / calls >= self.error_rate or slow_calls / calls >= self.slow_rate):
+                self._transition(OPEN, now)
+
+    def latency_quantile(self, q, min_samples=20):
+        """
+        The q-quantile of recent successful attempt latencies, or None with fewer than min_samples.
+        """
+        samples = sorted(self._latencies)
+        if len(samples) < min_samples:
+            return None
+        return samples[min(len(samples) - 1, int(q * len(samples)))]
+
+    def snapshot(self):
+        """
+        State and window counters, for the health endpoint.
+        """
+        with self._lock:
+            self._evict(int(time.monotonic()))
+            calls, failures, slow_calls = self._totals
+            state = self.state
+        p95 = self.latency_quantile(0.95)
+        return {
+            "state": state,
+            "window_seconds": self.window,
+            "calls": calls,
+            "error_rate": round(failures / calls, 3) if calls else 0.0,
+            "slow_rate": round(slow_calls / calls, 3) if calls else 0.0,
+            "p95_seconds": round(p95, 3) if p95 is not None else None,
+            "retry_in_seconds": round(self.open_for(), 1),
+        }
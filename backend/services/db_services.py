@@ -0,0 +1,209 @@
+"""
+MongoDB connection handling and data-access helpers for the journal_entries collection.
+
+PyMongo clients must not be shared across fork(), so no client is created at
+import time: get_db() builds one per process on first use, which under
+gunicorn happens inside each worker after the fork.
+"""
+import base64
+import json
+import os
+import threading
+from datetime import datetime
+
+from bson.objectid import ObjectId
+from bson.errors import InvalidId
+from pymongo import MongoClient
+from pymongo.errors import ConfigurationError, OperationFailure
+
+from services.entry_schema import display_date, entry_json
+from services.metrics import MongoCommandMetrics
+from services.period_summary import BUCKET_SUMMARY_TTL_SECONDS
+
+# Fields the journal listing actually returns (timestamp is needed for the cursor)
+ENTRY_LIST_PROJECTION = {"text": 1, "sentiment": 1, "timestamp": 1}
+
+
+class InvalidCursor(ValueError):
+    """The pagination cursor could not be decoded."""
+
+
+# Set by init_db(); the client itself belongs to the process that created it
+_settings = None
+_on_connect = None
+_client_factory = None
+_client = None
+_db = None
+_pid = None
+_lock = threading.Lock()
+
+
+def init_db(config, on_connect=None, client_factory=None):
+    """
+    Records the connection settings (a Flask config mapping) without connecting.
+    on_connect(db) runs in a background thread the first time each process connects.
+    client_factory(config) replaces the MongoClient built from the MONGO_* settings,
+    e.g. with an in-process stand-in for the load test (benchmarks/load_test.py).
+    """
+    global _settings, _on_connect, _client_factory, _pid
+    _settings = config
+    _on_connect = on_connect
+    _client_factory = client_factory
+    _pid = None  # Force a fresh client with the new settings
+
+
+def _create_client(config):
+    return MongoClient(
+        config['MONGO_URI'],
+        maxPoolSize=config['MONGO_MAX_POOL_SIZE'],
+        minPoolSize=config['MONGO_MIN_POOL_SIZE'],
+        maxIdleTimeMS=config['MONGO_MAX_IDLE_TIME_MS'],
+        waitQueueTimeoutMS=config['MONGO_WAIT_QUEUE_TIMEOUT_MS'],
+        connectTimeoutMS=config['MONGO_CONNECT_TIMEOUT_MS'],
+        serverSelectionTimeoutMS=config['MONGO_SERVER_SELECTION_TIMEOUT_MS'],
+        socketTimeoutMS=config['MONGO_SOCKET_TIMEOUT_MS'],
+        readPreference=config['MONGO_READ_PREFERENCE'],
+        event_listeners=[MongoCommandMetrics()] if config['METRICS_ENABLED'] else [],
+        # Server discovery happens in the background; nothing here blocks on the network
+        connect=False
+    )
+
+
+def get_db():
+    """
+    Returns this process's database handle, creating the client on first use.
+    Returns None if the settings are invalid (e.g. a malformed MONGO_URI).
+    """
+    global _client, _db, _pid
+    if _pid == os.getpid() or _settings is None:
+        return _db
+    with _lock:
+        if _pid != os.getpid():
+            # Either the first call, or we are a forked child holding the parent's client
+            try:
+                _client = (_client_factory or _create_client)(_settings)
+                _db = _client[_settings['MONGO_DB_NAME']]
+            except (ConfigurationError, ValueError, TypeError) as e:
+                print(f"MongoDB configuration error: {e}")
+                _client, _db = None, None
+            _pid = os.getpid()
+            if _db is not None and _on_connect is not None:
+                threading.Thread(target=_on_connect, args=(_db,), name="db-on-connect", daemon=True).start()
+    return _db
+
+
+def db_status():
+    """
+    Pings the server and returns "connected" or "error: ..." for the status route.
+    """
+    db = get_db()
+    if db is None:
+        return "error: database not configured"
+    try:
+        db.client.admin.command('ping')
+        return "connected"
+    except Exception as e:
+        return f"error: {e}"
+
+
+# Every index the routes and workers rely on, as (collection, keys, options).
+# ensure_indexes() creates them on startup; `python -m benchmarks.load_test
+# --check-plans` checks that the queries the routes send actually use them.
+INDEXES = [
+    # Register, login and change-password look users up by name; unique also
+    # stops two concurrent registrations from creating the same user twice
+    ("users", [("username", 1)], {"unique": True}),
+    # Keyset pagination: WHERE username = ? ORDER BY timestamp DESC, _id DESC.
+    # Also serves the recent-entries and period range queries (read backwards for ascending order)
+    ("journal_entries", [("username", 1), ("timestamp", -1), ("_id", -1)], {}),
+    # Delta sync (services/journal_sync.py): WHERE username = ? AND (updated_at, _id) > token
+    ("journal_entries", [("username", 1), ("updated_at", 1), ("_id", 1)], {}),
+    # Keyword search (services/search.py); a collection can have only one text index
+    ("journal_entries", [("username", 1), ("text", "text")], {}),
+    # One counters document per user and day
+    ("sentiment_rollups", [("username", 1), ("day", 1)], {"unique": True}),
+    # Due jobs are claimed oldest first
+    ("sentiment_queue", [("available_at", 1)], {}),
+    # Prompt pools due for a refill are claimed oldest first; the sweep looks for
+    # unscheduled (refill_at null) pools by when they were last refreshed
+    ("prompt_pool", [("refill_at", 1), ("refreshed_at", 1)], {}),
+    # Cached per-bucket period summaries expire when unused
+    ("period_bucket_summaries", [("created_at", 1)], {"expireAfterSeconds": BUCKET_SUMMARY_TTL_SECONDS}),
+]
+
+
+def ensure_indexes(db):
+    """
+    Creates the indexes in INDEXES. Safe to run on every startup: existing
+    indexes are left alone, and one that cannot be built (e.g. duplicate
+    usernames already stored) is reported without stopping the others.
+    """
+    for collection, keys, options in INDEXES:
+        try:
+            db[collection].create_index(keys, **options)
+        except OperationFailure as e:
+            print(f"Could not create index {keys} on {collection}: {e}")
+
+
+def encode_cursor(entry):
+    """
+    Builds an opaque cursor pointing just after the given entry.
+    """
+    raw = json.dumps({"t": entry["timestamp"].isoformat(), "i": str(entry["_id"])}, separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    """
+    Returns (timestamp, ObjectId) from a cursor made by encode_cursor.
+    """
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        data = json.loads(raw)
+        return datetime.fromisoformat(data["t"]), ObjectId(data["i"])
+    except (ValueError, KeyError, TypeError, InvalidId) as e:
+        raise InvalidCursor("Invalid pagination cursor") from e
+
+
+def entry_to_json(entry):
+    """
+    Shapes a stored entry the way the journal routes return it.
+    """
+    return {
+        "id": str(entry['_id']),
+        "text": entry['text'],
+        "date": display_date(entry['timestamp']),
+        "sentiment": entry.get('sentiment', 'unknown') # Default to 'unknown' if not present
+    }
+
+
+def fetch_entries_page(db, username, limit, cursor=None):
+    """
+    Returns (entries, next_cursor) for one page of a user's entries, newest first,
+    each entry as a JSON object string (see entry_json()).
+    next_cursor is None on the last page.
+    """
+    query = {"username": username}
+    if cursor:
+        timestamp, entry_id = decode_cursor(cursor)
+        query["$or"] = [
+            {"timestamp": {"$lt": timestamp}},
+            {"timestamp": timestamp, "_id": {"$lt": entry_id}}
+        ]
+
+    # Fetch one extra document to learn whether another page exists
+    documents = list(
+        db.journal_entries.find(query, ENTRY_LIST_PROJECTION)
+        .sort([("timestamp", -1), ("_id", -1)])
+        .limit(limit + 1)
+    )
+    next_cursor = encode_cursor(documents[limit - 1]) if len(documents) > limit else None
+    return [entry_json(entry) for entry in documents[:limit]], next_cursor
+
+
+def iter_all_entries(db, username):
+    """
+    Yields every entry of a user, newest first, as JSON object strings.
+    """
+    for entry in db.journal_entries.find({"username": username}, ENTRY_LIST_PROJECTION).sort("timestamp", -1):
+        yield entry_json(entry)
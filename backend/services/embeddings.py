@@ -0,0 +1,248 @@
+"""
+Local embeddings for "related past entries": GET /journal/<username>/related/<entry_id>.
+
+Each entry gets a dense vector of signed, hashed unigram and bigram counts
+(no model download, no network call), computed when the entry is written and
+stored on it as EMBEDDING_DIM little-endian float32 values in a BSON Binary
+field. `flask --app app reembed-entries` is the migration: it embeds
+entries written before embeddings existed and, after embed() changes,
+recomputes vectors made by an older EMBEDDING_VERSION (embedding_state
+records the version each user's entries were embedded by). Lookups never
+write in bulk: an entry asked about that has no vector yet is embedded on
+its own, and entries without one are otherwise just not suggested until
+the migration reaches them.
+
+A user's vectors are loaded into one (n, EMBEDDING_DIM) matrix and kept in a
+small per-process LRU, keyed by the user's entries_version (bumped by writes
+that add entries, not by sentiment changes), so a lookup is a
+single matrix-vector product; the vectors are unit length, so that product
+is the cosine similarity.
+"""
+import math
+import threading
+import zlib
+from collections import OrderedDict
+
+import numpy as np
+from bson.binary import Binary
+from bson.errors import InvalidId
+from bson.objectid import ObjectId
+from pymongo import UpdateOne
+
+from services.db_services import ENTRY_LIST_PROJECTION, entry_to_json
+from services.local_sentiment import tokenize
+from services.search import stem
+from services.versioning import bump_version, get_version
+
+# Changing this needs every stored embedding recomputed ($unset them and restart)
+EMBEDDING_DIM = 256
+# Bump when embed() changes, then run `flask --app app reembed-entries`
+EMBEDDING_VERSION = 2
+EMBED_BATCH_SIZE = 500
+# Users whose matrices each process keeps in memory (EMBEDDING_DIM * 4 bytes per entry)
+MAX_CACHED_USERS = 64
+# Hash collisions alone give unrelated entries scores of up to about this much
+MIN_SIMILARITY = 0.1
+
+# Function words carry no topic; left in, they make every pair of entries look alike
+STOP_WORDS = {
+    "i", "me", "my", "myself", "we", "our", "you", "your", "he", "she", "it", "its", "they", "them", "their",
+    "a", "an", "the", "and", "or", "so", "if", "then", "than", "to", "of", "in", "on", "at", "by", "for",
+    "with", "about", "from", "up", "down", "out", "into", "over", "is", "am", "are", "was", "were", "be",
+    "been", "being", "have", "has", "had", "do", "does", "did", "that", "this", "these", "those", "there",
+    "what", "which", "who", "when", "where", "how", "just", "very", "really", "today", "also", "as", "all",
+    "some", "any", "can", "could", "would", "should", "will", "get", "got", "go", "went", "much", "more",
+}
+
+# username -> (entries_version, UserMatrix)
+_matrices = OrderedDict()
+_lock = threading.Lock()
+
+
+class UserMatrix:
+    """A user's embeddings, one row per entry."""
+
+    def __init__(self, ids, matrix):
+        self.ids = ids
+        self.matrix = matrix
+        self.rows = {entry_id: row for row, entry_id in enumerate(ids)}
+
+
+def embed(text):
+    """
+    Returns the unit-length float32 vector of text (all zeros if it has no content words).
+    """
+    # Negation matters for sentiment, not for topic: "can't stop thinking about exams" is about exams
+    words = (token.removeprefix("not_") for token in tokenize(text))
+    tokens = [stem(word) for word in words if word.isalpha() and word not in STOP_WORDS]
+    grams = tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]
+    if not grams:
+        return np.zeros(EMBEDDING_DIM, dtype=np.float32)
+    hashes = np.fromiter((zlib.crc32(gram.encode('utf-8')) for gram in grams), dtype=np.uint32, count=len(grams))
+    # The low bits pick the dimension and the top bit the sign, so collisions tend to cancel out
+    signs = np.where(hashes >> 31, -1.0, 1.0)
+    vector = np.bincount(hashes % EMBEDDING_DIM, weights=signs, minlength=EMBEDDING_DIM)
+    # Damp repeated words so one long rant does not dominate the direction
+    vector = np.sign(vector) * np.log1p(np.abs(vector))
+    norm = math.sqrt(float(vector @ vector))
+    return (vector / norm if norm else vector).astype(np.float32)
+
+
+def to_binary(vector):
+    return Binary(np.asarray(vector, dtype='<f4').tobytes())
+
+
+def embedding_field(text):
+    """
+    The stored form of text's embedding, for the "embedding" field of a journal entry.
+    """
+    return to_binary(embed(text))
+
+
+def _text_of(entry):
+    # Entries stored before text was validated may hold something else; they embed as empty
+    text = entry.get("text")
+    return text if isinstance(text, str) else ""
+
+
+def _embed_batches(db, entries, batch_size):
+    """
+    Stores the embeddings of entries ({_id, text} documents) in bulk writes of
+    batch_size. Returns how many were written.
+    """
+    written = 0
+    updates = []
+    for entry in entries:
+        updates.append(UpdateOne({"_id": entry["_id"]}, {"$set": {"embedding": embedding_field(_text_of(entry))}}))
+        if len(updates) >= batch_size:
+            db.journal_entries.bulk_write(updates, ordered=False)
+            written += len(updates)
+            updates = []
+    if updates:
+        db.journal_entries.bulk_write(updates, ordered=False)
+        written += len(updates)
+    return written
+
+
+def reembed_entries(db, username=None, batch_size=EMBED_BATCH_SIZE, report=print):
+    """
+    Embeds every user's (or just username's) entries that have no embedding,
+    and recomputes all of a user's embeddings if they were made by an older
+    EMBEDDING_VERSION, in batches of batch_size. Safe to rerun and to run
+    while the app is serving; a user interrupted halfway is redone. Returns
+    the number of entries written.
+    """
+    usernames = [username] if username else db.journal_entries.distinct("username")
+    written = 0
+    for name in usernames:
+        state = db.embedding_state.find_one({"_id": name})
+        query = {"username": name}
+        if state is not None and state.get("version") == EMBEDDING_VERSION:
+            query["embedding"] = {"$exists": False}
+        count = _embed_batches(db, db.journal_entries.find(query, {"text": 1}), batch_size)
+        db.embedding_state.update_one({"_id": name}, {"$set": {"version": EMBEDDING_VERSION}}, upsert=True)
+        if count:
+            # Cached matrices everywhere lack or hold old vectors for these entries
+            bump_version(db, name, entries=True)
+            written += count
+            report(f"Embedded {count} entries of {name}; {written} so far")
+    return written
+
+
+def _load_matrix(db, username):
+    """
+    Returns a UserMatrix of all of a user's embedded entries.
+    """
+    ids, chunks = [], []
+    for entry in db.journal_entries.find({"username": username, "embedding": {"$exists": True}}, {"embedding": 1}):
+        ids.append(entry["_id"])
+        chunks.append(bytes(entry["embedding"]))
+    return UserMatrix(ids, np.frombuffer(b"".join(chunks), dtype='<f4').reshape(len(ids), EMBEDDING_DIM))
+
+
+def user_matrix(db, username):
+    """
+    Returns the UserMatrix of a user, reloading it only when entries were added since it was loaded.
+    """
+    # Read the version before the data: a write landing in between only costs a reload
+    version = get_version(db, username, "entries_version")
+    with _lock:
+        cached = _matrices.get(username)
+        if cached is not None and cached[0] == version:
+            _matrices.move_to_end(username)
+            return cached[1]
+
+    loaded = _load_matrix(db, username)
+    with _lock:
+        _matrices[username] = (version, loaded)
+        _matrices.move_to_end(username)
+        while len(_matrices) > MAX_CACHED_USERS:
+            _matrices.popitem(last=False)
+    return loaded
+
+
+def nearest(matrix, vector, limit, exclude=None):
+    """
+    Returns [(row, score)] for the limit rows most similar to vector, best first.
+    Rows scoring below MIN_SIMILARITY are left out.
+    """
+    if not len(matrix) or limit < 1:
+        return []
+    scores = matrix @ vector
+    if exclude is not None:
+        scores[exclude] = -np.inf
+    count = min(limit, len(scores))
+    # Partial selection of the top rows, then a sort of just those
+    top = np.argpartition(-scores, count - 1)[:count]
+    top = top[np.argsort(-scores[top], kind='stable')]
+    return [(int(row), float(scores[row])) for row in top if scores[row] >= MIN_SIMILARITY]
+
+
+def _fetch_results(db, ids, matches):
+    documents = {doc["_id"]: doc for doc in db.journal_entries.find({"_id": {"$in": [ids[row] for row, _ in matches]}},
+                                                                    ENTRY_LIST_PROJECTION)}
+    # An entry deleted since the matrix was loaded is just left out
+    return [{**entry_to_json(documents[ids[row]]), "score": round(score, 4)}
+            for row, score in matches if ids[row] in documents]
+
+
+def _entry_vector(db, entry):
+    """
+    The stored embedding of an entry, or, for one the migration has not reached
+    yet, its embedding computed and stored now. No version is bumped: the
+    entry's text did not change, and other users of the matrix can wait for the migration.
+    """
+    if "embedding" in entry:
+        return np.frombuffer(bytes(entry["embedding"]), dtype='<f4')
+    vector = embed(_text_of(entry))
+    db.journal_entries.update_one({"_id": entry["_id"], "embedding": {"$exists": False}},
+                                  {"$set": {"embedding": to_binary(vector)}})
+    return vector
+
+
+def related_entries(db, username, entry_id, limit):
+    """
+    Returns the limit entries of a user most similar to one of their entries,
+    best first, each with a cosine similarity score; None if there is no such entry.
+    """
+    try:
+        entry_id = ObjectId(entry_id)
+    except (InvalidId, TypeError):
+        return None
+    user = user_matrix(db, username)
+    row = user.rows.get(entry_id)
+    if row is not None:
+        return _fetch_results(db, user.ids, nearest(user.matrix, user.matrix[row], limit, exclude=row))
+    # Not embedded yet, or written after the matrix was loaded
+    entry = db.journal_entries.find_one({"_id": entry_id, "username": username}, {"text": 1, "embedding": 1})
+    if entry is None:
+        return None
+    return _fetch_results(db, user.ids, nearest(user.matrix, _entry_vector(db, entry), limit))
+
+
+def related_to_text(db, username, text, limit, exclude_id=None):
+    """
+    Returns the limit entries of a user most similar to text, best first.
+    """
+    user = user_matrix(db, username)
+    return _fetch_results(db, user.ids, nearest(user.matrix, embed(text), limit, user.rows.get(exclude_id)))
@@ -0,0 +1,80 @@
+"""
+The compact journal entry schema, and the JSON writer for journal listings.
+
+A journal_entries document holds:
+
+    _id             ObjectId
+    username        str
+    text            str
+    timestamp       datetime, naive server-local time
+    sentiment       str (a label, "pending", "unknown" or "error")
+    sentiment_tier  "local" or "llm"; absent until a tier has classified the entry
+    updated_at      datetime, UTC (delta sync)
+    embedding       Binary (related entries)
+
+The "date" the routes return is derived from timestamp at read time.
+Entries written before this schema also carry a date_display copy of it and
+a null sentiment_tier while pending; `flask --app app migrate-entries`
+removes both.
+
+The journal listing writes each entry's JSON straight from the decoded
+document instead of building the entry_to_json() dict and having jsonify
+sort and serialize it. The documents are still decoded by pymongo's C
+extension: RawBSONDocument decodes the whole document on first field
+access, and walking the raw bytes in Python would be slower than that.
+"""
+import json
+
+from pymongo import UpdateMany
+
+# Fields an entry may carry that the current schema no longer writes
+LEGACY_FIELDS = ("date_display",)
+# Fields the current schema leaves out rather than storing as null
+OMITTED_WHEN_NULL = ("sentiment_tier",)
+MIGRATION_BATCH_SIZE = 1000
+
+def display_date(timestamp):
+    """
+    The "date" shown for an entry, e.g. "2024-05-01 08:30:00".
+    """
+    return timestamp.isoformat(" ", "seconds")
+
+
+def migrate_entries(db, batch_size=MIGRATION_BATCH_SIZE, report=print):
+    """
+    Removes the legacy fields, and stored nulls of OMITTED_WHEN_NULL fields,
+    from stored entries in batches of batch_size. Safe to rerun and to run
+    while the app is serving. Returns the number of entries rewritten.
+    """
+    legacy = {"$or": [{field: {"$exists": True}} for field in LEGACY_FIELDS] +
+                     [{field: {"$exists": True, "$eq": None}} for field in OMITTED_WHEN_NULL]}
+    migrated = 0
+    while True:
+        ids = [doc["_id"] for doc in db.journal_entries.find(legacy, {"_id": 1}).limit(batch_size)]
+        if not ids:
+            return migrated
+        operations = [UpdateMany({"_id": {"$in": ids}}, {"$unset": {field: "" for field in LEGACY_FIELDS}})]
+        # Only where still null: a sentiment worker may have set the tier since
+        operations += [UpdateMany({"_id": {"$in": ids}, field: {"$exists": True, "$eq": None}}, {"$unset": {field: ""}})
+                       for field in OMITTED_WHEN_NULL]
+        db.journal_entries.bulk_write(operations)
+        migrated += len(ids)
+        report(f"Migrated {migrated} entries")
+
+
+def _json_value(value):
+    # json.dumps() without arguments reuses the module's shared encoder, which is the fast path for strings
+    return json.dumps(value) if isinstance(value, str) else json.dumps(value, default=str)
+
+
+def entry_json(entry):
+    """
+    The JSON object for a stored entry; the same as
+    json.dumps(entry_to_json(entry), sort_keys=True) gives. Only the listing
+    fields are read, so entries without a sentiment_tier (or any other
+    optional field) are fine, and a text or sentiment of another type is
+    written as JSON rather than failing the whole listing.
+    """
+    # Keys in sorted order, like jsonify
+    return (f'{{"date":"{display_date(entry["timestamp"])}","id":"{entry["_id"]}",'
+            f'"sentiment":{_json_value(entry.get("sentiment", "unknown"))},"text":{_json_value(entry["text"])}}}')
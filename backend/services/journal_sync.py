@@ -0,0 +1,105 @@
+"""
+Delta sync for journal entries: GET /journal/<username>/changes?since=<token>.
+
+Every write path stamps the entries it inserts or modifies with updated_at
+(UTC, from the writing process's clock). A sync token holds a position in
+(updated_at, _id) order; the changes route returns the entries after it,
+oldest change first, and a token to continue from.
+
+Writes from other processes can become visible slightly out of updated_at
+order (commit delay, clock skew between web servers). So once a client has
+caught up, its next token points lag_seconds before the time of the request,
+and the next sync repeats the changes made in that window. Clients apply
+changes by entry id, so repeats are harmless.
+"""
+import base64
+import json
+from datetime import datetime, timedelta
+
+from bson.errors import InvalidId
+from bson.objectid import ObjectId
+
+from services.db_services import ENTRY_LIST_PROJECTION, InvalidCursor, entry_to_json
+
+# updated_at given to entries written before the field existed, so a first sync includes them
+EPOCH = datetime(1970, 1, 1)
+
+CHANGES_PROJECTION = {**ENTRY_LIST_PROJECTION, "updated_at": 1}
+
+# Users whose older entries this process has already stamped
+_stamped_users = set()
+
+
+def encode_token(updated_at, entry_id=None):
+    """
+    Builds an opaque sync token: after entry_id at updated_at, or after updated_at if entry_id is None.
+    """
+    data = {"t": updated_at.isoformat()}
+    if entry_id is not None:
+        data["i"] = str(entry_id)
+    raw = json.dumps(data, separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_token(token):
+    """
+    Returns (updated_at, ObjectId or None) from a token made by encode_token.
+    """
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        data = json.loads(raw)
+        return datetime.fromisoformat(data["t"]), ObjectId(data["i"]) if "i" in data else None
+    except (ValueError, KeyError, TypeError, InvalidId) as e:
+        raise InvalidCursor("Invalid sync token") from e
+
+
+def ensure_updated_at(db, username):
+    """
+    Stamps a user's entries that predate updated_at with EPOCH, once per process.
+    """
+    if username in _stamped_users:
+        return
+    db.journal_entries.update_many({"username": username, "updated_at": {"$exists": False}},
+                                   {"$set": {"updated_at": EPOCH}})
+    _stamped_users.add(username)
+
+
+def fetch_changes(db, username, limit, token=None, lag_seconds=10):
+    """
+    Returns (entries, next_token, has_more) for the entries inserted or
+    modified after token (all entries when token is None).
+    """
+    started = datetime.utcnow()
+    ensure_updated_at(db, username)
+
+    query = {"username": username}
+    if token:
+        updated_at, entry_id = decode_token(token)
+        if entry_id is None:
+            query["updated_at"] = {"$gt": updated_at}
+        else:
+            query["$or"] = [
+                {"updated_at": {"$gt": updated_at}},
+                {"updated_at": updated_at, "_id": {"$gt": entry_id}}
+            ]
+
+    # Fetch one extra document to learn whether another page exists
+    documents = list(
+        db.journal_entries.find(query, CHANGES_PROJECTION)
+        .sort([("updated_at", 1), ("_id", 1)])
+        .limit(limit + 1)
+    )
+    has_more = len(documents) > limit
+    documents = documents[:limit]
+    if has_more:
+        last = documents[-1]
+        next_token = encode_token(last["updated_at"], last["_id"])
+    else:
+        # Caught up: step back so changes still becoming visible are picked up next time,
+        # but never behind where this request started from
+        resume_at = started - timedelta(seconds=lag_seconds)
+        if token:
+            resume_at = max(resume_at, updated_at)
+        next_token = encode_token(resume_at)
+    return [{**entry_to_json(entry), "updated_at": entry["updated_at"].isoformat() + "Z"}
+            for entry in documents], next_token, has_more
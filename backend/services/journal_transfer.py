@@ -0,0 +1,168 @@
+"""
+NDJSON export and bulk import of a user's journal.
+
+Export streams one JSON object per line straight from a MongoDB cursor, so
+memory use does not grow with the journal. Import reads the request body a
+line at a time and writes unordered insert_many batches; imported entries keep
+their timestamps and are stored as "pending" for the sentiment workers, so an
+import never waits on Gemini.
+
+Each line is {"text": "...", "timestamp": "2024-05-01T08:30:00"}; other fields
+(such as the id, date and sentiment an export includes) are ignored on import.
+"""
+import json
+from datetime import datetime
+
+from pymongo.errors import BulkWriteError
+
+from services.embeddings import embedding_field
+from services.entry_schema import display_date
+from services.rollups import record_sentiment_changes
+from services.sentiment_queue import PENDING_SENTIMENT, enqueue_sentiments
+from services.versioning import bump_version
+
+EXPORT_PROJECTION = {"text": 1, "timestamp": 1, "sentiment": 1}
+EXPORT_BATCH_SIZE = 500
+
+# Line errors reported back in the import response; the rest are only counted
+MAX_REPORTED_ERRORS = 20
+
+
+class InvalidLine(ValueError):
+    """An import line is not a usable journal entry."""
+
+
+def export_lines(db, username):
+    """
+    Yields the user's entries as NDJSON lines, oldest first.
+    """
+    cursor = (db.journal_entries.find({"username": username}, EXPORT_PROJECTION)
+              .sort([("timestamp", 1), ("_id", 1)])
+              .batch_size(EXPORT_BATCH_SIZE))
+    for entry in cursor:
+        yield json.dumps({
+            "id": str(entry["_id"]),
+            "text": entry["text"],
+            "timestamp": entry["timestamp"].isoformat(),
+            "date": display_date(entry["timestamp"]),
+            "sentiment": entry.get("sentiment", "unknown")
+        }, ensure_ascii=False) + "\n"
+
+
+def read_lines(stream, max_line_bytes):
+    """
+    Yields the lines of a binary stream without reading it whole. A line
+    longer than max_line_bytes is yielded as None, and the rest of it skipped.
+    """
+    while True:
+        line = stream.readline(max_line_bytes + 1)
+        if not line:
+            return
+        if len(line) > max_line_bytes and not line.endswith(b"\n"):
+            # Skip to the end of the oversized line
+            while line and not line.endswith(b"\n"):
+                line = stream.readline(max_line_bytes + 1)
+            yield None
+            continue
+        yield line
+
+
+def parse_line(line, username):
+    """
+    Turns one import line into a journal_entries document.
+    """
+    try:
+        data = json.loads(line)
+    except ValueError as e:
+        raise InvalidLine(f"not valid JSON ({e})") from None
+    if not isinstance(data, dict) or not isinstance(data.get("text"), str) or not data["text"].strip():
+        raise InvalidLine("missing 'text'")
+
+    timestamp = data.get("timestamp")
+    if timestamp is None:
+        timestamp = datetime.now()
+    else:
+        try:
+            timestamp = datetime.fromisoformat(timestamp)
+        except (TypeError, ValueError):
+            raise InvalidLine(f"invalid timestamp {timestamp!r}") from None
+        if timestamp.tzinfo is not None:
+            # Stored timestamps are naive server-local times, like datetime.now() in add_journal_entry
+            timestamp = timestamp.astimezone().replace(tzinfo=None)
+
+    return {
+        "text": data["text"],
+        "timestamp": timestamp,
+        "username": username,
+        "sentiment": PENDING_SENTIMENT,
+        "embedding": embedding_field(data["text"])
+    }
+
+
+def _write_batch(db, batch):
+    """
+    Inserts a batch of (line number, document) pairs and records the rollups
+    and sentiment jobs for the documents that were stored. Returns
+    (inserted count, [(line number, error message)] for the rest).
+    """
+    now = datetime.utcnow()
+    entries = [entry for _, entry in batch]
+    for entry in entries:
+        entry["updated_at"] = now
+    failed = {}
+    try:
+        db.journal_entries.insert_many(entries, ordered=False)
+    except BulkWriteError as e:
+        # Unordered: every document without a write error was inserted
+        failed = {error["index"]: error.get("errmsg", "insert failed") for error in e.details.get("writeErrors", [])}
+        if not failed:
+            raise
+    # insert_many sets _id on the documents it is given
+    inserted = [entry for index, entry in enumerate(entries) if index not in failed]
+    if inserted:
+        record_sentiment_changes(db, [(entry["username"], entry["timestamp"], None, PENDING_SENTIMENT)
+                                      for entry in inserted])
+        enqueue_sentiments(db, [(entry["_id"], entry["username"]) for entry in inserted])
+    return len(inserted), [(batch[index][0], message) for index, message in sorted(failed.items())]
+
+
+def import_lines(db, username, lines, batch_size=500):
+    """
+    Stores the entries from an iterable of NDJSON lines (None for a line that
+    was too long) and returns {"imported": n, "skipped": n, "errors": [...]}.
+    Lines that parse but fail to insert are counted as skipped.
+    """
+    imported, skipped, errors = 0, 0, []
+    batch = []
+
+    def write(batch):
+        nonlocal imported, skipped
+        inserted, failures = _write_batch(db, batch)
+        imported += inserted
+        skipped += len(failures)
+        for number, message in failures[:MAX_REPORTED_ERRORS - len(errors)]:
+            errors.append({"line": number, "error": message})
+
+    try:
+        for number, line in enumerate(lines, 1):
+            try:
+                if line is None:
+                    raise InvalidLine("line too long")
+                if not line.strip():
+                    continue
+                batch.append((number, parse_line(line, username)))
+            except InvalidLine as e:
+                skipped += 1
+                if len(errors) < MAX_REPORTED_ERRORS:
+                    errors.append({"line": number, "error": str(e)})
+                continue
+            if len(batch) >= batch_size:
+                write(batch)
+                batch = []
+        if batch:
+            write(batch)
+    finally:
+        # Batches written before a failure are kept, so their readers must see them
+        if imported:
+            bump_version(db, username, entries=True)
+    return {"imported": imported, "skipped": skipped, "errors": errors}
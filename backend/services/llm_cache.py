@@ -0,0 +1,238 @@
+"""
+Content-addressed cache for Gemini responses.
+
+Responses are keyed by a hash of (model, contents, generationConfig), so the
+same prompt sent with the same settings is only paid for once. There is an
+in-process LRU+TTL tier per worker and an optional persistent tier in a Mongo
+collection shared by all workers. Concurrent misses for the same key are
+coalesced so only one of them goes upstream.
+"""
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+
+def cache_key(model, payload):
+    """
+    Returns a stable hex digest for a generateContent request.
+    """
+    canonical = json.dumps({
+        "model": model,
+        "contents": payload.get("contents"),
+        "generationConfig": payload.get("generationConfig"),
+    }, sort_keys=True, separators=(',', ':'), ensure_ascii=False)
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+class _InFlight:
+    """A pending upstream call that other threads can wait on."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+        self.upstream_seconds = 0.0
+
+
+class LLMResponseCache:
+    """
+    Two-tier response cache with single-flight coalescing.
+
+    The memory tier is an LRU bounded by max_entries with a per-entry TTL.
+    The persistent tier is attached with attach_collection() and relies on a
+    Mongo TTL index on created_at for expiry.
+    """
+
+    def __init__(self, max_entries=1024, ttl=86400, persistent_ttl=7 * 86400):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.persistent_ttl = persistent_ttl
+        self.collection = None
+        self._entries = OrderedDict()  # key -> (expires_at, value, upstream_seconds)
+        self._in_flight = {}
+        self._lock = threading.Lock()
+        self.stats = {
+            "hits": 0,
+            "persistent_hits": 0,
+            "misses": 0,
+            "coalesced": 0,
+            "evictions": 0,
+            "expirations": 0,
+            "upstream_calls": 0,
+            "upstream_errors": 0,
+            # Upstream latency we did not have to pay because of hits and coalescing
+            "saved_seconds": 0.0,
+        }
+
+    def attach_collection(self, collection):
+        """
+        Enables the persistent tier on the given Mongo collection.
+        """
+        collection.create_index("created_at", expireAfterSeconds=int(self.persistent_ttl))
+        self.collection = collection
+
+    def _get_memory(self, key):
+        # Caller holds self._lock
+        item = self._entries.get(key)
+        if item is None:
+            return None
+        expires_at, value, upstream_seconds = item
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            self.stats["expirations"] += 1
+            return None
+        self._entries.move_to_end(key)
+        return item
+
+    def _put_memory(self, key, value, upstream_seconds):
+        # Caller holds self._lock
+        self._entries[key] = (time.monotonic() + self.ttl, value, upstream_seconds)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.stats["evictions"] += 1
+
+    def _get_persistent(self, key):
+        if self.collection is None:
+            return None
+        try:
+            doc = self.collection.find_one({"_id": key})
+        except Exception as e:
+            print(f"LLM cache: persistent lookup failed: {e}")
+            return None
+        if not doc:
+            return None
+        return doc["response"], doc.get("upstream_seconds", 0.0)
+
+    def _put_persistent(self, key, value, upstream_seconds):
+        if self.collection is None:
+            return
+        try:
+            self.collection.update_one(
+                {"_id": key},
+                {"$set": {"response": value, "upstream_seconds": upstream_seconds, "created_at": datetime.utcnow()}},
+                upsert=True
+            )
+        except Exception as e:
+            print(f"LLM cache: persistent store failed: {e}")
+
+    def get(self, key):
+        """
+        Returns the cached value for key from either tier, or None on a miss.
+        """
+        with self._lock:
+            item = self._get_memory(key)
+            if item is not None:
+                self.stats["hits"] += 1
+                self.stats["saved_seconds"] += item[2]
+                return item[1]
+        persisted = self._get_persistent(key)
+        with self._lock:
+            if persisted is None:
+                self.stats["misses"] += 1
+                return None
+            value, upstream_seconds = persisted
+            self.stats["persistent_hits"] += 1
+            self.stats["saved_seconds"] += upstream_seconds
+            self._put_memory(key, value, upstream_seconds)
+        return value
+
+    def put(self, key, value, upstream_seconds=0.0):
+        """
+        Stores a value computed outside get_or_compute() (e.g. an assembled stream).
+        """
+        self._put_persistent(key, value, upstream_seconds)
+        with self._lock:
+            self.stats["upstream_calls"] += 1
+            self._put_memory(key, value, upstream_seconds)
+
+    def get_or_compute(self, key, compute, cacheable=None, private_errors=()):
+        """
+        Returns the cached value for key, or calls compute() once across all
+        concurrent callers and caches its result. Exceptions from compute()
+        are re-raised to every waiting caller and are not cached; neither are
+        values for which cacheable(value) is false. Exceptions that only
+        concern the leader (private_errors, e.g. its user's quota refusal) are
+        not passed on: the waiters retry, and one of them leads the next call.
+        """
+        while True:
+            with self._lock:
+                item = self._get_memory(key)
+                if item is not None:
+                    self.stats["hits"] += 1
+                    self.stats["saved_seconds"] += item[2]
+                    return item[1]
+                flight = self._in_flight.get(key)
+                if flight is None:
+                    flight = _InFlight()
+                    self._in_flight[key] = flight
+                    break
+                self.stats["coalesced"] += 1
+
+            flight.done.wait()
+            if flight.error is None:
+                with self._lock:
+                    self.stats["saved_seconds"] += flight.upstream_seconds
+                return flight.value
+            if not isinstance(flight.error, private_errors):
+                raise flight.error
+
+        try:
+            persisted = self._get_persistent(key)
+            if persisted is not None:
+                value, upstream_seconds = persisted
+                with self._lock:
+                    self.stats["persistent_hits"] += 1
+                    self.stats["saved_seconds"] += upstream_seconds
+                    self._put_memory(key, value, upstream_seconds)
+            else:
+                with self._lock:
+                    self.stats["misses"] += 1
+                    self.stats["upstream_calls"] += 1
+                started = time.monotonic()
+                try:
+                    value = compute()
+                except Exception:
+                    with self._lock:
+                        self.stats["upstream_errors"] += 1
+                    raise
+                upstream_seconds = time.monotonic() - started
+                if cacheable is None or cacheable(value):
+                    self._put_persistent(key, value, upstream_seconds)
+                    with self._lock:
+                        self._put_memory(key, value, upstream_seconds)
+            flight.value = value
+            flight.upstream_seconds = upstream_seconds
+            return value
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+            flight.done.set()
+
+    def record(self, **deltas):
+        """
+        Adds to the counters, for callers that coordinate upstream calls
+        themselves (e.g. AsyncGeminiClient), e.g. record(coalesced=1).
+        """
+        with self._lock:
+            for name, amount in deltas.items():
+                self.stats[name] += amount
+
+    def snapshot(self):
+        """
+        Returns a copy of the counters plus the current memory-tier size.
+        """
+        with self._lock:
+            stats = dict(self.stats)
+            stats["entries"] = len(self._entries)
+        lookups = stats["hits"] + stats["persistent_hits"] + stats["misses"] + stats["coalesced"]
+        stats["hit_ratio"] = round((lookups - stats["misses"]) / lookups, 4) if lookups else 0.0
+        stats["saved_seconds"] = round(stats["saved_seconds"], 3)
+        stats["persistent_tier"] = self.collection is not None
+        return stats
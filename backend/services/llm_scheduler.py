@@ -0,0 +1,315 @@
+"""
+Admission control for Gemini calls, shared by all worker processes on a host.
+
+Before a call goes upstream (cache hits never get here) it must be admitted:
+
+- per user, a token bucket of LLM_USER_RPM requests per minute bursting to
+  LLM_USER_BURST; a user whose bucket is empty is turned away at once, so one
+  user cannot use up the quota or tie up worker threads waiting. Only
+  interactive calls (insights, prompts, summaries) count against it:
+  sentiment runs once per written entry, where a refusal would only leave an
+  "error" sentiment, and the prompt pool charges each background refill
+  itself with charge_user();
+- globally, LLM_GLOBAL_RPM requests and LLM_GLOBAL_TPM (estimated) tokens per
+  minute, matching the Gemini project quota.
+
+Callers waiting for the global budget queue in priority order (sentiment
+before interactive routes before background work) and, within a priority,
+round-robin by user: the user served least recently goes first, so a user
+with many requests in flight cannot push everyone else back. A caller that is
+not admitted within LLM_ADMISSION_MAX_WAIT gets GeminiQuotaExceeded.
+
+The buckets and the queue live in a small SQLite file (LLM_SCHEDULER_PATH),
+so gunicorn workers share them; every decision is one short IMMEDIATE
+transaction. Who is calling comes from llm_request(), a context manager the
+routes and workers wrap their Gemini calls in. A route that makes several
+calls for one request (e.g. a period summary) charges the user once with
+charge_user() and makes its calls with quota=False.
+"""
+import asyncio
+import contextlib
+import contextvars
+import os
+import random
+import sqlite3
+import threading
+import time
+
+from config import config_getter
+from services.metrics import observe_llm_admission
+
+PRIORITY_SENTIMENT = "sentiment"
+PRIORITY_INTERACTIVE = "interactive"
+PRIORITY_BACKGROUND = "background"
+# Lower goes first
+PRIORITIES = {PRIORITY_SENTIMENT: 0, PRIORITY_INTERACTIVE: 1, PRIORITY_BACKGROUND: 2}
+
+# The global buckets hold this many seconds of their rate, so short bursts are not queued
+BURST_SECONDS = 10
+# Waiters that stopped polling this long ago (e.g. their process died) are dropped from the queue
+WAITER_TIMEOUT = 10
+# Users not served for this long are forgotten; they count as never served
+SERVED_RETENTION = 3600
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS buckets (key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL);
+CREATE TABLE IF NOT EXISTS waiters (id INTEGER PRIMARY KEY AUTOINCREMENT, priority INTEGER NOT NULL,
+                                    username TEXT NOT NULL, heartbeat REAL NOT NULL);
+CREATE TABLE IF NOT EXISTS served (username TEXT PRIMARY KEY, last_served REAL NOT NULL);
+"""
+
+# The queue's head: highest priority, then the user served least recently, then the oldest waiter
+HEAD_QUERY = """
+SELECT w.id FROM waiters w LEFT JOIN served s ON s.username = w.username
+ORDER BY w.priority, COALESCE(s.last_served, 0), w.id LIMIT 1
+"""
+
+# (username or None, priority, quota) of the Gemini calls made in the current context
+_current = contextvars.ContextVar('llm_request', default=(None, PRIORITY_INTERACTIVE, True))
+
+
+@contextlib.contextmanager
+def llm_request(username=None, priority=PRIORITY_INTERACTIVE, quota=True):
+    """
+    Attributes the Gemini calls made inside the block to a user and priority class.
+    quota=False admits them without taking from the user's bucket, for calls
+    the caller already paid for with charge_user().
+    """
+    token = _current.set((username, priority, quota))
+    try:
+        yield
+    finally:
+        _current.reset(token)
+
+
+def current_llm_request():
+    return _current.get()
+
+
+def estimate_tokens(payload):
+    """
+    Rough token count of a generateContent request: ~4 characters per prompt
+    token plus the output limit.
+    """
+    chars = sum(len(part.get("text", "")) for content in payload.get("contents", [])
+                for part in content.get("parts", []))
+    return chars / 4 + payload.get("generationConfig", {}).get("maxOutputTokens", 0)
+
+
+class LLMScheduler:
+    """
+    Per-user token buckets, global request/token budgets and a fair priority
+    queue, kept in a SQLite file shared by the processes on this host.
+    """
+
+    def __init__(self, path, rpm=1000, tpm=1000000, user_rpm=10, user_burst=5, max_wait=10.0, poll_interval=0.02):
+        self.path = path
+        self.request_rate = rpm / 60
+        self.token_rate = tpm / 60
+        self.user_rate = user_rpm / 60
+        self.user_burst = float(user_burst)
+        self.max_wait = max_wait
+        self.poll_interval = poll_interval
+        # One connection per thread and process
+        self._local = threading.local()
+
+    @classmethod
+    def from_config(cls, config):
+        get = config_getter(config)
+        return cls(
+            path=get('LLM_SCHEDULER_PATH'),
+            rpm=get('LLM_GLOBAL_RPM'),
+            tpm=get('LLM_GLOBAL_TPM'),
+            user_rpm=get('LLM_USER_RPM'),
+            user_burst=get('LLM_USER_BURST'),
+            max_wait=get('LLM_ADMISSION_MAX_WAIT'),
+        )
+
+    def _db(self):
+        db = getattr(self._local, 'db', None)
+        if db is None or self._local.pid != os.getpid():
+            # Autocommit mode, so transactions are exactly the BEGIN IMMEDIATE blocks below
+            db = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            db.execute("PRAGMA journal_mode=WAL")
+            # Losing the last few decisions in a power cut is harmless
+            db.execute("PRAGMA synchronous=OFF")
+            db.executescript(SCHEMA)
+            self._local.db, self._local.pid = db, os.getpid()
+        return db
+
+    @contextlib.contextmanager
+    def _transaction(self):
+        db = self._db()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            yield db
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        db.execute("COMMIT")
+
+    @staticmethod
+    def _level(db, key, rate, capacity, now):
+        row = db.execute("SELECT tokens, updated FROM buckets WHERE key = ?", (key,)).fetchone()
+        return capacity if row is None else min(capacity, row[0] + (now - row[1]) * rate)
+
+    @staticmethod
+    def _store(db, key, tokens, now):
+        db.execute("INSERT OR REPLACE INTO buckets (key, tokens, updated) VALUES (?, ?, ?)", (key, tokens, now))
+
+    def _take_user_token(self, username):
+        """
+        Takes one request from the user's bucket. Returns 0, or the seconds until one is available.
+        """
+        key = f"user:{username}"
+        with self._transaction() as db:
+            now = time.time()
+            tokens = self._level(db, key, self.user_rate, self.user_burst, now)
+            if tokens >= 1:
+                self._store(db, key, tokens - 1, now)
+                return 0
+            return (1 - tokens) / self.user_rate
+
+    def _refund_user_token(self, username):
+        """
+        Puts back a request taken by _take_user_token() for a call that was then not admitted.
+        """
+        key = f"user:{username}"
+        with self._transaction() as db:
+            now = time.time()
+            tokens = self._level(db, key, self.user_rate, self.user_burst, now)
+            self._store(db, key, min(self.user_burst, tokens + 1), now)
+
+    def charge_user(self, username):
+        """
+        Takes one request from the user's bucket up front. Returns None, or the
+        seconds the caller should wait before retrying if the bucket is empty.
+        """
+        wait = self._take_user_token(username)
+        if wait:
+            observe_llm_admission(PRIORITY_INTERACTIVE, "refused", 0.0)
+            return wait
+        return None
+
+    def _join(self, username, priority):
+        with self._transaction() as db:
+            return db.execute("INSERT INTO waiters (priority, username, heartbeat) VALUES (?, ?, ?)",
+                              (PRIORITIES[priority], username or "", time.time())).lastrowid
+
+    def _leave(self, waiter):
+        with self._transaction() as db:
+            db.execute("DELETE FROM waiters WHERE id = ?", (waiter,))
+
+    def _try_global(self, waiter, username, priority, cost):
+        """
+        Admits the waiter if it heads the queue and the global budgets allow.
+        Returns 0 when admitted, otherwise how long to wait before trying again.
+        """
+        request_capacity = max(1.0, self.request_rate * BURST_SECONDS)
+        token_capacity = max(1.0, self.token_rate * BURST_SECONDS)
+        # A request bigger than the bucket would never fit
+        cost = min(cost, token_capacity)
+        with self._transaction() as db:
+            now = time.time()
+            db.execute("DELETE FROM waiters WHERE heartbeat < ?", (now - WAITER_TIMEOUT,))
+            if not db.execute("UPDATE waiters SET heartbeat = ? WHERE id = ?", (now, waiter)).rowcount:
+                # Dropped as stale after a long pause; rejoin in the same place
+                db.execute("INSERT INTO waiters (id, priority, username, heartbeat) VALUES (?, ?, ?, ?)",
+                           (waiter, PRIORITIES[priority], username or "", now))
+            if db.execute(HEAD_QUERY).fetchone()[0] != waiter:
+                return self.poll_interval
+
+            requests = self._level(db, "global:requests", self.request_rate, request_capacity, now)
+            tokens = self._level(db, "global:tokens", self.token_rate, token_capacity, now)
+            if requests < 1 or tokens < cost:
+                return max((1 - requests) / self.request_rate, (cost - tokens) / self.token_rate)
+
+            self._store(db, "global:requests", requests - 1, now)
+            self._store(db, "global:tokens", tokens - cost, now)
+            db.execute("DELETE FROM waiters WHERE id = ?", (waiter,))
+            db.execute("INSERT OR REPLACE INTO served (username, last_served) VALUES (?, ?)", (username or "", now))
+            if random.random() < 0.01:
+                db.execute("DELETE FROM served WHERE last_served < ?", (now - SERVED_RETENTION,))
+            return 0
+
+    def try_admit(self, username=None, priority=PRIORITY_INTERACTIVE, cost=0):
+        """
+        Admits a call only if it can go upstream right away: nobody queued
+        ahead of it and room in the global budgets. The user's bucket is not
+        charged (this is for hedges of calls already admitted). Returns True if admitted.
+        """
+        waiter = self._join(username, priority)
+        admitted = not self._try_global(waiter, username, priority, cost)
+        if not admitted:
+            self._leave(waiter)
+        observe_llm_admission(priority, "admitted" if admitted else "refused", 0.0)
+        return admitted
+
+    def _admission(self, username, priority, cost, quota):
+        """
+        Generator behind admit()/aadmit(): yields the seconds to sleep between
+        attempts and returns None once admitted, or the suggested retry delay
+        in seconds if the call should be refused.
+        """
+        deadline = time.monotonic() + self.max_wait
+        charged = username is not None and priority == PRIORITY_INTERACTIVE and quota
+        if charged:
+            # Not waited for: a user over their budget would otherwise hold a worker thread each
+            wait = self._take_user_token(username)
+            if wait:
+                return wait
+
+        waiter = self._join(username, priority)
+        admitted = False
+        try:
+            while True:
+                wait = self._try_global(waiter, username, priority, cost)
+                if not wait:
+                    # _try_global already removed the waiter
+                    admitted = True
+                    return None
+                # Poll at least every poll_interval, since the queue head can change any time
+                wait = min(wait, self.poll_interval) * random.uniform(0.5, 1.5)
+                if time.monotonic() + wait > deadline:
+                    return max(1.0, wait)
+                yield wait
+        finally:
+            if not admitted:
+                self._leave(waiter)
+                # Refused (or abandoned) for lack of global budget: the user's request was not used
+                if charged:
+                    self._refund_user_token(username)
+
+    def admit(self, username=None, priority=PRIORITY_INTERACTIVE, cost=0, quota=True):
+        """
+        Blocks until a call may go upstream. Returns None when admitted, or the
+        seconds the caller should wait before retrying if it was refused.
+        """
+        started = time.monotonic()
+        admission = self._admission(username, priority, cost, quota)
+        try:
+            while True:
+                time.sleep(next(admission))
+        except StopIteration as stop:
+            observe_llm_admission(priority, "refused" if stop.value else "admitted", time.monotonic() - started)
+            return stop.value
+
+    async def aadmit(self, username=None, priority=PRIORITY_INTERACTIVE, cost=0, quota=True):
+        """
+        admit() for the event loop: the SQLite steps run on a thread, the waits on the loop.
+        """
+        started = time.monotonic()
+        admission = self._admission(username, priority, cost, quota)
+
+        def step():
+            # StopIteration cannot cross into a Future, so hand back (done, value) instead
+            try:
+                return False, next(admission)
+            except StopIteration as stop:
+                return True, stop.value
+        while True:
+            done, value = await asyncio.to_thread(step)
+            if done:
+                observe_llm_admission(priority, "refused" if value else "admitted", time.monotonic() - started)
+                return value
+            await asyncio.sleep(value)
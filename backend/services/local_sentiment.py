@@ -0,0 +1,319 @@
+"""
+Local, network-free sentiment classification with LLM escalation.
+
+Two local scorers are available:
+- LinearSentimentModel: a softmax regression over hashed unigram/bigram
+  features, trained with NumPy on entries Gemini has already labelled and
+  stored in the sentiment_models collection so every worker shares it.
+- lexicon_sentiment: a small negation-aware word list, used until a model
+  has been trained.
+
+Both return a confidence. classify_tiered() keeps confident local answers and
+sends only the rest to Gemini, reporting which tier produced each label.
+"""
+import io
+import math
+import re
+import threading
+import time
+import zlib
+from datetime import datetime
+
+import numpy as np
+from bson.binary import Binary
+
+from services.ai_services import SENTIMENT_LABELS, classify_sentiments_batch
+
+TIER_LOCAL = "local"
+TIER_LLM = "llm"
+
+TOKEN_RE = re.compile(r"[a-z']+|[.,!?;:]")
+NEGATORS = {"not", "no", "never", "nothing", "nobody", "nowhere", "neither", "nor", "cannot", "without", "hardly", "barely"}
+CLAUSE_BREAKS = {".", ",", "!", "?", ";", ":", "but", "however", "although", "though"}
+
+POSITIVE_WORDS = {
+    "happy", "happier", "happiest", "glad", "joy", "joyful", "great", "good", "better", "best", "love", "loved",
+    "loving", "lovely", "wonderful", "amazing", "awesome", "excited", "exciting", "grateful", "thankful",
+    "calm", "peaceful", "relaxed", "relieved", "proud", "hopeful", "optimistic", "fun", "enjoyed", "enjoy",
+    "beautiful", "fantastic", "cheerful", "content", "satisfied", "confident", "accomplished", "productive",
+    "energized", "motivated", "inspired", "blessed", "delighted", "pleased", "smile", "smiled", "laughed",
+    "laugh", "success", "successful", "win", "won", "nice", "comfortable", "rested", "safe", "supported",
+}
+NEGATIVE_WORDS = {
+    "sad", "sadder", "unhappy", "depressed", "depressing", "angry", "mad", "furious", "upset", "anxious",
+    "anxiety", "worried", "worry", "stressed", "stress", "stressful", "tired", "exhausted", "lonely", "alone",
+    "afraid", "scared", "fear", "terrible", "awful", "horrible", "bad", "worse", "worst", "hate", "hated",
+    "cry", "cried", "crying", "hurt", "pain", "painful", "frustrated", "frustrating", "annoyed", "miserable",
+    "overwhelmed", "hopeless", "guilty", "ashamed", "disappointed", "disappointing", "sick", "ill", "lost",
+    "failed", "failure", "panic", "nervous", "broken", "empty", "regret", "bored", "drained", "struggling",
+}
+INTENSIFIERS = {"very", "really", "so", "extremely", "incredibly", "super", "totally", "truly", "deeply"}
+
+
+def tokenize(text):
+    """
+    Lowercases and tokenizes text, prefixing words in the scope of a negator
+    with "not_" until the next clause break.
+    """
+    tokens = []
+    negated = False
+    for token in TOKEN_RE.findall(text.lower()):
+        if token in CLAUSE_BREAKS:
+            negated = False
+            if token.isalpha():
+                tokens.append(token)
+            continue
+        if token in NEGATORS or token.endswith("n't"):
+            negated = True
+            tokens.append(token)
+            continue
+        tokens.append("not_" + token if negated else token)
+    return tokens
+
+
+def lexicon_sentiment(text):
+    """
+    Scores text against the word lists. Returns (label, confidence).
+    """
+    positive = negative = 0.0
+    boost = 1.0
+    for token in tokenize(text):
+        if token in INTENSIFIERS:
+            boost = 1.5
+            continue
+        word = token[4:] if token.startswith("not_") else token
+        negated = token.startswith("not_")
+        if word in POSITIVE_WORDS:
+            if negated:
+                negative += boost
+            else:
+                positive += boost
+        elif word in NEGATIVE_WORDS:
+            # "not bad" is mildly positive at most
+            if negated:
+                positive += 0.5 * boost
+            else:
+                negative += boost
+        boost = 1.0
+
+    if positive == 0 and negative == 0:
+        # No signal: probably neutral, but not confident enough to skip the LLM
+        return "neutral", 0.4
+    if positive >= 1 and negative >= 1:
+        # Mixed feelings are subtle; the lexicon never trusts itself enough to skip the LLM here
+        balance = min(positive, negative) / max(positive, negative)
+        if balance >= 0.5:
+            return "mixed", 0.5 + 0.2 * balance
+    label = "positive" if positive > negative else "negative"
+    # More evidence on one side and less on the other means more confidence
+    margin = abs(positive - negative)
+    return label, min(0.95, (1 - 0.5 ** margin) * (1 - 0.15 * min(positive, negative)))
+
+
+def hashed_features(text, n_features):
+    """
+    Returns (indices, values) of the hashed unigram+bigram features of text,
+    L2-normalised. crc32 keeps the hashing stable across processes.
+    """
+    tokens = tokenize(text)
+    grams = tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]
+    if not grams:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+    indices = np.fromiter((zlib.crc32(gram.encode('utf-8')) % n_features for gram in grams),
+                          dtype=np.int64, count=len(grams))
+    indices, counts = np.unique(indices, return_counts=True)
+    values = counts.astype(np.float32)
+    values /= np.linalg.norm(values)
+    return indices, values
+
+
+class LinearSentimentModel:
+    """
+    Multinomial logistic regression over hashed features.
+    """
+
+    def __init__(self, weights, bias, n_features):
+        self.weights = weights  # (n_features, n_labels) float32
+        self.bias = bias        # (n_labels,) float32
+        self.n_features = n_features
+
+    @staticmethod
+    def _stack(texts, n_features):
+        """
+        Builds a sparse batch as flat (indices, values, rows) arrays, one element per non-zero feature.
+        """
+        features = [hashed_features(text, n_features) for text in texts]
+        lengths = np.array([len(indices) for indices, _ in features], dtype=np.int64)
+        indices = np.concatenate([indices for indices, _ in features]) if features else np.zeros(0, dtype=np.int64)
+        values = np.concatenate([values for _, values in features]) if features else np.zeros(0, dtype=np.float32)
+        rows = np.repeat(np.arange(len(texts)), lengths)
+        return indices, values, rows
+
+    @staticmethod
+    def _logits(weights, bias, indices, values, rows, n_rows):
+        logits = np.tile(bias, (n_rows, 1))
+        contributions = weights[indices] * values[:, None]
+        for label in range(weights.shape[1]):
+            # bincount is a much faster scatter-add than np.add.at
+            logits[:, label] += np.bincount(rows, weights=contributions[:, label], minlength=n_rows)
+        return logits
+
+    @staticmethod
+    def _softmax(logits):
+        logits = logits - logits.max(axis=1, keepdims=True)
+        exp = np.exp(logits)
+        return exp / exp.sum(axis=1, keepdims=True)
+
+    def predict_proba(self, texts):
+        indices, values, rows = self._stack(texts, self.n_features)
+        return self._softmax(self._logits(self.weights, self.bias, indices, values, rows, len(texts)))
+
+    def predict(self, texts):
+        """
+        Returns [(label, confidence)] for texts.
+        """
+        probabilities = self.predict_proba(texts)
+        best = probabilities.argmax(axis=1)
+        return [(SENTIMENT_LABELS[i], float(probabilities[row, i])) for row, i in enumerate(best)]
+
+    @classmethod
+    def train(cls, texts, labels, n_features=2 ** 16, epochs=150, learning_rate=2.0, l2=1e-5):
+        """
+        Fits the model with full-batch gradient descent (with momentum).
+        """
+        y = np.array([SENTIMENT_LABELS.index(label) for label in labels])
+        targets = np.eye(len(SENTIMENT_LABELS), dtype=np.float32)[y]
+        indices, values, rows = cls._stack(texts, n_features)
+        weights = np.zeros((n_features, len(SENTIMENT_LABELS)), dtype=np.float32)
+        # Start from the class priors so rare labels are not over-predicted early on
+        priors = np.bincount(y, minlength=len(SENTIMENT_LABELS)) + 1.0
+        bias = np.log(priors / priors.sum()).astype(np.float32)
+        velocity_w = np.zeros_like(weights)
+        velocity_b = np.zeros_like(bias)
+        n = len(texts)
+
+        for _ in range(epochs):
+            errors = cls._softmax(cls._logits(weights, bias, indices, values, rows, n)) - targets
+            gradient_w = np.empty_like(weights)
+            for label in range(len(SENTIMENT_LABELS)):
+                gradient_w[:, label] = np.bincount(indices, weights=errors[rows, label] * values, minlength=n_features)
+            gradient_w = gradient_w / n + l2 * weights
+            gradient_b = errors.mean(axis=0)
+            velocity_w = 0.9 * velocity_w - learning_rate * gradient_w
+            velocity_b = 0.9 * velocity_b - learning_rate * gradient_b
+            weights += velocity_w
+            bias += velocity_b
+        return cls(weights, bias, n_features)
+
+    def to_bytes(self):
+        buffer = io.BytesIO()
+        np.savez_compressed(buffer, weights=self.weights, bias=self.bias)
+        return buffer.getvalue()
+
+    @classmethod
+    def from_bytes(cls, data):
+        arrays = np.load(io.BytesIO(data))
+        return cls(arrays["weights"], arrays["bias"], arrays["weights"].shape[0])
+
+
+def load_training_data(db, limit=50000):
+    """
+    Returns (texts, labels) from entries Gemini labelled, newest first.
+    Entries labelled by the local tier are left out so the model never trains on itself.
+    """
+    cursor = db.journal_entries.find(
+        {"sentiment": {"$in": SENTIMENT_LABELS}, "sentiment_tier": {"$ne": TIER_LOCAL}},
+        {"text": 1, "sentiment": 1, "_id": 0}
+    ).sort("timestamp", -1).limit(limit)
+    texts, labels = [], []
+    for entry in cursor:
+        texts.append(entry["text"])
+        labels.append(entry["sentiment"])
+    return texts, labels
+
+
+def save_model(db, model, n_samples, metrics=None):
+    db.sentiment_models.update_one(
+        {"_id": "current"},
+        {"$set": {
+            "weights": Binary(model.to_bytes()),
+            "n_samples": n_samples,
+            "metrics": metrics or {},
+            "trained_at": datetime.utcnow()
+        }},
+        upsert=True
+    )
+
+
+class LocalSentimentClassifier:
+    """
+    Uses the trained model when one exists, the lexicon otherwise, and
+    reloads the model periodically so retraining reaches running workers.
+    """
+
+    def __init__(self, db, reload_seconds=600):
+        self.db = db
+        self.reload_seconds = reload_seconds
+        self.model = None
+        self._trained_at = None
+        self._checked_at = -math.inf
+        self._lock = threading.Lock()
+
+    def _maybe_reload(self):
+        if self.db is None or time.monotonic() - self._checked_at < self.reload_seconds:
+            return
+        with self._lock:
+            if time.monotonic() - self._checked_at < self.reload_seconds:
+                return
+            self._checked_at = time.monotonic()
+            try:
+                meta = self.db.sentiment_models.find_one({"_id": "current"}, {"trained_at": 1})
+                if meta and meta["trained_at"] != self._trained_at:
+                    doc = self.db.sentiment_models.find_one({"_id": "current"})
+                    self.model = LinearSentimentModel.from_bytes(doc["weights"])
+                    self._trained_at = doc["trained_at"]
+                    print(f"Loaded local sentiment model trained at {self._trained_at}")
+            except Exception as e:
+                print(f"Could not load local sentiment model: {e}")
+
+    def predict(self, texts):
+        """
+        Returns [(label, confidence)] for texts.
+        """
+        self._maybe_reload()
+        if self.model is not None:
+            return self.model.predict(texts)
+        return [lexicon_sentiment(text) for text in texts]
+
+
+_classifier = None
+
+
+def get_local_classifier(db, reload_seconds=600):
+    """
+    Returns the process-wide local classifier.
+    """
+    global _classifier
+    if _classifier is None or _classifier.db is not db:
+        _classifier = LocalSentimentClassifier(db, reload_seconds)
+    return _classifier
+
+
+def classify_tiered(db, texts, threshold, escalate=classify_sentiments_batch):
+    """
+    Classifies texts locally and escalates those below `threshold` confidence
+    to Gemini in one batch (all of them if threshold is None).
+    Returns [(label, tier)]. Raises GeminiError if the escalation call fails.
+    """
+    results = [None] * len(texts)
+    if threshold is not None:
+        for i, (label, confidence) in enumerate(get_local_classifier(db).predict(texts)):
+            if confidence >= threshold:
+                results[i] = (label, TIER_LOCAL)
+
+    pending = [i for i, result in enumerate(results) if result is None]
+    if pending:
+        labels = escalate([texts[i] for i in pending])
+        for i, label in zip(pending, labels):
+            results[i] = (label, TIER_LLM)
+    return results
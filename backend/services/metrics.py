@@ -0,0 +1,206 @@
+"""
+Prometheus metrics, served in text format at /metrics.
+
+- http_request_duration_seconds: per route template and status (its _count is the request count)
+- mongodb_command_duration_seconds: per collection and command, from a pymongo CommandListener
+- gemini_request_duration_seconds / gemini_errors_total / gemini_tokens_total: per Gemini HTTP call
+- gemini_breaker_transitions_total / gemini_hedges_total: circuit breaker state changes and hedged calls
+- llm_admission_wait_seconds: time calls spent waiting for the LLM scheduler, per priority and outcome
+
+With several worker processes (gunicorn, uvicorn --workers) set
+PROMETHEUS_MULTIPROC_DIR to an empty directory before they start
+(gunicorn.conf.py does this): every process then writes its samples there
+and /metrics reports the totals across all workers.
+"""
+import os
+import time
+
+from flask import Request
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Histogram, generate_latest
+from prometheus_client import multiprocess
+from pymongo import monitoring
+
+GEMINI_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.0, 4.0, 8.0, 15.0, 30.0)
+MONGO_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+# Status is a label here rather than on a separate counter: one write per request instead of two
+REQUEST_LATENCY = Histogram('http_request_duration_seconds', "Time until the response is returned "
+                            "(the first byte for streamed responses)", ['method', 'route', 'status'])
+
+MONGO_LATENCY = Histogram('mongodb_command_duration_seconds', "MongoDB command round trips",
+                          ['collection', 'command'], buckets=MONGO_BUCKETS)
+MONGO_FAILURES = Counter('mongodb_command_failures', "MongoDB commands that failed", ['collection', 'command'])
+
+GEMINI_LATENCY = Histogram('gemini_request_duration_seconds', "Gemini HTTP attempts, until the response "
+                           "headers arrive", ['method', 'outcome'], buckets=GEMINI_BUCKETS)
+GEMINI_ERRORS = Counter('gemini_errors', "Failed Gemini HTTP attempts by error class", ['method', 'error'])
+GEMINI_TOKENS = Counter('gemini_tokens', "Tokens reported in Gemini usageMetadata", ['kind'])
+GEMINI_BREAKER_TRANSITIONS = Counter('gemini_breaker_transitions', "Circuit breaker state changes, by new state",
+                                     ['state'])
+GEMINI_HEDGES = Counter('gemini_hedges', "Calls that sent a hedge request, by which request answered first "
+                        "(primary, hedge or none; skipped when the LLM scheduler had no room for the hedge)", ['winner'])
+
+LLM_ADMISSION_WAIT = Histogram('llm_admission_wait_seconds', "Time Gemini calls waited for the LLM scheduler "
+                               "(outcome admitted or refused)", ['priority', 'outcome'], buckets=GEMINI_BUCKETS)
+
+# Route used for requests that matched no route, so 404 scans cannot blow up label cardinality
+UNMATCHED_ROUTE = "<unmatched>"
+ROUTE_ENVIRON_KEY = 'mindease.route'
+
+# Labelled children are looked up once per label set; labels() itself costs more than an observation
+_request_children = {}
+_mongo_children = {}
+
+
+def observe_request(method, route, status, seconds):
+    """
+    Records one served request. route is the route template, not the concrete path.
+    """
+    key = (method, route, status)
+    child = _request_children.get(key)
+    if child is None:
+        child = _request_children[key] = REQUEST_LATENCY.labels(method, route, str(status))
+    child.observe(seconds)
+
+
+class RouteRecordingRequest(Request):
+    """
+    Flask request that copies its matched route template into the environ when
+    Flask sets url_rule, because Flask drops the request object itself from the
+    environ before RequestMetricsMiddleware gets it back.
+    """
+    _url_rule = None
+
+    @property
+    def url_rule(self):
+        return self._url_rule
+
+    @url_rule.setter
+    def url_rule(self, rule):
+        self._url_rule = rule
+        if rule is not None:
+            self.environ[ROUTE_ENVIRON_KEY] = rule.rule
+
+
+class RequestMetricsMiddleware:
+    """
+    WSGI middleware that times every request the wrapped Flask app serves.
+
+    Timing and the status live out here, where they cost a third of what a
+    before/after_request pair going through the g and request proxies does;
+    the route comes from RouteRecordingRequest.
+    """
+
+    def __init__(self, wsgi_app):
+        self.wsgi_app = wsgi_app
+
+    def __call__(self, environ, start_response):
+        started = time.perf_counter()
+        status = 500
+
+        def record_status(status_line, headers, exc_info=None):
+            nonlocal status
+            status = int(status_line[:3])
+            return start_response(status_line, headers, exc_info)
+
+        try:
+            return self.wsgi_app(environ, record_status)
+        finally:
+            observe_request(environ['REQUEST_METHOD'], environ.get(ROUTE_ENVIRON_KEY, UNMATCHED_ROUTE),
+                            status, time.perf_counter() - started)
+
+
+def init_app(app):
+    """
+    Times every request the Flask app serves.
+    """
+    app.request_class = RouteRecordingRequest
+    app.wsgi_app = RequestMetricsMiddleware(app.wsgi_app)
+
+
+def observe_gemini(method, started, error=None):
+    """
+    Records one Gemini HTTP attempt that began at time.monotonic() == started.
+    error is the exception class name or "http_<status>" for a failed attempt.
+    """
+    GEMINI_LATENCY.labels(method, error or "ok").observe(time.monotonic() - started)
+    if error:
+        GEMINI_ERRORS.labels(method, error).inc()
+
+
+def observe_breaker_transition(state):
+    GEMINI_BREAKER_TRANSITIONS.labels(state).inc()
+
+
+def observe_gemini_hedge(winner):
+    GEMINI_HEDGES.labels(winner).inc()
+
+
+def observe_llm_admission(priority, outcome, seconds):
+    """
+    Records one LLM scheduler decision and how long the caller waited for it.
+    """
+    LLM_ADMISSION_WAIT.labels(priority, outcome).observe(seconds)
+
+
+def record_gemini_usage(response):
+    """
+    Adds the token counts from a Gemini response (or stream event) to the counters.
+    """
+    usage = (response or {}).get('usageMetadata')
+    if not usage:
+        return
+    prompt = usage.get('promptTokenCount', 0)
+    output = usage.get('candidatesTokenCount', 0)
+    if prompt:
+        GEMINI_TOKENS.labels('prompt').inc(prompt)
+    if output:
+        GEMINI_TOKENS.labels('output').inc(output)
+
+
+class MongoCommandMetrics(monitoring.CommandListener):
+    """
+    Times MongoDB commands per collection and command name.
+    Pass an instance in MongoClient(event_listeners=[...]).
+    """
+
+    def __init__(self):
+        # (connection, request id) -> children for the command in flight; the
+        # finished events carry the duration but not the collection
+        self._pending = {}
+
+    def started(self, event):
+        command_name = event.command_name
+        target = event.command.get(command_name)
+        if command_name == 'getMore':
+            target = event.command.get('collection')
+        collection = target if isinstance(target, str) else "-"
+        key = (collection, command_name)
+        children = _mongo_children.get(key)
+        if children is None:
+            children = _mongo_children[key] = (MONGO_LATENCY.labels(collection, command_name),
+                                               MONGO_FAILURES.labels(collection, command_name))
+        self._pending[(event.connection_id, event.request_id)] = children
+
+    def succeeded(self, event):
+        children = self._pending.pop((event.connection_id, event.request_id), None)
+        if children is not None:
+            children[0].observe(event.duration_micros / 1e6)
+
+    def failed(self, event):
+        children = self._pending.pop((event.connection_id, event.request_id), None)
+        if children is not None:
+            children[0].observe(event.duration_micros / 1e6)
+            children[1].inc()
+
+
+def render():
+    """
+    Returns (body, content type) for the /metrics endpoint.
+    """
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
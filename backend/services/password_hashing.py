@@ -0,0 +1,155 @@
+"""
+Password hashing and verification on a small per-process worker pool.
+
+Werkzeug's hashes (scrypt by default) are deliberately CPU-heavy. Running them
+inline lets a burst of logins occupy every request thread and CPU core and
+starve the journal routes. Here they run in at most PASSWORD_HASH_WORKERS
+child processes. At most PASSWORD_HASH_MAX_PENDING calls may be running or
+queued at once; beyond that, and when a call waits longer than
+PASSWORD_HASH_TIMEOUT, PasswordHashingBusy is raised (the auth routes answer
+503 with Retry-After).
+
+As with the MongoDB client, the pool is created on first use in each process,
+so gunicorn workers each get their own after the fork. A pool broken by a
+dead child (e.g. OOM-killed) answers that call with PasswordHashingBusy and is
+replaced on the next one.
+"""
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+DEFAULT_SETTINGS = {
+    'PASSWORD_HASH_METHOD': "scrypt:32768:8:1",
+    'PASSWORD_SALT_LENGTH': 16,
+    'PASSWORD_HASH_WORKERS': 1,
+    'PASSWORD_HASH_MAX_PENDING': 8,
+    'PASSWORD_HASH_TIMEOUT': 5.0,
+}
+
+
+class PasswordHashingBusy(Exception):
+    """Too many password hashes are queued; the caller should retry later."""
+
+
+_settings = DEFAULT_SETTINGS
+_executor = None
+_pid = None
+_in_flight = 0
+_lock = threading.Lock()
+
+
+def configure_password_hashing(config):
+    """
+    Records the PASSWORD_* settings (a Flask config mapping); the pool starts on first use.
+    """
+    global _settings, _executor, _pid
+    _settings = {key: config.get(key, default) for key, default in DEFAULT_SETTINGS.items()}
+    with _lock:
+        # Only this process's own pool; one inherited over a fork belongs to the parent
+        if _executor is not None and _pid == os.getpid():
+            _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+        _pid = None  # Force a fresh pool with the new settings
+
+
+def _method_of(password_hash):
+    return password_hash.split('$', 1)[0]
+
+
+def _verify_and_upgrade(password_hash, password, method, salt_length):
+    """
+    Runs in the pool. Returns (matches, new hash or None); the new hash is set
+    when the password matches but was stored with other parameters than method.
+    """
+    if not check_password_hash(password_hash, password):
+        return False, None
+    if _method_of(password_hash) == method:
+        return True, None
+    new_hash = generate_password_hash(password, method, salt_length)
+    # A short method name ("scrypt") expands to the same parameters it was stored with
+    if _method_of(new_hash) == _method_of(password_hash):
+        return True, None
+    return True, new_hash
+
+
+def _get_executor():
+    global _executor, _pid
+    if _pid != os.getpid():
+        # Either the first call, or we are a forked child holding the parent's pool
+        with _lock:
+            if _pid != os.getpid():
+                # spawn, not fork: request threads may hold locks a forked child would inherit
+                _executor = ProcessPoolExecutor(max_workers=_settings['PASSWORD_HASH_WORKERS'],
+                                                mp_context=multiprocessing.get_context('spawn'))
+                _pid = os.getpid()
+    return _executor
+
+
+def _discard_executor(executor):
+    """
+    Drops a broken pool (e.g. a hashing process was OOM-killed) so the next call builds a new one.
+    """
+    global _executor, _pid
+    with _lock:
+        if _executor is executor:
+            _executor, _pid = None, None
+    executor.shutdown(wait=False, cancel_futures=True)
+
+
+def _release(future):
+    global _in_flight
+    with _lock:
+        _in_flight -= 1
+
+
+def _run(fn, *args):
+    """
+    Runs fn(*args) in the pool, or inline when PASSWORD_HASH_WORKERS is 0.
+    """
+    global _in_flight
+    if _settings['PASSWORD_HASH_WORKERS'] <= 0:
+        return fn(*args)
+    executor = _get_executor()
+    with _lock:
+        if _in_flight >= _settings['PASSWORD_HASH_MAX_PENDING']:
+            raise PasswordHashingBusy("Too many password checks in progress")
+        _in_flight += 1
+    try:
+        future = executor.submit(fn, *args)
+    except BrokenProcessPool:
+        with _lock:
+            _in_flight -= 1
+        _discard_executor(executor)
+        raise PasswordHashingBusy("Password hashing pool restarting") from None
+    future.add_done_callback(_release)
+    try:
+        return future.result(timeout=_settings['PASSWORD_HASH_TIMEOUT'])
+    except BrokenProcessPool:
+        _discard_executor(executor)
+        raise PasswordHashingBusy("Password hashing pool restarting") from None
+    except FutureTimeoutError:
+        # Still counts against the limit until it finishes; nobody is waiting for it any more
+        future.cancel()
+        raise PasswordHashingBusy("Timed out waiting for a password check") from None
+
+
+def hash_password(password):
+    """
+    Returns a new hash of password with the configured method.
+    """
+    return _run(generate_password_hash, password, _settings['PASSWORD_HASH_METHOD'],
+                _settings['PASSWORD_SALT_LENGTH'])
+
+
+def verify_password(password_hash, password):
+    """
+    Returns (matches, new hash or None). A new hash is returned when the
+    password matches a hash made with other parameters than the configured
+    ones; store it in place of the old one.
+    """
+    return _run(_verify_and_upgrade, password_hash, password, _settings['PASSWORD_HASH_METHOD'],
+                _settings['PASSWORD_SALT_LENGTH'])
@@ -0,0 +1,209 @@
+"""
+Map-reduce narrative summaries over a date range.
+
+Short ranges are summarized with a single prompt, as before. Longer ranges are
+split into calendar buckets (ISO weeks, or months/quarters/years when the
+range would need more than `max_buckets` weeks; ranges longer than
+max_buckets years get adjacent years merged). Each bucket is summarized on
+its own and the bucket summaries are then reduced into the final narrative,
+so a request costs at most max_buckets + 1 LLM calls whatever its length.
+
+Bucket summaries are stored in period_bucket_summaries, keyed by a hash of the
+bucket and the ids and text of its entries, so overlapping or repeated ranges
+only pay for buckets whose entries changed.
+"""
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from services.ai_services import get_gemini_client
+from services.llm_scheduler import current_llm_request, llm_request
+
+# Bucket summaries nobody has asked for in this long are dropped
+BUCKET_SUMMARY_TTL_SECONDS = 90 * 86400
+
+# Shortest excerpt of an entry worth putting in a bucket prompt; buckets with
+# more entries than bucket_chars allows at this length are sampled
+MIN_ENTRY_CHARS = 200
+
+
+def _week(day):
+    monday = day - timedelta(days=day.weekday())
+    return ("week", monday.strftime("%Y-%m-%d")), f"Week of {monday.strftime('%Y-%m-%d')}"
+
+
+def _month(day):
+    return ("month", day.strftime("%Y-%m")), day.strftime("%B %Y")
+
+
+def _quarter(day):
+    quarter = (day.month - 1) // 3 + 1
+    return ("quarter", f"{day.year}-Q{quarter}"), f"Q{quarter} {day.year}"
+
+
+def _year(day):
+    return ("year", str(day.year)), str(day.year)
+
+
+# Finest first; the first one that covers the range in <= max_buckets buckets wins
+GRANULARITIES = [_week, _month, _quarter, _year]
+
+
+def choose_bucketing(start_date, end_date, max_buckets):
+    """
+    Returns the finest bucket function that splits [start_date, end_date] into at most max_buckets buckets.
+    """
+    for bucket_of in GRANULARITIES:
+        buckets = set()
+        day = start_date
+        while day <= end_date and len(buckets) <= max_buckets:
+            buckets.add(bucket_of(day)[0])
+            day += timedelta(days=1)
+        if len(buckets) <= max_buckets:
+            return bucket_of
+    return GRANULARITIES[-1]
+
+
+def merge_buckets(buckets, max_buckets):
+    """
+    Merges runs of adjacent buckets until there are at most max_buckets.
+    buckets is [(bucket_id, (label, entries))] in chronological order.
+    """
+    if len(buckets) <= max_buckets:
+        return buckets
+    size = -(-len(buckets) // max_buckets)
+    merged = []
+    for i in range(0, len(buckets), size):
+        run = buckets[i:i + size]
+        (first_id, (first_label, _)), (last_id, (last_label, _)) = run[0], run[-1]
+        label = first_label if len(run) == 1 else f"{first_label} to {last_label}"
+        merged.append(((first_id, last_id), (label, [entry for _, (_, entries) in run for entry in entries])))
+    return merged
+
+
+def sample_entries(entries, count):
+    """
+    Picks count entries spread evenly over the list, keeping their order.
+    """
+    if len(entries) <= count:
+        return entries
+    return [entries[i * len(entries) // count] for i in range(count)]
+
+
+def format_entry(entry, max_chars=None):
+    text = entry['text'] if max_chars is None else entry['text'][:max_chars]
+    return f"Date: {entry['timestamp'].strftime('%Y-%m-%d %H:%M:%S')}\nEntry: {text}\n\n"
+
+
+def direct_prompt(entries):
+    """
+    The original single-prompt summary, used when the range is small enough.
+    """
+    all_entries_text = "".join(format_entry(entry) for entry in entries)
+    return f"""Summarize the following journal entries from a user over a specific period. Focus on identifying key themes, recurring emotions, significant events, and overall well-being trends. Provide a compassionate and insightful narrative summary, highlighting any notable changes or patterns. Keep the summary concise, under 250 words.
+
+        Journal Entries for the period:
+        {all_entries_text}
+
+        Period Summary:"""
+
+
+def _bucket_digest(bucket_id, entries):
+    digest = hashlib.sha256(repr(bucket_id).encode('utf-8'))
+    for entry in entries:
+        digest.update(str(entry['_id']).encode('utf-8'))
+        digest.update(hashlib.sha1(entry['text'].encode('utf-8')).digest())
+    return digest.hexdigest()
+
+
+class PeriodSummarizer:
+    """
+    Builds the final LLM prompt for a period, summarizing buckets as needed.
+    """
+
+    def __init__(self, db, direct_chars=8000, max_buckets=12, bucket_chars=12000, concurrency=4):
+        self.db = db
+        self.direct_chars = direct_chars
+        self.max_buckets = max_buckets
+        self.bucket_chars = bucket_chars
+        self.concurrency = concurrency
+
+    def fetch_entries(self, username, start_date, end_date):
+        return list(self.db.journal_entries.find(
+            {"username": username, "timestamp": {"$gte": start_date, "$lte": end_date}},
+            {"text": 1, "timestamp": 1}
+        ).sort("timestamp", 1)) # Sort by date ascending for chronological summary
+
+    def _summarize_bucket(self, label, entries):
+        # Keep every bucket prompt bounded, however many entries it holds
+        entries = sample_entries(entries, max(1, self.bucket_chars // MIN_ENTRY_CHARS))
+        per_entry = self.bucket_chars // len(entries)
+        entries_text = "".join(format_entry(entry, per_entry) for entry in entries)
+        prompt = f"""Summarize the following journal entries a user wrote during {label}. Note the main events, recurring emotions and overall mood. Keep it under 120 words.
+
+        Journal Entries:
+        {entries_text}
+
+        Summary:"""
+        summary = get_gemini_client().generate_text(prompt, temperature=0.3, max_output_tokens=200)
+        return summary.strip() if summary else ""
+
+    def _bucket_summaries(self, buckets):
+        """
+        Returns [(label, summary)] for the buckets, in order, reusing stored summaries.
+        """
+        keys = [_bucket_digest(bucket_id, entries) for bucket_id, (label, entries) in buckets]
+        stored = {doc["_id"]: doc["summary"] for doc in self.db.period_bucket_summaries.find({"_id": {"$in": keys}})}
+
+        missing = [(key, label, entries) for key, (_, (label, entries)) in zip(keys, buckets) if key not in stored]
+        if missing:
+            # Pool threads do not inherit the caller's context; pass on who the calls are for
+            request = current_llm_request()
+
+            def summarize(item):
+                key, label, entries = item
+                with llm_request(*request):
+                    summary = self._summarize_bucket(label, entries)
+                # Stored right away, so a later bucket failing does not waste the calls that succeeded
+                if summary:
+                    self.db.period_bucket_summaries.update_one(
+                        {"_id": key},
+                        {"$set": {"summary": summary, "label": label, "created_at": datetime.utcnow()}},
+                        upsert=True
+                    )
+                return summary
+            with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+                summaries = list(executor.map(summarize, missing))
+            for (key, _, _), summary in zip(missing, summaries):
+                stored[key] = summary
+
+        if stored:
+            # Refresh last use so bucket summaries that keep being reused do not expire
+            self.db.period_bucket_summaries.update_many({"_id": {"$in": keys}}, {"$set": {"created_at": datetime.utcnow()}})
+        return [(label, stored[key]) for key, (_, (label, _)) in zip(keys, buckets) if stored[key]]
+
+    def build_prompt(self, username, start_date, end_date):
+        """
+        Returns (llm_prompt, entry_count); llm_prompt is None if there are no entries.
+        """
+        entries = self.fetch_entries(username, start_date, end_date)
+        if not entries:
+            return None, 0
+        if sum(len(entry['text']) for entry in entries) <= self.direct_chars:
+            return direct_prompt(entries), len(entries)
+
+        bucket_of = choose_bucketing(start_date, end_date, self.max_buckets)
+        buckets = {}
+        for entry in entries:
+            bucket_id, label = bucket_of(entry['timestamp'])
+            buckets.setdefault(bucket_id, (label, []))[1].append(entry)
+
+        summaries = self._bucket_summaries(merge_buckets(list(buckets.items()), self.max_buckets))
+        summaries_text = "".join(f"{label}:\n{summary}\n\n" for label, summary in summaries)
+        llm_prompt = f"""The following are summaries of a user's journal entries over consecutive parts of a period, in chronological order. Combine them into one narrative summary of the whole period. Focus on identifying key themes, recurring emotions, significant events, and overall well-being trends. Provide a compassionate and insightful narrative summary, highlighting any notable changes or patterns. Keep the summary concise, under 250 words.
+
+        Summaries:
+        {summaries_text}
+
+        Period Summary:"""
+        return llm_prompt, len(entries)
@@ -0,0 +1,281 @@
+"""
+Journaling prompts generated ahead of time, so "suggest a prompt" does not wait on Gemini.
+
+Each user has one prompt_pool document holding up to PROMPT_POOL_SIZE
+prompts, newest first, plus the fields of a small durable job queue:
+
+    {_id: username, prompts: [{text, created_at}], refill_at, lease_expires_at,
+     attempts, refreshed_at, last_active_at}
+
+POST /journal/generate_prompt/<username> takes the newest prompt if it is
+younger than PROMPT_POOL_MAX_AGE and falls back to generating one on demand
+otherwise. Taking a prompt and writing an entry both set refill_at; the
+prompt workers claim due documents (leased like the sentiment queue), build
+the prompt from the user's latest and related entries, and push fresh
+prompts to the front of the pool. A periodic sweep also schedules users who
+were active within PROMPT_POOL_IDLE_DAYS but whose pool is getting old, so
+their next click is fast too.
+
+Pools only exist for registered users, and each refill takes one request
+from the user's LLM quota (charge_user); a refill for a user whose bucket is
+empty is skipped until their next request, so taking prompts faster than the
+quota allows does not buy extra generations.
+"""
+import random
+import threading
+import time
+from datetime import datetime, timedelta
+
+from bson.objectid import ObjectId
+from pymongo import ReturnDocument
+
+from services.ai_services import GeminiQuotaExceeded, get_gemini_client
+from services.db_services import ENTRY_LIST_PROJECTION, entry_to_json
+from services.embeddings import related_to_text
+from services.llm_scheduler import PRIORITY_BACKGROUND, llm_request
+
+PROMPT_TEMPERATURE = 0.8
+PROMPT_MAX_OUTPUT_TOKENS = 100
+
+# Set by schedule_refill so in-process workers start on it without waiting for the next poll
+_wakeup = threading.Event()
+
+
+def context_lines(entries, chars):
+    """
+    Formats entries as "- (date) text" lines for an LLM prompt, clipping each text to chars.
+    """
+    def clip(text):
+        return text if len(text) <= chars else text[:chars].rstrip() + "…"
+    return "\n".join(f"- ({entry['date']}) {clip(entry['text'])}" for entry in entries)
+
+
+def prompt_context_text(db, username, related_limit, chars):
+    """
+    The latest entry plus the past entries most similar to it, topped up with
+    the most recent ones when too few are similar.
+    """
+    recent = [entry_to_json(entry) for entry in
+              db.journal_entries.find({"username": username}, ENTRY_LIST_PROJECTION)
+              .sort("timestamp", -1).limit(related_limit + 1)]
+    if not recent:
+        return ""
+    latest = recent[0]
+    context = [latest] + related_to_text(db, username, latest["text"], related_limit, ObjectId(latest["id"]))
+    seen = {entry["id"] for entry in context}
+    context += [entry for entry in recent[1:] if entry["id"] not in seen][:related_limit + 1 - len(context)]
+    return context_lines(context, chars)
+
+
+def journal_prompt_request(context_text):
+    """
+    Returns the LLM prompt asking for a journaling prompt, given prompt_context_text().
+    """
+    if not context_text:
+        # If no recent entries, provide a general prompt
+        prompt_context = "The user has no recent journal entries."
+    else:
+        prompt_context = f"The user's latest journal entry (first) and related past entries include:\n{context_text}"
+
+    return f"""Based on the following context about the user's recent journal entries, suggest a single, concise, and encouraging journaling prompt. The prompt should help the user reflect further on their well-being, emotions, or experiences. Keep it to one sentence.
+
+        Context:
+        {prompt_context}
+
+        Journaling Prompt:"""
+
+
+def schedule_refill(db, username):
+    """
+    Asks the prompt workers to add a fresh prompt to the user's pool, and marks the user active.
+    A pool is only created for a username that is registered.
+    """
+    now = datetime.utcnow()
+    update = {"$set": {"refill_at": now, "last_active_at": now}}
+    if not db.prompt_pool.update_one({"_id": username}, update).matched_count:
+        if db.users.find_one({"username": username}, {"_id": 1}) is None:
+            return
+        db.prompt_pool.update_one(
+            {"_id": username},
+            {**update, "$setOnInsert": {"prompts": [], "attempts": 0, "lease_expires_at": None, "refreshed_at": None}},
+            upsert=True
+        )
+    _wakeup.set()
+
+
+def take_prompt(db, username, max_age):
+    """
+    Removes and returns the user's newest pooled prompt, or None if the pool
+    has nothing younger than max_age seconds. Either way a refill is scheduled.
+    """
+    cutoff = datetime.utcnow() - timedelta(seconds=max_age)
+    # The newest prompt is first, so if it is too old, all of them are
+    before = db.prompt_pool.find_one_and_update(
+        {"_id": username, "prompts.0.created_at": {"$gte": cutoff}},
+        {"$pop": {"prompts": -1}},
+        projection={"prompts": {"$slice": 1}},
+        return_document=ReturnDocument.BEFORE
+    )
+    schedule_refill(db, username)
+    return before["prompts"][0]["text"] if before else None
+
+
+def claim_refill(db, lease_seconds):
+    """
+    Atomically leases one user whose pool is due for a refill.
+    """
+    now = datetime.utcnow()
+    return db.prompt_pool.find_one_and_update(
+        {"refill_at": {"$lte": now}, "$or": [{"lease_expires_at": None}, {"lease_expires_at": {"$lt": now}}]},
+        {"$set": {"lease_expires_at": now + timedelta(seconds=lease_seconds)}, "$inc": {"attempts": 1}},
+        projection={"prompts": 1, "refill_at": 1, "attempts": 1},
+        sort=[("refill_at", 1)],
+        return_document=ReturnDocument.AFTER
+    )
+
+
+def refill(db, job, pool_size, max_age, related_limit, context_chars, max_attempts=5):
+    """
+    Generates prompts for a leased pool document until it holds pool_size
+    fresh ones (at least one, so new entries are reflected). Returns the number added.
+    """
+    username = job["_id"]
+    now = datetime.utcnow()
+    cutoff = now - timedelta(seconds=max_age)
+    fresh = sum(1 for prompt in job.get("prompts", []) if prompt["created_at"] >= cutoff)
+    wanted = max(1, pool_size - fresh)
+
+    prompts = []
+    try:
+        # One request from the user's quota per refill, however many prompts it makes
+        get_gemini_client().charge_user(username)
+    except GeminiQuotaExceeded as e:
+        print(f"Prompt worker: skipping refill for {username}: {e}")
+        # Not a failure: give the attempt back and wait for the user's next request
+        db.prompt_pool.update_one({"_id": username}, {"$set": {"lease_expires_at": None}, "$inc": {"attempts": -1}})
+        db.prompt_pool.update_one({"_id": username, "refill_at": job["refill_at"]}, {"$set": {"refill_at": None}})
+        return 0
+    try:
+        llm_prompt = journal_prompt_request(prompt_context_text(db, username, related_limit, context_chars))
+        with llm_request(username, PRIORITY_BACKGROUND, quota=False):
+            for _ in range(wanted):
+                text = get_gemini_client().generate_text(prompt=llm_prompt, temperature=PROMPT_TEMPERATURE,
+                                                         max_output_tokens=PROMPT_MAX_OUTPUT_TOKENS, use_cache=False)
+                if text:
+                    prompts.append({"text": text.strip(), "created_at": datetime.utcnow()})
+    except Exception as e:
+        # Any failure (Gemini or the context queries) backs off and counts against max_attempts
+        print(f"Prompt worker: refill for {username} failed: {e}")
+        if not prompts:
+            db.prompt_pool.update_one({"_id": username}, {"$set": {"lease_expires_at": None}})
+            # Exponential backoff with jitter; after max_attempts wait for the next request or sweep
+            retry_at = None
+            if job["attempts"] < max_attempts:
+                retry_at = now + timedelta(seconds=min(300, 2 ** job["attempts"]) * random.uniform(0.5, 1.0))
+            db.prompt_pool.update_one({"_id": username, "refill_at": job["refill_at"]}, {"$set": {"refill_at": retry_at}})
+            return 0
+
+    db.prompt_pool.update_one({"_id": username}, {"$pull": {"prompts": {"created_at": {"$lt": cutoff}}}})
+    db.prompt_pool.update_one({"_id": username}, {
+        "$push": {"prompts": {"$each": prompts[::-1], "$position": 0, "$slice": pool_size}},
+        "$set": {"lease_expires_at": None, "attempts": 0, "refreshed_at": now}
+    })
+    # Keep a refill requested while this one ran (e.g. another new entry)
+    db.prompt_pool.update_one({"_id": username, "refill_at": job["refill_at"]}, {"$set": {"refill_at": None}})
+    return len(prompts)
+
+
+def schedule_idle_refills(db, refresh_after, idle_days):
+    """
+    Schedules refills for users active in the last idle_days whose pool was
+    last refreshed more than refresh_after seconds ago. Returns how many.
+    """
+    now = datetime.utcnow()
+    result = db.prompt_pool.update_many(
+        # $not also matches pools that were never refreshed (refreshed_at None), e.g. after a first refill gave up
+        {"refill_at": None, "refreshed_at": {"$not": {"$gte": now - timedelta(seconds=refresh_after)}},
+         "last_active_at": {"$gte": now - timedelta(days=idle_days)}},
+        {"$set": {"refill_at": now}}
+    )
+    if result.modified_count:
+        _wakeup.set()
+    return result.modified_count
+
+
+class PromptWorkerPool:
+    """
+    Daemon threads keeping the users' prompt pools filled.
+    """
+
+    def __init__(self, db, threads=1, pool_size=3, max_age=86400, idle_days=14, lease_seconds=60,
+                 poll_interval=5.0, sweep_interval=600, related_limit=3, context_chars=400):
+        self.db = db
+        self.threads = threads
+        self.pool_size = pool_size
+        self.max_age = max_age
+        self.idle_days = idle_days
+        self.lease_seconds = lease_seconds
+        self.poll_interval = poll_interval
+        self.sweep_interval = sweep_interval
+        self.related_limit = related_limit
+        self.context_chars = context_chars
+        self._next_sweep = 0.0
+        self._sweep_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._threads = []
+
+    def sweep_if_due(self):
+        with self._sweep_lock:
+            if time.monotonic() < self._next_sweep:
+                return
+            self._next_sweep = time.monotonic() + self.sweep_interval
+        # Refresh at half the maximum age, so an idle user's pool never runs out of fresh prompts
+        scheduled = schedule_idle_refills(self.db, self.max_age / 2, self.idle_days)
+        if scheduled:
+            print(f"Prompt worker: scheduled {scheduled} idle user(s) for a refill")
+
+    def run_once(self):
+        """
+        Refills one due pool. Returns True if there was one.
+        """
+        self.sweep_if_due()
+        job = claim_refill(self.db, self.lease_seconds)
+        if job is None:
+            return False
+        refill(self.db, job, self.pool_size, self.max_age, self.related_limit, self.context_chars)
+        return True
+
+    def _loop(self):
+        while not self._stop.is_set():
+            try:
+                claimed = self.run_once()
+            except Exception as e:
+                print(f"Prompt worker error: {e}")
+                claimed = False
+            if not claimed:
+                _wakeup.wait(self.poll_interval)
+                _wakeup.clear()
+
+    def start(self):
+        for i in range(self.threads):
+            thread = threading.Thread(target=self._loop, name=f"prompt-worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        print(f"Started {self.threads} prompt worker thread(s)")
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        _wakeup.set()
+        for thread in self._threads:
+            thread.join(timeout)
+
+    def run_forever(self):
+        """
+        Runs the pool in the foreground, e.g. from a dedicated worker process.
+        """
+        self.start()
+        try:
+            while any(thread.is_alive() for thread in self._threads):
+                time.sleep(1)
+        except KeyboardInterrupt:
+            self.stop(timeout=self.lease_seconds)
@@ -0,0 +1,150 @@
+"""
+Query-plan guardrail: records the distinct MongoDB queries the app sends and
+explains each one, flagging collection scans and in-memory sorts.
+
+    recorder = QueryRecorder()
+    pymongo.monitoring.register(recorder)   # before the MongoClient is created
+    ... serve some traffic ...
+    problems = check_query_plans(client, recorder.queries())
+
+benchmarks/load_test.py --check-plans does this over seeded data for every route.
+Explain runs with "queryPlanner" verbosity, so explained writes are never applied.
+"""
+import threading
+
+from pymongo import monitoring
+
+# Commands that go through the query planner, and the key holding their statements (if batched)
+EXPLAINABLE = {
+    "find": None,
+    "aggregate": None,
+    "count": None,
+    "distinct": None,
+    "findAndModify": None,
+    "update": "updates",
+    "delete": "deletes",
+}
+
+# Driver and session fields explain does not accept
+DRIVER_FIELDS = {"lsid", "$db", "$clusterTime", "txnNumber", "$readPreference", "readConcern", "writeConcern",
+                 "ordered", "bypassDocumentValidation", "autocommit", "startTransaction"}
+
+# Explain sections that describe plans that were not chosen, or echo the command back
+IGNORED_SECTIONS = {"rejectedPlans", "slotBasedPlan", "command", "originalCommand"}
+
+
+def query_shape(value):
+    """
+    Replaces the values in a command with their type names, so queries that
+    differ only in their arguments compare equal.
+    """
+    if isinstance(value, dict):
+        return tuple((key, query_shape(item)) for key, item in value.items())
+    if isinstance(value, (list, tuple)):
+        return tuple(sorted({query_shape(item) for item in value}, key=repr))
+    return type(value).__name__
+
+
+def split_statements(command_name, command):
+    """
+    Yields one explainable command per statement, without the driver's session fields.
+    """
+    command = {key: value for key, value in command.items() if key not in DRIVER_FIELDS}
+    statements_key = EXPLAINABLE[command_name]
+    if statements_key is None:
+        yield command
+        return
+    # explain takes a single update or delete statement
+    for statement in command.get(statements_key, []):
+        yield {**command, statements_key: [statement]}
+
+
+class QueryRecorder(monitoring.CommandListener):
+    """
+    Keeps the first example of every distinct query shape the app sends.
+    """
+
+    def __init__(self):
+        self._queries = {}
+        self._lock = threading.Lock()
+
+    def started(self, event):
+        if event.command_name not in EXPLAINABLE:
+            return
+        for command in split_statements(event.command_name, event.command):
+            shape = (event.database_name, query_shape(command))
+            if shape not in self._queries:
+                with self._lock:
+                    self._queries.setdefault(shape, (event.database_name, command))
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+    def queries(self):
+        """
+        Returns [(database name, command)], one per distinct shape.
+        """
+        with self._lock:
+            return list(self._queries.values())
+
+
+def plan_problems(explain):
+    """
+    Returns the sorted problem stages ("COLLSCAN", "SORT") in the winning plan of an explain result.
+    """
+    problems = set()
+
+    def walk(node):
+        if isinstance(node, dict):
+            for key, value in node.items():
+                if key in IGNORED_SECTIONS:
+                    continue
+                if key == "stage" and value in ("COLLSCAN", "SORT"):
+                    problems.add(value)
+                elif key == "$sort":
+                    # A pipeline $sort the query layer could not take over from an index
+                    problems.add("SORT")
+                walk(value)
+        elif isinstance(node, list):
+            for item in node:
+                walk(item)
+
+    walk(explain)
+    return sorted(problems)
+
+
+def describe(command):
+    """
+    Short label for a command in reports: its name, collection and filter.
+    """
+    name = next(iter(command))
+    detail = (command.get("filter") or command.get("query") or command.get("pipeline")
+              or (command.get("updates") or command.get("deletes") or [{}])[0].get("q"))
+    return f"{name} {command[name]} {detail}"
+
+
+def is_text_search(command):
+    """
+    True for a $text query, whose relevance order no index can provide.
+    """
+    return "'$text'" in repr(command)
+
+
+def check_query_plans(client, queries):
+    """
+    Explains each (database name, command) and returns [(description, problems)]
+    for the ones whose plan scans a collection or sorts in memory. Text
+    searches may sort in memory: they sort their (index-found) matches by score.
+    """
+    failures = []
+    for database_name, command in queries:
+        explain = client[database_name].command("explain", command, verbosity="queryPlanner")
+        problems = plan_problems(explain)
+        if is_text_search(command):
+            problems = [problem for problem in problems if problem != "SORT"]
+        if problems:
+            failures.append((describe(command), problems))
+    return failures
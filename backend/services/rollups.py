@@ -0,0 +1,306 @@
+"""
+Per-user, per-day sentiment counters.
+
+The sentiment_rollups collection holds one document per (username, day) with
+a counts sub-document ({"positive": 3, "pending": 1, ...}). Every path that
+writes a sentiment applies a matching $inc (and a $inc of -1 for the label it
+replaces), so the summary and trends endpoints read O(days) rollup documents
+instead of aggregating every entry. rebuild_rollups() reconciles the counters
+with journal_entries. Days are server-local, so trends in another time zone
+are counted from the entries (read_trends).
+
+Rollups are only read for users listed in rollup_state: users registered
+since rollups existed, and users `flask --app app rebuild-rollups` has
+counted. Older users are answered from their entries until that command
+has run; reads never rebuild anything.
+"""
+from collections import defaultdict
+from datetime import datetime, time, timedelta
+from zoneinfo import ZoneInfo
+
+from bson.objectid import ObjectId
+from pymongo import UpdateOne
+
+from services.versioning import bump_version
+
+# Labels that get their own counter; anything else is counted as "unknown"
+ROLLUP_LABELS = ['positive', 'neutral', 'negative', 'mixed', 'unknown', 'pending', 'error']
+
+# Labels the summary/trends responses report individually; the rest fold into "unknown"
+REPORTED_LABELS = ['positive', 'neutral', 'negative', 'mixed', 'unknown']
+
+TREND_GRANULARITIES = ['day', 'week', 'month']
+
+def rollup_label(sentiment):
+    return sentiment if sentiment in ROLLUP_LABELS else 'unknown'
+
+
+def day_of(timestamp):
+    # Matches the $dateToString day the trends aggregation used
+    return timestamp.strftime("%Y-%m-%d")
+
+
+def rollup_updates(changes):
+    """
+    Turns (username, timestamp, old_sentiment, new_sentiment) changes into
+    one $inc UpdateOne per (username, day). Pass old_sentiment=None for a new
+    entry and new_sentiment=None for a removed one.
+    """
+    deltas = defaultdict(lambda: defaultdict(int))
+    for username, timestamp, old, new in changes:
+        key = (username, day_of(timestamp))
+        if old is not None:
+            deltas[key][rollup_label(old)] -= 1
+        if new is not None:
+            deltas[key][rollup_label(new)] += 1
+
+    operations = []
+    for (username, day), counts in deltas.items():
+        inc = {f"counts.{label}": n for label, n in counts.items() if n}
+        if inc:
+            operations.append(UpdateOne({"username": username, "day": day}, {"$inc": inc}, upsert=True))
+    return operations
+
+
+def record_sentiment_changes(db, changes):
+    """
+    Applies rollup_updates(changes) in one unordered bulk write.
+    """
+    operations = rollup_updates(changes)
+    if operations:
+        db.sentiment_rollups.bulk_write(operations, ordered=False)
+
+
+def record_sentiment_change(db, username, timestamp, old, new):
+    record_sentiment_changes(db, [(username, timestamp, old, new)])
+
+
+def _count_entries(db, match):
+    """
+    Aggregates raw entries into {(username, day): {label: count}}.
+    """
+    pipeline = [
+        {"$match": match},
+        {"$group": {
+            "_id": {
+                "username": "$username",
+                "day": {"$dateToString": {"format": "%Y-%m-%d", "date": "$timestamp"}},
+                "sentiment": {"$ifNull": ["$sentiment", "unknown"]}
+            },
+            "count": {"$sum": 1}
+        }}
+    ]
+    counts = defaultdict(lambda: defaultdict(int))
+    for item in db.journal_entries.aggregate(pipeline, allowDiskUse=True):
+        key = (item["_id"]["username"], item["_id"]["day"])
+        counts[key][rollup_label(item["_id"]["sentiment"])] += item["count"]
+    return counts
+
+
+def refresh_rollup_days(db, days):
+    """
+    Recounts specific (username, day) pairs from journal_entries. Used when a
+    bulk write could not tell which individual sentiment updates applied.
+    """
+    days = set(days)
+    for username, day in days:
+        start = datetime.strptime(day, "%Y-%m-%d")
+        counts = _count_entries(db, {"username": username, "timestamp": {"$gte": start, "$lt": start + timedelta(days=1)}})
+        db.sentiment_rollups.update_one(
+            {"username": username, "day": day},
+            {"$set": {"counts": dict(counts.get((username, day), {}))}},
+            upsert=True
+        )
+    # The summary and trends ETags are derived from the data version
+    bump_version(db, *(username for username, _ in days))
+
+
+def rebuild_rollups(db, username=None):
+    """
+    Recomputes rollups from journal_entries for one user, or for everyone.
+    Returns the number of (username, day) documents written.
+
+    Writes that land while the rebuild runs can be lost; run it when the
+    counters have drifted, not as part of normal traffic.
+    """
+    match = {"username": username} if username else {}
+    counts = _count_entries(db, match)
+    # Tag every document this run writes so leftover days can be removed afterwards
+    run_id = ObjectId()
+    operations = [
+        UpdateOne({"username": user, "day": day}, {"$set": {"counts": dict(day_counts), "rebuild_id": run_id}}, upsert=True)
+        for (user, day), day_counts in counts.items()
+    ]
+    if operations:
+        db.sentiment_rollups.bulk_write(operations, ordered=False)
+    # Days that no longer have any entries
+    stale = {**match, "rebuild_id": {"$ne": run_id}}
+    emptied = db.sentiment_rollups.distinct("username", stale)
+    db.sentiment_rollups.delete_many(stale)
+
+    # Registered users without entries have nothing to count, but their rollups are complete too
+    users = [username] if username else list({user for user, _ in counts} | set(db.users.distinct("username")))
+    now = datetime.utcnow()
+    for user in users:
+        db.rollup_state.update_one({"_id": user}, {"$set": {"rebuilt_at": now}}, upsert=True)
+    # Cached summary and trends responses hold the old counters
+    bump_version(db, *users, *emptied)
+    return len(operations)
+
+
+def _fold(counts):
+    """
+    Maps rollup counters onto the labels the API reports.
+    """
+    folded = dict.fromkeys(REPORTED_LABELS, 0)
+    for label, count in (counts or {}).items():
+        folded[label if label in folded else 'unknown'] += count
+    return folded
+
+
+def mark_rollups_complete(db, username):
+    """
+    Records a new user as having complete rollups: with no entries yet, the
+    counters maintained from their first write on cover everything.
+    """
+    if db.journal_entries.find_one({"username": username}, {"_id": 1}) is None:
+        db.rollup_state.update_one({"_id": username}, {"$setOnInsert": {"rebuilt_at": None}}, upsert=True)
+
+
+def rollups_complete(db, username):
+    """
+    True if the user's rollups count all of their entries (see rollup_state above).
+    """
+    return db.rollup_state.find_one({"_id": username}, {"_id": 1}) is not None
+
+
+def read_summary(db, username):
+    """
+    Returns the sentiment summary for a user from the rollups, or from their
+    entries if their rollups are not complete yet.
+    """
+    if rollups_complete(db, username):
+        days = (doc.get("counts") for doc in db.sentiment_rollups.find({"username": username}, {"counts": 1, "_id": 0}))
+    else:
+        days = _count_entries(db, {"username": username}).values()
+    summary = dict.fromkeys(REPORTED_LABELS, 0)
+    for counts in days:
+        for label, count in _fold(counts).items():
+            summary[label] += count
+    summary["total"] = sum(summary.values())
+    return summary
+
+
+def _rollup_trends_stages(username, granularity, start, end):
+    """
+    Stages grouping a user's day rollups into periods. The days are server-local dates.
+    """
+    match = {"username": username}
+    if start or end:
+        # "YYYY-MM-DD" strings sort by date
+        match["day"] = {}
+        if start:
+            match["day"]["$gte"] = day_of(start)
+        if end:
+            match["day"]["$lte"] = day_of(end)
+
+    if granularity == "day":
+        period = "$day"
+    elif granularity == "month":
+        period = {"$concat": [{"$substrBytes": ["$day", 0, 7]}, "-01"]}
+    else:
+        period = {"$dateToString": {"format": "%Y-%m-%d", "date": {"$dateTrunc": {
+            "date": {"$dateFromString": {"dateString": "$day", "format": "%Y-%m-%d"}},
+            "unit": granularity, "startOfWeek": "monday"
+        }}}}
+
+    count = {label: {"$ifNull": [f"$counts.{label}", 0]} for label in ROLLUP_LABELS}
+    folded = {label: count[label] for label in REPORTED_LABELS if label != 'unknown'}
+    folded['unknown'] = {"$add": [count[label] for label in ROLLUP_LABELS if label not in folded]}
+    return [
+        {"$match": match},
+        {"$group": {"_id": period, **{label: {"$sum": folded[label]} for label in REPORTED_LABELS}}},
+    ]
+
+
+def _entry_trends_stages(username, granularity, start, end, timezone, server_timezone):
+    """
+    Stages counting a user's entries per period in another time zone than the rollups'.
+    """
+    zone, server_zone = ZoneInfo(timezone), ZoneInfo(server_timezone)
+
+    def server_local(day):
+        # Midnight in the requested zone, as the naive server-local time entries are stored with
+        return datetime.combine(day, time(), zone).astimezone(server_zone).replace(tzinfo=None)
+
+    match = {"username": username}
+    if start or end:
+        match["timestamp"] = {}
+        if start:
+            match["timestamp"]["$gte"] = server_local(start)
+        if end:
+            match["timestamp"]["$lt"] = server_local(end + timedelta(days=1))
+
+    # Stored timestamps are naive server-local times; read them back as instants in server_timezone
+    instant = {"$dateFromString": {
+        "dateString": {"$dateToString": {"format": "%Y-%m-%dT%H:%M:%S.%L", "date": "$timestamp"}},
+        "timezone": server_timezone
+    }}
+    period = {"$dateToString": {"format": "%Y-%m-%d", "timezone": timezone, "date": {"$dateTrunc": {
+        "date": instant, "unit": granularity, "timezone": timezone, "startOfWeek": "monday"
+    }}}}
+
+    labelled = [label for label in REPORTED_LABELS if label != 'unknown']
+    counts = {label: {"$sum": {"$cond": [{"$eq": ["$sentiment", label]}, 1, 0]}} for label in labelled}
+    counts['unknown'] = {"$sum": {"$cond": [{"$in": ["$sentiment", labelled]}, 0, 1]}}
+    return [
+        {"$match": match},
+        {"$group": {"_id": period, **counts}},
+    ]
+
+
+def read_trends(db, username, granularity="day", start=None, end=None, timezone=None,
+                server_timezone="UTC", max_points=None, columnar=False):
+    """
+    Returns a user's sentiment counts per day, week (from Monday) or month,
+    oldest first, for dates start..end (inclusive, either may be None).
+    Periods without entries are left out.
+
+    In the server's time zone the counts come from the day rollups; in any
+    other, or while the user's rollups are not complete, from the entries themselves. With max_points, adjacent periods are
+    merged (and their counts summed) into at most that many points, each
+    dated by its first period. Rows are [{"date", "positive", ...}];
+    columnar=True gives {"dates": [...], "counts": {"positive": [...], ...}}.
+    Everything is computed in one aggregation.
+    """
+    if (timezone is None or timezone == server_timezone) and rollups_complete(db, username):
+        collection = db.sentiment_rollups
+        pipeline = _rollup_trends_stages(username, granularity, start, end)
+    else:
+        collection = db.journal_entries
+        pipeline = _entry_trends_stages(username, granularity, start, end, timezone or server_timezone,
+                                        server_timezone)
+
+    pipeline += [
+        # Days whose counters have all gone back to zero
+        {"$match": {"$or": [{label: {"$gt": 0}} for label in REPORTED_LABELS]}},
+        {"$sort": {"_id": 1}},
+    ]
+    if max_points:
+        pipeline += [
+            {"$bucketAuto": {"groupBy": "$_id", "buckets": max_points,
+                             "output": {label: {"$sum": f"${label}"} for label in REPORTED_LABELS}}},
+            {"$set": {"_id": "$_id.min"}},
+            {"$sort": {"_id": 1}},
+        ]
+    if not columnar:
+        pipeline.append({"$project": {"_id": 0, "date": "$_id", **dict.fromkeys(REPORTED_LABELS, 1)}})
+        return list(collection.aggregate(pipeline))
+
+    pipeline += [
+        {"$group": {"_id": None, "dates": {"$push": "$_id"},
+                    **{label: {"$push": f"${label}"} for label in REPORTED_LABELS}}},
+        {"$project": {"_id": 0, "dates": 1, "counts": {label: f"${label}" for label in REPORTED_LABELS}}},
+    ]
+    result = next(collection.aggregate(pipeline), None)
+    return result or {"dates": [], "counts": {label: [] for label in REPORTED_LABELS}}
@@ -0,0 +1,133 @@
+"""
+Keyword search over a user's journal entries: GET /journal/<username>/search?q=.
+
+Backed by MongoDB's text index on journal_entries (username, text), which
+stems words and ranks matches by textScore, and is kept up to date by MongoDB
+on every insert and update, in every process. Results come best match first,
+with a snippet around the first matching word and the character ranges to
+highlight in it, and are paged by an opaque (score, _id) cursor.
+"""
+import base64
+import json
+import re
+
+from bson.errors import InvalidId
+from bson.objectid import ObjectId
+
+from services.db_services import InvalidCursor, entry_to_json
+
+SNIPPET_CHARS = 160
+MAX_QUERY_CHARS = 200
+
+WORD_RE = re.compile(r"\w+", re.UNICODE)
+# Rough English suffix stripping, so "walking" in a query highlights "walked" the way the text index matches it
+SUFFIX_RE = re.compile(r"(ing|ed|es|ly|s)$")
+
+
+class InvalidQuery(ValueError):
+    """The search parameters cannot be used."""
+
+
+def encode_search_cursor(score, entry_id):
+    raw = json.dumps({"s": score, "i": str(entry_id)}, separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_search_cursor(cursor):
+    """
+    Returns (score, ObjectId) from a cursor made by encode_search_cursor.
+    """
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        data = json.loads(raw)
+        return float(data["s"]), ObjectId(data["i"])
+    except (ValueError, KeyError, TypeError, InvalidId) as e:
+        raise InvalidCursor("Invalid search cursor") from e
+
+
+def stem(word):
+    word = word.lower()
+    if len(word) <= 4:
+        return word
+    if word.endswith("ies"):
+        return word[:-3] + "y"
+    return SUFFIX_RE.sub("", word)
+
+
+def highlight(text, query, width=SNIPPET_CHARS):
+    """
+    Returns (snippet, [[start, end], ...]): up to width characters of text
+    around the first word matching a query term, and the matching words'
+    positions within the snippet.
+    """
+    stems = {stem(word) for word in WORD_RE.findall(query) if word.strip()}
+    matches = [m.span() for m in WORD_RE.finditer(text) if stem(m.group()) in stems]
+    start = 0
+    if matches and len(text) > width:
+        # Open the snippet a little before the first match
+        start = max(0, min(matches[0][0] - width // 4, len(text) - width))
+    end = min(len(text), start + width)
+    snippet = text[start:end]
+    highlights = [[s - start, e - start] for s, e in matches if s >= start and e <= end]
+    if start > 0:
+        snippet = "…" + snippet
+        highlights = [[s + 1, e + 1] for s, e in highlights]
+    if end < len(text):
+        snippet += "…"
+    return snippet, highlights
+
+
+def build_filter(username, query, sentiments=None, start=None, end=None):
+    """
+    Builds the journal_entries $match for a search. start/end are datetimes; end is exclusive.
+    """
+    if not query or not query.strip():
+        raise InvalidQuery("q is required")
+    if len(query) > MAX_QUERY_CHARS:
+        raise InvalidQuery(f"q must be at most {MAX_QUERY_CHARS} characters")
+    match = {"username": username, "$text": {"$search": query}}
+    if sentiments:
+        match["sentiment"] = {"$in": list(sentiments)}
+    if start or end:
+        match["timestamp"] = {}
+        if start:
+            match["timestamp"]["$gte"] = start
+        if end:
+            match["timestamp"]["$lt"] = end
+    return match
+
+
+def search_entries(db, username, query, limit, cursor=None, sentiments=None, start=None, end=None):
+    """
+    Returns (results, next_cursor) for one page of a user's entries matching
+    query, best match first. next_cursor is None on the last page.
+    """
+    pipeline = [
+        {"$match": build_filter(username, query, sentiments, start, end)},
+        {"$addFields": {"score": {"$meta": "textScore"}}},
+    ]
+    if cursor:
+        score, entry_id = decode_search_cursor(cursor)
+        pipeline.append({"$match": {"$or": [
+            {"score": {"$lt": score}},
+            {"score": score, "_id": {"$lt": entry_id}}
+        ]}})
+    pipeline += [
+        # Relevance order cannot come from an index; MongoDB sorts the matches in memory
+        {"$sort": {"score": -1, "_id": -1}},
+        # Fetch one extra document to learn whether another page exists
+        {"$limit": limit + 1},
+        {"$project": {"text": 1, "timestamp": 1, "sentiment": 1, "score": 1}},
+    ]
+    documents = list(db.journal_entries.aggregate(pipeline))
+
+    results = []
+    for entry in documents[:limit]:
+        snippet, highlights = highlight(entry["text"], query)
+        results.append({**entry_to_json(entry), "score": round(entry["score"], 4),
+                        "snippet": snippet, "highlights": highlights})
+    next_cursor = None
+    if len(documents) > limit:
+        last = documents[limit - 1]
+        next_cursor = encode_search_cursor(last["score"], last["_id"])
+    return results, next_cursor
@@ -0,0 +1,286 @@
+"""
+Durable background sentiment classification for journal writes.
+
+POST /journal/<username> stores the entry with sentiment "pending" (unless the
+local classifier is already confident) and puts a job in the sentiment_queue
+collection. Workers lease jobs in batches, classify them with the local tier
+and one multi-entry Gemini prompt for the rest, write the labels back and
+delete the jobs. A job whose lease runs out (e.g. the worker died) becomes claimable
+again, and failed jobs are retried with backoff up to a maximum attempt count.
+A job whose last attempt was abandoned is not claimed again; a periodic sweep
+marks its entry "error" instead.
+"""
+import random
+import threading
+import time
+from datetime import datetime, timedelta
+
+from pymongo import ReturnDocument, UpdateOne
+
+from services.ai_services import GeminiCircuitOpen
+from services.llm_scheduler import PRIORITY_SENTIMENT, llm_request
+from services.local_sentiment import TIER_LLM, classify_tiered
+from services.rollups import day_of, record_sentiment_changes, refresh_rollup_days
+from services.versioning import bump_version
+
+PENDING_SENTIMENT = "pending"
+
+# Set by enqueue_sentiments so in-process workers pick up new jobs without waiting for the next poll
+_wakeup = threading.Event()
+
+
+def enqueue_sentiment(db, entry_id, username):
+    """
+    Queues a journal entry for background sentiment classification.
+    """
+    enqueue_sentiments(db, [(entry_id, username)])
+
+
+def enqueue_sentiments(db, entries):
+    """
+    Queues (entry_id, username) pairs for background sentiment classification in one bulk write.
+    """
+    now = datetime.utcnow()
+    db.sentiment_queue.bulk_write([
+        UpdateOne(
+            {"_id": entry_id},
+            {"$setOnInsert": {
+                "username": username,
+                "attempts": 0,
+                "available_at": now,
+                "lease_expires_at": None,
+                "created_at": now
+            }},
+            upsert=True
+        )
+        for entry_id, username in entries
+    ], ordered=False)
+    _wakeup.set()
+
+
+def claim_jobs(db, limit, lease_seconds, max_attempts):
+    """
+    Atomically leases up to `limit` jobs that are due, not leased by a live
+    worker and have attempts left.
+    """
+    jobs = []
+    for _ in range(limit):
+        now = datetime.utcnow()
+        job = db.sentiment_queue.find_one_and_update(
+            {
+                "available_at": {"$lte": now},
+                "attempts": {"$lt": max_attempts},
+                "$or": [{"lease_expires_at": None}, {"lease_expires_at": {"$lt": now}}]
+            },
+            {
+                "$set": {"lease_expires_at": now + timedelta(seconds=lease_seconds)},
+                "$inc": {"attempts": 1}
+            },
+            sort=[("available_at", 1)],
+            return_document=ReturnDocument.AFTER
+        )
+        if job is None:
+            break
+        jobs.append(job)
+    return jobs
+
+
+def process_jobs(db, jobs, max_attempts, local_threshold=None):
+    """
+    Classifies the entries behind a batch of leased jobs and writes the results.
+    local_threshold is passed to classify_tiered (None sends everything to Gemini).
+    Returns the number of entries whose sentiment was written.
+    """
+    job_ids = [job["_id"] for job in jobs]
+    entries = {
+        entry["_id"]: entry
+        for entry in db.journal_entries.find({"_id": {"$in": job_ids}}, {"text": 1, "username": 1, "timestamp": 1})
+    }
+    # Entries deleted since they were queued have nothing left to classify
+    missing = [job_id for job_id in job_ids if job_id not in entries]
+    if missing:
+        db.sentiment_queue.delete_many({"_id": {"$in": missing}})
+    jobs = [job for job in jobs if job["_id"] in entries]
+    # Entries stored before text was validated may hold something else; they cannot be classified
+    invalid = [job["_id"] for job in jobs if not isinstance(entries[job["_id"]].get("text"), str)]
+    if invalid:
+        _fail(db, invalid, entries)
+        jobs = [job for job in jobs if job["_id"] not in invalid]
+    if not jobs:
+        return 0
+
+    try:
+        # A batch mixes users, so it is attributed to none
+        with llm_request(None, PRIORITY_SENTIMENT):
+            results = classify_tiered(db, [entries[job["_id"]]["text"] for job in jobs], local_threshold)
+    except GeminiCircuitOpen as e:
+        # Gemini is known to be down; wait for the breaker without using up attempts
+        print(f"Sentiment worker: {e}; postponing {len(jobs)} job(s)")
+        _postpone(db, jobs, e.retry_after)
+        return 0
+    except Exception as e:
+        # Not only Gemini: a Mongo error or a failing local model must use up attempts too
+        print(f"Sentiment worker: batch of {len(jobs)} failed: {e}")
+        _reschedule_or_fail(db, jobs, entries, max_attempts)
+        return 0
+
+    _set_pending_sentiments(db, [(entries[job["_id"]], label, tier) for job, (label, tier) in zip(jobs, results)])
+    db.sentiment_queue.delete_many({"_id": {"$in": [job["_id"] for job in jobs]}})
+    return len(jobs)
+
+
+def _set_pending_sentiments(db, results):
+    """
+    Writes (entry, label, tier) results for entries that are still pending and
+    keeps the sentiment rollups in step.
+    """
+    now = datetime.utcnow()
+    result = db.journal_entries.bulk_write([
+        UpdateOne({"_id": entry["_id"], "sentiment": PENDING_SENTIMENT},
+                  {"$set": {"sentiment": label, "sentiment_tier": tier, "updated_at": now}})
+        for entry, label, tier in results
+    ], ordered=False)
+    if result.modified_count == len(results):
+        record_sentiment_changes(db, [
+            (entry["username"], entry["timestamp"], PENDING_SENTIMENT, label) for entry, label, _ in results
+        ])
+    else:
+        # Some entries changed under us; recount the affected days instead of guessing
+        refresh_rollup_days(db, [(entry["username"], day_of(entry["timestamp"])) for entry, _, _ in results])
+    bump_version(db, *(entry["username"] for entry, _, _ in results))
+
+
+def _postpone(db, jobs, seconds):
+    """
+    Releases leased jobs until `seconds` from now (plus jitter), refunding the claim's attempt.
+    """
+    now = datetime.utcnow()
+    db.sentiment_queue.bulk_write([
+        UpdateOne({"_id": job["_id"]}, {
+            "$set": {"lease_expires_at": None,
+                     "available_at": now + timedelta(seconds=seconds + random.uniform(0, 2))},
+            "$inc": {"attempts": -1}
+        })
+        for job in jobs
+    ], ordered=False)
+
+
+def _fail(db, job_ids, entries):
+    """
+    Gives up on jobs: their entries get the sentiment "error" and the jobs are deleted.
+    """
+    # Same outcome the synchronous path had when Gemini failed
+    results = [(entries[job_id], "error", TIER_LLM) for job_id in job_ids if job_id in entries]
+    if results:
+        _set_pending_sentiments(db, results)
+    db.sentiment_queue.delete_many({"_id": {"$in": job_ids}})
+
+
+def fail_abandoned_jobs(db, max_attempts, limit=100):
+    """
+    Gives up on jobs whose last attempt's lease ran out (the worker died or
+    crashed mid-batch), which claim_jobs() no longer hands out. Returns how many.
+    """
+    now = datetime.utcnow()
+    job_ids = [job["_id"] for job in db.sentiment_queue.find(
+        {"attempts": {"$gte": max_attempts}, "$or": [{"lease_expires_at": None}, {"lease_expires_at": {"$lt": now}}]},
+        {"_id": 1}
+    ).limit(limit)]
+    if job_ids:
+        entries = {entry["_id"]: entry for entry in
+                   db.journal_entries.find({"_id": {"$in": job_ids}}, {"username": 1, "timestamp": 1})}
+        _fail(db, job_ids, entries)
+    return len(job_ids)
+
+
+def _reschedule_or_fail(db, jobs, entries, max_attempts):
+    now = datetime.utcnow()
+    exhausted = [job["_id"] for job in jobs if job["attempts"] >= max_attempts]
+    if exhausted:
+        _fail(db, exhausted, entries)
+
+    retry = [job for job in jobs if job["attempts"] < max_attempts]
+    if retry:
+        db.sentiment_queue.bulk_write([
+            UpdateOne({"_id": job["_id"]}, {"$set": {
+                "lease_expires_at": None,
+                # Exponential backoff with jitter: ~2s, 4s, 8s, ... capped at 5 minutes
+                "available_at": now + timedelta(seconds=min(300, 2 ** job["attempts"]) * random.uniform(0.5, 1.0))
+            }})
+            for job in retry
+        ], ordered=False)
+
+
+class SentimentWorkerPool:
+    """
+    A small pool of daemon threads draining the sentiment queue.
+    """
+
+    def __init__(self, db, threads=2, batch_size=8, max_attempts=5, lease_seconds=60, poll_interval=2.0,
+                 local_threshold=None):
+        self.db = db
+        self.threads = threads
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.lease_seconds = lease_seconds
+        self.poll_interval = poll_interval
+        self.local_threshold = local_threshold
+        self._next_sweep = 0.0
+        self._sweep_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._threads = []
+
+    def sweep_if_due(self):
+        with self._sweep_lock:
+            if time.monotonic() < self._next_sweep:
+                return
+            # Abandoned jobs only appear when a lease runs out
+            self._next_sweep = time.monotonic() + self.lease_seconds
+        failed = fail_abandoned_jobs(self.db, self.max_attempts)
+        if failed:
+            print(f"Sentiment worker: gave up on {failed} job(s) whose last attempt was abandoned")
+
+    def run_once(self):
+        """
+        Claims and processes one batch. Returns the number of jobs claimed.
+        """
+        self.sweep_if_due()
+        jobs = claim_jobs(self.db, self.batch_size, self.lease_seconds, self.max_attempts)
+        if jobs:
+            process_jobs(self.db, jobs, self.max_attempts, self.local_threshold)
+        return len(jobs)
+
+    def _loop(self):
+        while not self._stop.is_set():
+            try:
+                claimed = self.run_once()
+            except Exception as e:
+                print(f"Sentiment worker error: {e}")
+                claimed = 0
+            if not claimed:
+                _wakeup.wait(self.poll_interval)
+                _wakeup.clear()
+
+    def start(self):
+        for i in range(self.threads):
+            thread = threading.Thread(target=self._loop, name=f"sentiment-worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        print(f"Started {self.threads} sentiment worker thread(s)")
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        _wakeup.set()
+        for thread in self._threads:
+            thread.join(timeout)
+
+    def run_forever(self):
+        """
+        Runs the pool in the foreground, e.g. from a dedicated worker process.
+        """
+        self.start()
+        try:
+            while any(thread.is_alive() for thread in self._threads):
+                time.sleep(1)
+        except KeyboardInterrupt:
+            self.stop(timeout=self.lease_seconds)
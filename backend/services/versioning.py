@@ -0,0 +1,67 @@
+"""
+Per-user data versions for conditional GETs.
+
+Every write that changes what a user's journal routes return bumps a counter
+in the data_versions collection. The GET routes derive their ETag from that
+counter, so a client revalidating with If-None-Match gets a 304 after a
+single _id lookup, without journal_entries being queried at all.
+"""
+import hashlib
+from functools import wraps
+
+from flask import make_response, request
+
+
+def bump_version(db, *usernames, entries=False):
+    """
+    Marks each user's journal data as changed. Pass entries=True for writes
+    that add entries or change their text, which also bumps entries_version.
+    """
+    inc = {"version": 1, "entries_version": 1} if entries else {"version": 1}
+    for username in set(usernames):
+        db.data_versions.update_one({"_id": username}, {"$inc": inc}, upsert=True)
+
+
+def get_version(db, username, field="version"):
+    doc = db.data_versions.find_one({"_id": username}, {field: 1})
+    return doc.get(field, 0) if doc else 0
+
+
+def make_etag(version):
+    """
+    Builds an ETag for the current request: the user's data version plus a
+    digest of the path and query string, since each route and page differs.
+    """
+    variant = hashlib.sha1(request.full_path.encode('utf-8')).hexdigest()[:16]
+    return f"{version}.{variant}"
+
+
+def conditional_on_user_version(get_db):
+    """
+    Decorator for GET views taking a username: answers If-None-Match with 304
+    when the user's data version is unchanged, and tags fresh 200 responses
+    with an ETag. get_db returns the database handle (or None).
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(username, *args, **kwargs):
+            db = get_db()
+            if db is None:
+                return view(username, *args, **kwargs)
+
+            # Read the version before the data: a write landing in between
+            # yields newer data under an older ETag, which only costs a refetch
+            etag = make_etag(get_version(db, username))
+            if request.if_none_match.contains(etag):
+                response = make_response('', 304)
+                response.set_etag(etag)
+                return response
+
+            response = make_response(view(username, *args, **kwargs))
+            if response.status_code == 200:
+                response.set_etag(etag)
+                # Let browsers keep the body but revalidate on every use
+                response.headers['Cache-Control'] = 'private, no-cache'
+            return response
+        return wrapper
+    return decorator
@@ -91,7 +91,7 @@ function App() {
       setLoadingEntries(true);
       setErrorEntries(null);
       try {
-        const response = await fetch(`https://mindease-nxnw.onrender.com/journal/${loggedInUser}`);
+        const response = await fetch(`https://mindease-nxnw.onrender.com/journal/${loggedInUser}?all=true`);
         if (!response.ok) {
           throw new Error(`HTTP error! status: ${response.status}`);
         }